@@ -14,11 +14,6 @@ sudo apt install -y \
 	libtiff-dev \
 	python3-pil.imagetk \
 	python3-pip
-if ! sudo apt install -y python3-colormath
-then
-	pip3 install --upgrade pip
-	pip3 install --upgrade colormath
-fi
 
 mkdir dcamprof
 cd dcamprof
@@ -27,25 +27,72 @@
 # Application name: Coloric
 # Application allows easily build DCP profile for defined target and illuminant.
 ###############################################################
-import tkinter as tk
-from tkinter import *  
-from tkinter import filedialog
-from tkinter import messagebox
+import time
+STARTUP_TIME = time.perf_counter()
 import math
-from PIL import Image, ImageTk
-from colormath.color_objects import sRGBColor,LabColor, XYZColor
-from colormath.color_conversions import convert_color
 import datetime
 import os
 import sys, getopt
 import json
 import shutil
 import threading
-import time
+import queue
+import importlib
+import struct
+import hashlib
+import mmap
 from enum import Enum
-import cv2
 import numpy as np
+import coloric_color
+import coloric_dcp
 
+# Startup time measurement and lazy imports
+#---------------------------------------------------
+class CStartupTimer():
+    def __init__(self):
+        self.marks = [("python imports", time.perf_counter())]
+        self.enabled = False
+        self.budget = 1000
+    def Mark(self, name):
+        self.marks.append((name, time.perf_counter()))
+    def Elapsed(self, name):
+        for mark, timestamp in self.marks:
+            if mark == name:
+                return (timestamp - STARTUP_TIME) * 1000
+        return None
+    def Report(self):
+        if self.enabled == False:
+            return
+        previous = STARTUP_TIME
+        for name, timestamp in self.marks:
+            print("startup: {:<28} {:>9.1f} ms {:>9.1f} ms".format(name, (timestamp - previous) * 1000, (timestamp - STARTUP_TIME) * 1000))
+            previous = timestamp
+        first_window = self.Elapsed("first window")
+        if first_window != None:
+            print("startup: time to first window {:.1f} ms, budget {} ms, {}".format(first_window, self.budget, "ok" if first_window <= self.budget else "over budget"))
+
+startup = CStartupTimer()
+
+class CLazyModule():
+    #module is imported on first attribute access
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+    def __getattr__(self, attr):
+        if self.module == None:
+            start = time.perf_counter()
+            self.module = importlib.import_module(self.name)
+            startup.Mark("import {} ({:.1f} ms)".format(self.name, (time.perf_counter() - start) * 1000))
+        return getattr(self.module, attr)
+
+cv2 = CLazyModule("cv2")
+
+#GUI modules are imported by ImportGui(), batch mode and library use don't need a display
+tk = None
+filedialog = None
+messagebox = None
+Image = None
+ImageTk = None
 
 # Structures and Classes
 #---------------------------------------------------
@@ -92,23 +139,24 @@ class CGrid:
         self.rb_circle = None
         self.lb_circle = None 
         self.start_point = 0
+    def create_objects(self, canvas, line_width):
+        for corner in [self.lt_frame_corner, self.rt_frame_corner, self.rb_frame_corner, self.lb_frame_corner]:
+            corner.line1 = canvas.create_line(0, 0, 0, 0, fill="white", width=line_width, dash=(3,5), tags=("grid",))
+            corner.line2 = canvas.create_line(0, 0, 0, 0, fill="white", width=line_width, dash=(3,5), tags=("grid",))
+        self.lt_circle = canvas.create_oval(0, 0, 0, 0, outline="red", dash=(3,5), tags=("grid",))
+        self.rt_circle = canvas.create_oval(0, 0, 0, 0, outline="red", dash=(3,5), tags=("grid",))
+        self.rb_circle = canvas.create_oval(0, 0, 0, 0, outline="red", dash=(3,5), tags=("grid",))
+        self.lb_circle = canvas.create_oval(0, 0, 0, 0, outline="red", dash=(3,5), tags=("grid",))
+    def has_objects(self):
+        return self.lt_circle != None
     def delete_objects(self, canvas):
-        if self.lt_frame_corner.line1 != None:
-            canvas.delete(self.lt_frame_corner.line1)  
-        if self.lt_frame_corner.line2 != None:
-            canvas.delete(self.lt_frame_corner.line2) 
-        if self.rt_frame_corner.line1 != None:
-            canvas.delete(self.rt_frame_corner.line1)  
-        if self.rt_frame_corner.line2 != None:
-            canvas.delete(self.rt_frame_corner.line2) 
-        if self.rb_frame_corner.line1 != None:
-            canvas.delete(self.rb_frame_corner.line1)  
-        if self.rb_frame_corner.line2 != None:
-            canvas.delete(self.rb_frame_corner.line2) 
-        if self.lb_frame_corner.line1 != None:
-            canvas.delete(self.lb_frame_corner.line1)  
-        if self.lb_frame_corner.line2 != None:
-            canvas.delete(self.lb_frame_corner.line2) 
+        for corner in [self.lt_frame_corner, self.rt_frame_corner, self.rb_frame_corner, self.lb_frame_corner]:
+            if corner.line1 != None:
+                canvas.delete(corner.line1)
+                corner.line1 = None
+            if corner.line2 != None:
+                canvas.delete(corner.line2)
+                corner.line2 = None
         if self.lt_circle != None:
             canvas.delete(self.lt_circle)  
         if self.rt_circle != None:
@@ -116,7 +164,11 @@ class CGrid:
         if self.rb_circle != None:
             canvas.delete(self.rb_circle)  
         if self.lb_circle != None:
-            canvas.delete(self.lb_circle)                                    
+            canvas.delete(self.lb_circle)
+        self.lt_circle = None
+        self.rt_circle = None
+        self.rb_circle = None
+        self.lb_circle = None
 
 class CSpace_enum(Enum):
     C_XYZ = 0,
@@ -128,10 +180,41 @@ class CGridPatches:
         self.columns = cht.columns
         self.rows = cht.rows
         self.number_patches = self.columns * self.rows  
-        self.patches = [CTetragonPoints() for i in range(self.number_patches)]  
+        #patch corners (lt, rt, rb, lb) relative to fiducial frame, grid order
+        self.corners = np.zeros((self.number_patches, 4, 2))
         self.patches_lines = [CTetragonLines() for i in range(self.number_patches)]
         self.patches_triangles = [None for i in range(self.number_patches)]
         self.patches_colors = [] 
+        self.drawn_colors = [None for i in range(self.number_patches)]
+        self.patches_text = [None for i in range(self.number_patches)]
+        self.summary_text = None
+    def create_objects(self, canvas, line_width):
+        self.summary_text = canvas.create_text(0, 0, text="", fill="yellow", anchor="nw", tags=("grid",))
+        for i in range(self.number_patches):
+            self.patches_lines[i].top = canvas.create_line(0, 0, 0, 0, fill="white", width=line_width, dash=(3,5), tags=("grid",))
+            self.patches_lines[i].right = canvas.create_line(0, 0, 0, 0, fill="white", width=line_width, dash=(3,5), tags=("grid",))
+            self.patches_lines[i].bottom = canvas.create_line(0, 0, 0, 0, fill="white", width=line_width, dash=(3,5), tags=("grid",))
+            self.patches_lines[i].left = canvas.create_line(0, 0, 0, 0, fill="white", width=line_width, dash=(3,5), tags=("grid",))
+            self.patches_triangles[i] = canvas.create_polygon(0, 0, 0, 0, 0, 0, tags=("grid",))
+            self.patches_text[i] = canvas.create_text(0, 0, text="", fill="yellow", justify="center", tags=("grid",))
+            self.drawn_colors[i] = None
+    def has_objects(self):
+        return self.number_patches == 0 or self.patches_triangles[0] != None
+    def delete_objects(self, canvas):
+        for i in range(self.number_patches):
+            for line in [self.patches_lines[i].top, self.patches_lines[i].right, self.patches_lines[i].bottom, self.patches_lines[i].left]:
+                if line != None:
+                    canvas.delete(line)
+            if self.patches_triangles[i] != None:
+                canvas.delete(self.patches_triangles[i])
+            if self.patches_text[i] != None:
+                canvas.delete(self.patches_text[i])
+            self.patches_lines[i] = CTetragonLines()
+            self.patches_triangles[i] = None
+            self.patches_text[i] = None
+        if self.summary_text != None:
+            canvas.delete(self.summary_text)
+            self.summary_text = None
     def ColorCheckerPatches(self, cht):
         step_x = cht.xi / cht.grid_width
         step_y = cht.yi / cht.grid_height
@@ -139,16 +222,10 @@ class CGridPatches:
         patch_height = (cht.h - 2 * cht.shrink) / (2 * cht.grid_height)
         c_offs_x = (cht.x0 - cht.feducials.lt.x + cht.w / 2) / cht.grid_width
         c_offs_y = (cht.y0 - cht.feducials.lt.y + cht.h / 2) / cht.grid_height
-        for y in range(self.rows):
-            for x in range(self.columns):
-                self.patches[y * self.columns + x].lt.x = c_offs_x + step_x * x - patch_width
-                self.patches[y * self.columns + x].lt.y = c_offs_y + step_y * y - patch_height
-                self.patches[y * self.columns + x].rt.x = c_offs_x + step_x * x + patch_width
-                self.patches[y * self.columns + x].rt.y = c_offs_y + step_y * y - patch_height
-                self.patches[y * self.columns + x].rb.x = c_offs_x + step_x * x + patch_width
-                self.patches[y * self.columns + x].rb.y = c_offs_y + step_y * y + patch_height
-                self.patches[y * self.columns + x].lb.x = c_offs_x + step_x * x - patch_width
-                self.patches[y * self.columns + x].lb.y = c_offs_y + step_y * y + patch_height
+        y, x = np.mgrid[0:self.rows, 0:self.columns]
+        centers = np.stack([c_offs_x + step_x * x.ravel(), c_offs_y + step_y * y.ravel()], axis=-1)
+        offsets = np.array([[-patch_width, -patch_height], [patch_width, -patch_height], [patch_width, patch_height], [-patch_width, patch_height]])
+        self.corners = centers[:, None, :] + offsets[None, :, :]
 
 class Ccht:
     def __init__(self):
@@ -158,6 +235,12 @@ class Ccht:
         self.number_of_patches = 0
         self.shrink = 1.0
         self.patches_rgb = []
+        self.patches_id = []
+        self.patches_reference = []
+        self.cht_file = None
+        self.cie_file = None
+        self.cie_names = []
+        self.cie_reference = []
         self.grid_patches = None
         self.w = 0
         self.h = 0
@@ -168,116 +251,375 @@ class Ccht:
         self.grid_width = 0
         self.grid_height = 0
         self.feducials = CTetragonPoints()
-    def Open_cht(self, filename):
+    def CieFile(self, filename):
+        #.cie file from configuration or next to .cht file
+        if app.config.input_cie_file != "":
+            return app.config.input_cie_file
+        return "{}cie".format(filename[:-3])
+    def IsOpened(self, filename, cie_file=None):
+        if cie_file == None:
+            cie_file = self.CieFile(filename)
+        return self.grid_patches != None and self.cht_file == filename and self.cie_file == cie_file
+    def Open_cht(self, filename, cie_file=None):
+        #compiled chart is loaded from target library if .cht and .cie files have not changed
+        if cie_file == None:
+            cie_file = self.CieFile(filename)
         try:
-            with open(filename,"r") as cht:
-                #searching for BOXES  
-                expected = False 
-                columns = 1
-                rows = 1
-                boxes = False
-                x_or_y = False 
-                for line in cht:
-                    if len(line) <= 1: continue 
-                    
-                    if line.find("BOXES") > -1:
-                        boxes = True
-                    if boxes:    
-                        T = line.split()
-                        if len(T) == 0:
-                            continue
-                        xy = False
-                        if T[0] == "F":
-                            #fiducials as T[3],...T[10]
-                            self.feducials.lt.x = float(T[3])
-                            self.feducials.lt.y = float(T[4])
-                            self.feducials.rt.x = float(T[5])
-                            self.feducials.rt.y = float(T[6])
-                            self.feducials.rb.x = float(T[7])
-                            self.feducials.rb.y = float(T[8])
-                            self.feducials.lb.x = float(T[9])
-                            self.feducials.lb.y = float(T[10])
-                            self.grid_width = math.sqrt((float(T[5]) - float(T[3])) * (float(T[5]) - float(T[3])) + (float(T[6]) - float(T[4])) * (float(T[6]) - float(T[4])))
-                            self.grid_height = math.sqrt((float(T[9]) - float(T[3])) * (float(T[9]) - float(T[3])) + (float(T[10]) - float(T[4])) * (float(T[10]) - float(T[4])))
-                        elif T[0] == "X" and len(T[2]) == 1:
-                            #tweezers, should be added parsing
-                            self.rows = int(T[4])
-                            self.columns = ord(T[2]) - 64
-                            x_or_y = True
-                            xy = True
-                        elif T[0] == "Y" and len(T[4]) == 1:
-                            #tweezers, should be added parsing
-                            self.columns = int(T[2])
-                            self.rows = ord(T[4]) - 64
-                            x_or_y = False
-                            xy = True
-                        else:
-                            #"Parse error"
-                            pass
-                        if xy:
-                            self.w = float(T[5])
-                            self.h = float(T[6])
-                            self.x0 = float(T[7])
-                            self.y0 = float(T[8])
-                            self.xi = float(T[9])
-                            self.yi = float(T[10])   
-                    #searching for BOX_SHRINK    
-                    if line.find("BOX_SHRINK") > -1:
-                        self.shrink = float(line.split()[1])
-                    #searching for EXPECTED    
-                    if line.find("EXPECTED") > -1:
-                        T = line.split()
-                        if T[1] == "XYZ":
-                            self.space = CSpace_enum.C_XYZ
-                        if T[1] == "LAB":
-                            self.space = CSpace_enum.C_LAB 
-                        self.number_of_patches = int(T[2])  
-                        self.patches_rgb.clear()
-                        self.patches_rgb = [[0.0, 0.0, 0.0] for i in range(self.columns * self.rows)] 
-                        expected = True 
-                    #print(expected , self.columns , self.rows , self.number_of_patches, self.number_of_patches == (self.columns * self.rows))    
-                    if expected and self.columns and self.rows:
-                        T = line.split()
+            key = app.targets.Key(filename, cie_file)
+            if app.targets.Load(self, key) == 1:
+                self.Parse_cht(filename)
+                self.Read_cie(cie_file)
+                app.targets.Save(self, key)
+            self.cht_file = filename
+            self.cie_file = cie_file
+        except OSError as error: 
+            ShowWarning(error)
+            return 1
+        self.Create_grid_patches()
+        return 0
+    def Parse_cht(self, filename):
+        with open(filename,"r") as cht:
+            #searching for BOXES  
+            expected = False 
+            columns = 1
+            rows = 1
+            boxes = False
+            x_or_y = False 
+            for line in cht:
+                if len(line) <= 1: continue 
+                
+                if line.find("BOXES") > -1:
+                    boxes = True
+                if boxes:    
+                    T = line.split()
+                    if len(T) == 0:
+                        continue
+                    xy = False
+                    if T[0] == "F":
+                        #fiducials as T[3],...T[10]
+                        self.feducials.lt.x = float(T[3])
+                        self.feducials.lt.y = float(T[4])
+                        self.feducials.rt.x = float(T[5])
+                        self.feducials.rt.y = float(T[6])
+                        self.feducials.rb.x = float(T[7])
+                        self.feducials.rb.y = float(T[8])
+                        self.feducials.lb.x = float(T[9])
+                        self.feducials.lb.y = float(T[10])
+                        self.grid_width = math.sqrt((float(T[5]) - float(T[3])) * (float(T[5]) - float(T[3])) + (float(T[6]) - float(T[4])) * (float(T[6]) - float(T[4])))
+                        self.grid_height = math.sqrt((float(T[9]) - float(T[3])) * (float(T[9]) - float(T[3])) + (float(T[10]) - float(T[4])) * (float(T[10]) - float(T[4])))
+                    elif T[0] == "X" and len(T[2]) == 1:
+                        #tweezers, should be added parsing
+                        self.rows = int(T[4])
+                        self.columns = ord(T[2]) - 64
+                        x_or_y = True
+                        xy = True
+                    elif T[0] == "Y" and len(T[4]) == 1:
+                        #tweezers, should be added parsing
+                        self.columns = int(T[2])
+                        self.rows = ord(T[4]) - 64
+                        x_or_y = False
+                        xy = True
+                    else:
+                        #"Parse error"
+                        pass
+                    if xy:
+                        self.w = float(T[5])
+                        self.h = float(T[6])
+                        self.x0 = float(T[7])
+                        self.y0 = float(T[8])
+                        self.xi = float(T[9])
+                        self.yi = float(T[10])   
+                #searching for BOX_SHRINK    
+                if line.find("BOX_SHRINK") > -1:
+                    self.shrink = float(line.split()[1])
+                #searching for EXPECTED    
+                if line.find("EXPECTED") > -1:
+                    T = line.split()
+                    if T[1] == "XYZ":
+                        self.space = CSpace_enum.C_XYZ
+                    if T[1] == "LAB":
+                        self.space = CSpace_enum.C_LAB 
+                    self.number_of_patches = int(T[2])  
+                    self.patches_rgb.clear()
+                    self.patches_rgb = [[0.0, 0.0, 0.0] for i in range(self.columns * self.rows)] 
+                    self.patches_id = ["" for i in range(self.columns * self.rows)]
+                    self.patches_reference = [[0.0, 0.0, 0.0] for i in range(self.columns * self.rows)]
+                    expected = True 
+                #print(expected , self.columns , self.rows , self.number_of_patches, self.number_of_patches == (self.columns * self.rows))    
+                if expected and self.columns and self.rows:
+                    T = line.split()
+                    if x_or_y:
+                        s = chr(65 + (columns - 1)) + str(rows)
+                    else:    
+                        s = chr(65 + (rows - 1)) + str(columns)
+                    #print(T[0], s, columns, rows, self.columns, self.rows)
+                    #patch numbers may be zero padded, e.g. A01 in IT8 charts
+                    if T[0] == s or (T[0][0:1] == s[0] and T[0][1:].isdigit() and int(T[0][1:]) == int(s[1:])):
+                        color_found = True
+                        self.patches_id[(rows - 1) * self.columns + (columns - 1)] = T[0]
+                        self.patches_reference[(rows - 1) * self.columns + (columns - 1)] = [float(T[1]), float(T[2]), float(T[3])]
                         if x_or_y:
-                            s = chr(65 + (columns - 1)) + str(rows)
-                        else:    
-                            s = chr(65 + (rows - 1)) + str(columns)
-                        #print(T[0], s, columns, rows, self.columns, self.rows)
-                        if T[0] == s:
-                            color_found = True
-                            if self.space == CSpace_enum.C_XYZ:
-                                space = XYZColor(*[component/100 for component in [float(T[1]), float(T[2]), float(T[3])]])
-                            else:
-                                space = LABColor(*[component/100 for component in [float(T[1]), float(T[2]), float(T[3])]])    
-                            rgb = convert_color(space, sRGBColor)
-                            rgb_list = [255*color for color in rgb.get_value_tuple()]
-                            self.patches_rgb[(rows - 1) * self.columns + (columns - 1)] = rgb_list
-                            if x_or_y:
-                                rows += 1
-                                if rows > self.rows:
-                                    rows = 1
-                                    columns += 1
-                            else:
+                            rows += 1
+                            if rows > self.rows:
+                                rows = 1
                                 columns += 1
-                                if columns > self.columns:
-                                    columns = 1
-                                    rows += 1  
-            if self.grid_patches != None: 
-                del self.grid_patches
-            if  self.columns and self.rows:   
-                self.grid_patches = CGridPatches(self)
-                self.grid_patches.ColorCheckerPatches(self)
-                for i in range(self.columns * self.rows):
-                    if len(self.patches_rgb) == 0:
-                        l = "#FFFFFF" 
-                    else:    
-                        l = "#{}{}{}".format(hex(min(255, int(self.patches_rgb[i][0]))).lstrip("0x").zfill(2).upper(), hex(min(255, int(self.patches_rgb[i][1]))).lstrip("0x").zfill(2).upper(), hex(min(255, int(self.patches_rgb[i][2]))).lstrip("0x").zfill(2).upper())
-                    self.grid_patches.patches_colors.append(l)
-            return 0        
-        except OSError as error: 
-            messagebox.showwarning(title='Error', message=error)
+                        else:
+                            columns += 1
+                            if columns > self.columns:
+                                columns = 1
+                                rows += 1  
+        #preview colors of all patches are converted at once
+        if len(self.patches_reference) > 0:
+            reference = np.array(self.patches_reference)
+            if self.space == CSpace_enum.C_LAB:
+                self.patches_rgb = (coloric_color.LabToSRGB(reference) * 255).tolist()
+            else:
+                self.patches_rgb = (coloric_color.XYZToSRGB(reference / 100) * 255).tolist()
+    def Create_grid_patches(self):
+        if self.grid_patches != None: 
+            del self.grid_patches
+        if  self.columns and self.rows:   
+            self.grid_patches = CGridPatches(self)
+            self.grid_patches.ColorCheckerPatches(self)
+            for i in range(self.columns * self.rows):
+                if len(self.patches_rgb) == 0:
+                    l = "#FFFFFF" 
+                else:    
+                    l = "#{:02X}{:02X}{:02X}".format(*[min(255, max(0, int(component))) for component in self.patches_rgb[i]])
+                self.grid_patches.patches_colors.append(l)
+    def Read_cie(self, cie_file):
+        #reference values of patches in .cht order, .cht values are used
+        #for patches missing in .cie file or if there is no .cie file
+        self.cie_file = cie_file
+        self.cie_names = ["LAB_L", "LAB_A", "LAB_B"] if self.space == CSpace_enum.C_LAB else ["XYZ_X", "XYZ_Y", "XYZ_Z"]
+        self.cie_reference = [list(values) for values in self.patches_reference]
+        if cie_file == "" or os.path.exists(cie_file) == False:
+            return
+        fields, rows = coloric_color.ReadCgatsFile(cie_file)
+        if "XYZ_X" in fields:
+            names = ["XYZ_X", "XYZ_Y", "XYZ_Z"]
+        elif "LAB_L" in fields:
+            names = ["LAB_L", "LAB_A", "LAB_B"]
+        else:
+            return
+        try:
+            key = fields.index("SAMPLE_LOC") if "SAMPLE_LOC" in fields else fields.index("SAMPLE_ID")
+            columns = [fields.index(name) for name in names]
+            measured = {row[key]: [float(row[column]) for column in columns] for row in rows}
+        except (ValueError, IndexError):
+            ShowWarning('Unable to parse .cie file')
+            return
+        self.cie_names = names
+        self.cie_reference = [measured.get(patch_id, values) for patch_id, values in zip(self.patches_id, self.cie_reference)]
+
+class CTargetLibrary():
+    #compiled .cht/.cie pairs cached in binary files named by hash of
+    #their content: json header with scalars and patch names followed
+    #by raw float64 arrays
+    MAGIC = b"CTLB"
+    VERSION = 2
+    SCALARS = ["columns", "rows", "number_of_patches", "shrink", "w", "h", "x0", "y0", "xi", "yi", "grid_width", "grid_height", "patches_id", "cie_names"]
+    ARRAYS = ["patches_reference", "patches_rgb", "cie_reference"]
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+    def Key(self, cht_file, cie_file):
+        digest = hashlib.sha256(struct.pack("<I", self.VERSION))
+        with open(cht_file, "rb") as f:
+            digest.update(f.read())
+        if cie_file != "" and os.path.exists(cie_file):
+            with open(cie_file, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+    def Path(self, key):
+        return os.path.join(app.config.target_cache_directory, key + ".ctl")
+    def Load(self, cht, key):
+        if app.config.target_cache_directory == "":
+            return 1
+        try:
+            with open(self.Path(key), "rb") as f:
+                blob = f.read()
+            magic, version, length = struct.unpack_from("<4sII", blob)
+            if magic != self.MAGIC or version != self.VERSION:
+                return 1
+            header = json.loads(blob[12:12 + length].decode("utf-8"))
+            offset = 12 + length
+            for name in self.SCALARS:
+                setattr(cht, name, header[name])
+            cht.space = CSpace_enum[header["space"]] if header["space"] != "" else 0
+            fiducials = np.frombuffer(blob, dtype="<f8", count=8, offset=offset)
+            tetra = cht.feducials
+            tetra.lt.x, tetra.lt.y, tetra.rt.x, tetra.rt.y, tetra.rb.x, tetra.rb.y, tetra.lb.x, tetra.lb.y = fiducials.tolist()
+            offset += fiducials.nbytes
+            for name in self.ARRAYS:
+                array = np.frombuffer(blob, dtype="<f8", count=header[name] * 3, offset=offset)
+                setattr(cht, name, array.reshape(-1, 3).tolist())
+                offset += array.nbytes
+        except (OSError, ValueError, KeyError, struct.error):
+            self.misses += 1
+            return 1
+        self.hits += 1
+        return 0
+    def Save(self, cht, key):
+        if app.config.target_cache_directory == "":
+            return 1
+        header = {name: getattr(cht, name) for name in self.SCALARS}
+        header["space"] = cht.space.name if isinstance(cht.space, CSpace_enum) else ""
+        tetra = cht.feducials
+        data = [np.array([tetra.lt.x, tetra.lt.y, tetra.rt.x, tetra.rt.y, tetra.rb.x, tetra.rb.y, tetra.lb.x, tetra.lb.y], dtype="<f8").tobytes()]
+        for name in self.ARRAYS:
+            header[name] = len(getattr(cht, name))
+            data.append(np.array(getattr(cht, name), dtype="<f8").reshape(-1, 3).tobytes())
+        text = json.dumps(header).encode("utf-8")
+        try:
+            os.makedirs(app.config.target_cache_directory, exist_ok=True)
+            #write to temporary file first, so concurrent readers never see partial file
+            temporary = "{}.{}".format(self.Path(key), os.getpid())
+            with open(temporary, "wb") as f:
+                f.write(struct.pack("<4sII", self.MAGIC, self.VERSION, len(text)) + text + b"".join(data))
+            os.replace(temporary, self.Path(key))
+        except OSError:
+            return 1
+        return 0
+
+class CStageRunner():
+    #runs external tools directly (without shell), streams their output
+    #line by line and measures wall and CPU time of every stage
+    #several stages may run at once from different threads
+    def __init__(self):
+        self.processes = set()
+        self.timed_out = set()
+        self.finished = {}
+        self.cancelled = False
+        self.timings = []
+        self.mutex = threading.Lock()
+    def Run(self, name, args, timeout=0, log=None):
+        import subprocess
+        start_wall = time.perf_counter()
+        start_cpu = os.times()
+        with self.mutex:
+            if self.cancelled:
+                return 1
+            try:
+                #own process group so that children of the tool are stopped too
+                process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace", bufsize=1, start_new_session=(os.name != 'nt'))
+            except OSError as error:
+                ShowWarning('Unable to run {}: {}'.format(args[0], error))
+                return 1
+            self.processes.add(process)
+            self.finished[process] = threading.Event()
+        timer = None
+        if timeout > 0:
+            timer = threading.Timer(timeout, self.Timeout, [process])
+            timer.daemon = True
+            timer.start()
+        for line in process.stdout:
+            line = line.rstrip("\r\n")
+            if log != None:
+                with self.mutex:
+                    log.write("[{}] {}\n".format(name, line))
+                    log.flush()
+            StageOutput(name, line)
+        if os.name != 'nt':
+            #resource usage of this stage only, also when stages run in parallel
+            _, status, usage = os.wait4(process.pid, 0)
+            returned_value = process.returncode = os.waitstatus_to_exitcode(status)
+            cpu = usage.ru_utime + usage.ru_stime
+        else:
+            returned_value = process.wait()
+            #CPU time of children is only an estimate when stages run in parallel
+            stop_cpu = os.times()
+            cpu = (stop_cpu.children_user - start_cpu.children_user) + (stop_cpu.children_system - start_cpu.children_system)
+        if timer != None:
+            timer.cancel()
+        with self.mutex:
+            self.finished.pop(process).set()
+            self.processes.discard(process)
+            timed_out = process in self.timed_out
+            self.timings.append((name, time.perf_counter() - start_wall, cpu, returned_value))
+        if timed_out:
+            ShowWarning('Stage {} timed out after {} s'.format(name, timeout))
             return 1
-        return 0    
+        return returned_value
+    def Timeout(self, process):
+        with self.mutex:
+            self.timed_out.add(process)
+        self.Stop(process)
+    def Stop(self, process):
+        import signal
+        #process is reaped by Run only, so that its resource usage is not lost
+        with self.mutex:
+            finished = self.finished.get(process)
+        if finished == None:
+            return
+        try:
+            if os.name != 'nt':
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.terminate()
+            if not finished.wait(5):
+                if os.name != 'nt':
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+        except ProcessLookupError:
+            pass
+    def Cancel(self):
+        #stops running stages and prevents next ones from starting
+        with self.mutex:
+            self.cancelled = True
+            processes = list(self.processes)
+        for process in processes:
+            self.Stop(process)
+    def Report(self, wall=None):
+        width = max([12] + [len(name) for name, _, _, _ in self.timings])
+        lines = ["{:<{}} {:>9} {:>9} {:>5}".format("stage", width, "wall, s", "cpu, s", "exit")]
+        for name, stage_wall, cpu, returned_value in self.timings:
+            lines.append("{:<{}} {:>9.2f} {:>9.2f} {:>5}".format(name, width, stage_wall, cpu, returned_value))
+        if wall != None:
+            lines.append("{:<{}} {:>9.2f} {:>9.2f}".format("total", width, wall, sum(cpu for _, _, cpu, _ in self.timings)))
+        return "\n".join(lines)
+
+class CStage():
+    def __init__(self, name, key, outputs):
+        self.name = name
+        self.key = key
+        self.outputs = outputs
+
+class CPipeline():
+    #stages of profile generation keyed by hash of their inputs,
+    #upstream stages are inputs too, so a change reruns everything below it;
+    #state maps every output file to key of stage which produced it
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.state = {}
+        self.mutex = threading.Lock()
+        if self.state_file != None and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError):
+                self.state = {}
+    def Add(self, name, inputs, outputs):
+        digest = hashlib.sha256(name.encode("utf-8"))
+        for value in inputs + outputs:
+            if isinstance(value, CStage):
+                value = value.key
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            digest.update(struct.pack("<Q", len(value)) + value)
+        return CStage(name, digest.hexdigest(), outputs)
+    def IsDone(self, stage):
+        return all(self.state.get(output) == stage.key and os.path.exists(output) for output in stage.outputs)
+    def Commit(self, stages):
+        if self.state_file == None:
+            return
+        with self.mutex:
+            for stage in stages:
+                for output in stage.outputs:
+                    self.state[output] = stage.key
+            with open(self.state_file, "w") as f:
+                json.dump(self.state, f, indent=4)
 
 class CButtons_enum(Enum):
     OPEN_IMAGE = 0
@@ -295,24 +637,24 @@ class CButtons():
         self.Group = None
         self.buttons_array = []
         if app.use_buttons == True:
-            self.Group = LabelFrame(root, text = "")
-            self.Group.pack(side=RIGHT)
+            self.Group = tk.LabelFrame(root, text = "")
+            self.Group.pack(side=tk.RIGHT)
 
-            self.buttons_array.append(Button(self.Group, text="Open Image", command= OpenImageButtonClick))
-            self.buttons_array[CButtons_enum.OPEN_IMAGE.value].pack(side=TOP, fill="x")
-            self.buttons_array.append(Button(self.Group, text="Open White Balance", command= OpenWbButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Open Image", command= OpenImageButtonClick))
+            self.buttons_array[CButtons_enum.OPEN_IMAGE.value].pack(side=tk.TOP, fill="x")
+            self.buttons_array.append(tk.Button(self.Group, text="Open White Balance", command= OpenWbButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.OPEN_WB.value].pack(fill="x")
-            self.buttons_array.append(Button(self.Group, text="Save Image", command= SaveImageButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Save Image", command= SaveImageButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.SAVE_IMAGE.value].pack(fill="x")
-            self.buttons_array.append(Button(self.Group, text="Generate", command= SaveFilesButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Generate", command= SaveFilesButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.GENERATE.value].pack(fill="x")
-            self.buttons_array.append(Button(self.Group, text="Set Cropping", command= SetCropAreaButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Set Cropping", command= SetCropAreaButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.SET_CROP.value].pack(fill="x")
-            self.buttons_array.append(Button(self.Group, text="Crop", command= DoCropButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Crop", command= DoCropButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.CROP.value].pack(fill="x")
-            self.buttons_array.append(Button(self.Group, text="Open .cht", command= OpenCHTButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Open .cht", command= OpenCHTButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.OPEN_CHT.value].pack(fill="x")
-            self.buttons_array.append(Button(self.Group, text="Set Grid", command= SetGridAreaButtonClick, state=DISABLED))
+            self.buttons_array.append(tk.Button(self.Group, text="Set Grid", command= SetGridAreaButtonClick, state=tk.DISABLED))
             self.buttons_array[CButtons_enum.SET_GRID.value].pack(fill="x")  
     def SetButtonState(self, button, state):
         if self.use_buttons:
@@ -343,6 +685,22 @@ class CConfiguration():
         self.executor = "{}" if os.name == 'nt' else "sh -exc .\\ {}"
         self.max_process_image_width = 2048
         self.max_process_image_height = 2048
+        self.redraw_frame_rate = 60
+        self.startup_time_budget = 1000
+        self.patch_sampler = "scanin"
+        self.live_patch_sampling = True
+        self.live_sampling_interval = 100
+        self.target_cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "coloric")
+        self.incremental_pipeline = True
+        self.stage_runner = "native"
+        self.stage_timeout = 1800
+        self.log_file = "coloric.log"
+        self.profile_variants = []
+        self.max_parallel_stages = 0
+        self.make_dcp = True
+        self.preview_profile = True
+        self.preview_file = "Preview.json"
+        self.preview_reject_delta_e = 0
 
         self.config_file = None
 
@@ -401,9 +759,41 @@ class CConfiguration():
                         self.max_process_image_width = int(content["max process image width"]) 
                     if "max process image height" in content:
                         self.max_process_image_height = int(content["max process image height"])  
+                    if "redraw frame rate" in content:
+                        self.redraw_frame_rate = float(content["redraw frame rate"])
+                    if "startup time budget" in content:
+                        self.startup_time_budget = float(content["startup time budget"])
+                    if "patch sampler" in content:
+                        self.patch_sampler = content["patch sampler"]
+                    if "live patch sampling" in content:
+                        self.live_patch_sampling = bool(content["live patch sampling"])
+                    if "live sampling interval" in content:
+                        self.live_sampling_interval = float(content["live sampling interval"])
+                    if "target cache directory" in content:
+                        self.target_cache_directory = content["target cache directory"]
+                    if "incremental pipeline" in content:
+                        self.incremental_pipeline = bool(content["incremental pipeline"])
+                    if "stage runner" in content:
+                        self.stage_runner = content["stage runner"]
+                    if "stage timeout" in content:
+                        self.stage_timeout = float(content["stage timeout"])
+                    if "log file" in content:
+                        self.log_file = content["log file"]
+                    if "profile variants" in content:
+                        self.profile_variants = list(content["profile variants"])
+                    if "max parallel stages" in content:
+                        self.max_parallel_stages = int(content["max parallel stages"])
+                    if "make dcp" in content:
+                        self.make_dcp = bool(content["make dcp"])
+                    if "preview profile" in content:
+                        self.preview_profile = bool(content["preview profile"])
+                    if "preview file" in content:
+                        self.preview_file = content["preview file"]
+                    if "preview reject delta e" in content:
+                        self.preview_reject_delta_e = float(content["preview reject delta e"])
                     return 0    
             except OSError as error: 
-                messagebox.showwarning(title='Error', message=error)
+                ShowWarning(error)
                 return 1
         return 1        
        
@@ -413,41 +803,541 @@ class CCornerPoints_enum(Enum):
     POINT_RB = 2
     POINT_LB = 3
 
+class CEdit_enum(Enum):
+    CROP = 0
+    WHITE_BALANCE = 1
+
+class CEdit():
+    def __init__(self, kind, params):
+        self.kind = kind
+        self.params = params
+
+class CEditStack():
+    def __init__(self):
+        self.edits = []
+        self.width = 0
+        self.height = 0
+        self.revision = 0
+    def Reset(self, width, height):
+        self.edits.clear()
+        self.width = width
+        self.height = height
+        self.revision += 1
+    def Crop(self, x0, y0, x1, y1):
+        #coordinates are relative to the result of previous crops
+        left, top, right, bottom = self.CropRect()
+        x0 = min(max(int(round(x0)), 0), right - left)
+        y0 = min(max(int(round(y0)), 0), bottom - top)
+        x1 = min(max(int(round(x1)), x0), right - left)
+        y1 = min(max(int(round(y1)), y0), bottom - top)
+        self.edits.append(CEdit(CEdit_enum.CROP, (left + x0, top + y0, left + x1, top + y1)))
+        self.revision += 1
+    def SetWhiteBalance(self, kr, kg, kb, gamma):
+        self.edits = [edit for edit in self.edits if edit.kind != CEdit_enum.WHITE_BALANCE]
+        self.edits.append(CEdit(CEdit_enum.WHITE_BALANCE, (kr, kg, kb, gamma)))
+        self.revision += 1
+    def CropRect(self):
+        #crops are stored in original image coordinates, so the last one wins
+        rect = (0, 0, self.width, self.height)
+        for edit in self.edits:
+            if edit.kind == CEdit_enum.CROP:
+                rect = edit.params
+        return rect
+    def WhiteBalance(self):
+        wb = None
+        for edit in self.edits:
+            if edit.kind == CEdit_enum.WHITE_BALANCE:
+                wb = edit.params
+        return wb
+
+class CFrameFormat_enum(Enum):
+    RGB16 = 0
+    BGR16 = 1
+
+class CFrameHeader():
+    #header of raw frame in shared memory or memory-mapped file,
+    #pixel data follows at offset SIZE
+    MAGIC = b"CLRF"
+    LAYOUT = "<4sIIIIIddd"
+    SIZE = 64
+    def __init__(self):
+        self.version = 1
+        self.width = 0
+        self.height = 0
+        self.stride = 0
+        self.format = CFrameFormat_enum.RGB16
+        self.wb_r = 0.0
+        self.wb_g = 0.0
+        self.wb_b = 0.0
+    def Pack(self):
+        header = struct.pack(self.LAYOUT, self.MAGIC, self.version, self.width, self.height, self.stride, self.format.value, self.wb_r, self.wb_g, self.wb_b)
+        return header.ljust(self.SIZE, b"\0")
+    def Unpack(self, buffer):
+        magic, self.version, self.width, self.height, self.stride, format, self.wb_r, self.wb_g, self.wb_b = struct.unpack_from(self.LAYOUT, buffer)
+        if magic != self.MAGIC:
+            raise ValueError("Not a coloric frame buffer")
+        self.format = CFrameFormat_enum(format)
+        if self.stride < self.width * 6 or len(buffer) < self.SIZE + self.stride * self.height:
+            raise ValueError("Frame buffer is too small")
+
+class CTiffArray():
+    #lazy array over memory-mapped uncompressed tiff (strips or tiles),
+    #slicing reads only strips or tiles touching requested region,
+    #3 channel images are returned in OpenCV channel order
+    TAGS = {256: "width", 257: "height", 258: "bits", 259: "compression", 273: "offsets", 277: "samples", 278: "rows_per_strip", 284: "planar", 322: "tile_width", 323: "tile_height", 324: "tile_offsets", 339: "sample_format"}
+    def __init__(self, file_name):
+        with open(file_name, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        tags = self.ReadTags()
+        if tags.get("compression", (1,))[0] != 1 or tags.get("planar", (1,))[0] != 1 or tags.get("sample_format", (1,))[0] != 1:
+            raise ValueError("Only uncompressed interleaved unsigned tiff can be mapped")
+        width = tags["width"][0]
+        height = tags["height"][0]
+        self.samples = tags.get("samples", (1,))[0]
+        bits = set(tags.get("bits", (1,)))
+        if self.samples not in (1, 3) or bits not in ({8}, {16}):
+            raise ValueError("Only 8 or 16-bit gray or RGB tiff can be mapped")
+        self.dtype = np.dtype(np.uint8) if bits == {8} else np.dtype("<u2")
+        self.shape = (height, width) if self.samples == 1 else (height, width, self.samples)
+        self.ndim = len(self.shape)
+        self.tiled = "tile_offsets" in tags
+        if self.tiled:
+            self.chunk_width = tags["tile_width"][0]
+            self.chunk_height = tags["tile_height"][0]
+            self.offsets = tags["tile_offsets"]
+        else:
+            self.chunk_width = width
+            self.chunk_height = min(tags.get("rows_per_strip", (height,))[0], height)
+            self.offsets = tags["offsets"]
+        self.chunks_across = (width + self.chunk_width - 1) // self.chunk_width
+        self.chunk_size = self.chunk_width * self.chunk_height * self.samples * self.dtype.itemsize
+        if len(self.offsets) < self.chunks_across * ((height + self.chunk_height - 1) // self.chunk_height):
+            raise ValueError("Tiff strip or tile table is incomplete")
+        self.last_key = None
+        self.last_region = None
+    def ReadTags(self):
+        if self.map[0:4] != b"II*\0":
+            raise ValueError("Only little-endian tiff can be mapped")
+        ifd = struct.unpack_from("<I", self.map, 4)[0]
+        tags = {}
+        for i in range(struct.unpack_from("<H", self.map, ifd)[0]):
+            entry = ifd + 2 + i * 12
+            tag, type, count, value = struct.unpack_from("<HHII", self.map, entry)
+            if tag not in self.TAGS:
+                continue
+            format = {3: "H", 4: "I"}.get(type)
+            if format == None:
+                raise ValueError("Unsupported tiff tag type")
+            offset = entry + 8 if struct.calcsize(format) * count <= 4 else value
+            tags[self.TAGS[tag]] = struct.unpack_from("<{}{}".format(count, format), self.map, offset)
+        return tags
+    def Chunk(self, index):
+        #whole strip or tile, last strip may be shorter
+        rows = min(self.chunk_height, self.shape[0] - (index // self.chunks_across) * self.chunk_height) if self.chunks_across == 1 else self.chunk_height
+        chunk = np.ndarray((rows, self.chunk_width, self.samples), dtype=self.dtype, buffer=self.map, offset=self.offsets[index])
+        return chunk if self.samples == 1 else chunk[..., ::-1]
+    def View(self):
+        #zero-copy array when rows are stored back to back, None otherwise;
+        #rows of tiles wider than image are padded, so they need copying
+        if self.chunk_width != self.shape[1] or (self.tiled and self.shape[0] % self.chunk_height != 0):
+            return None
+        if self.chunks_across != 1 or any(offset != self.offsets[0] + i * self.chunk_size for i, offset in enumerate(self.offsets[:-1])):
+            return None
+        image = np.ndarray(self.shape[0:2] + (self.samples,), dtype=self.dtype, buffer=self.map, offset=self.offsets[0])
+        return image[..., 0] if self.samples == 1 else image[..., ::-1]
+    def Region(self, y0, y1, x0, x1):
+        if self.last_key == (y0, y1, x0, x1):
+            return self.last_region
+        region = np.empty((max(y1 - y0, 0), max(x1 - x0, 0), self.samples), dtype=self.dtype)
+        if y1 > y0 and x1 > x0:
+            for row in range(y0 // self.chunk_height, (y1 - 1) // self.chunk_height + 1):
+                for column in range(x0 // self.chunk_width, (x1 - 1) // self.chunk_width + 1):
+                    chunk = self.Chunk(row * self.chunks_across + column)
+                    cy0, cx0 = row * self.chunk_height, column * self.chunk_width
+                    ty0, ty1 = max(y0, cy0), min(y1, cy0 + chunk.shape[0])
+                    tx0, tx1 = max(x0, cx0), min(x1, cx0 + self.chunk_width)
+                    region[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = chunk[ty0 - cy0:ty1 - cy0, tx0 - cx0:tx1 - cx0]
+        if self.samples == 1:
+            region = region[..., 0]
+        self.last_key = (y0, y1, x0, x1)
+        self.last_region = region
+        return region
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows = key[0] if len(key) > 0 else slice(None)
+        columns = key[1] if len(key) > 1 else slice(None)
+        if not isinstance(rows, slice) or not isinstance(columns, slice) or rows.step not in (None, 1) or columns.step not in (None, 1):
+            return self.Region(0, self.shape[0], 0, self.shape[1])[key]
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = columns.indices(self.shape[1])
+        region = self.Region(y0, y1, x0, x1)
+        return region[(slice(None), slice(None)) + key[2:]] if len(key) > 2 else region
+    def __array__(self, dtype=None, copy=None):
+        image = self.Region(0, self.shape[0], 0, self.shape[1])
+        return image if dtype == None else image.astype(dtype)
+
+class CViewport():
+    def __init__(self):
+        self.image_width = 0
+        self.image_height = 0
+        self.canvas_width = 0
+        self.canvas_height = 0
+        self.fit_scale = 1.0
+        self.zoom = 1.0
+        self.max_zoom = 64.0
+        self.scale = 1.0
+        self.pos_x = 0
+        self.pos_y = 0
+    def SetSize(self, image_width, image_height, canvas_width, canvas_height):
+        if (image_width, image_height) != (self.image_width, self.image_height):
+            self.zoom = 1.0
+        self.image_width = image_width
+        self.image_height = image_height
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.fit_scale = min(canvas_width / image_width, canvas_height / image_height)
+        if self.zoom == 1.0:
+            self.Fit()
+        else:
+            self.ZoomAt(canvas_width / 2, canvas_height / 2, 1.0)
+    def Fit(self):
+        #whole image, centered horizontally and aligned to the top
+        self.zoom = 1.0
+        self.scale = self.fit_scale
+        self.pos_x = int((self.canvas_width - self.image_width * self.scale + 0.5) / 2)
+        self.pos_y = 0
+    def ZoomAt(self, canvas_x, canvas_y, factor):
+        #keeps image point under (canvas_x, canvas_y) in place
+        x, y = self.ToImage(canvas_x, canvas_y)
+        self.zoom = min(max(self.zoom * factor, 1.0), self.max_zoom)
+        if self.zoom == 1.0:
+            self.Fit()
+            return
+        self.scale = self.fit_scale * self.zoom
+        self.pos_x = canvas_x - x * self.scale
+        self.pos_y = canvas_y - y * self.scale
+        self.Clamp()
+    def Pan(self, dx, dy):
+        self.pos_x += dx
+        self.pos_y += dy
+        self.Clamp()
+    def Clamp(self):
+        width = self.image_width * self.scale
+        height = self.image_height * self.scale
+        if width <= self.canvas_width:
+            self.pos_x = (self.canvas_width - width) / 2
+        else:
+            self.pos_x = min(max(self.pos_x, self.canvas_width - width), 0)
+        if height <= self.canvas_height:
+            self.pos_y = 0
+        else:
+            self.pos_y = min(max(self.pos_y, self.canvas_height - height), 0)
+    def ToCanvas(self, x, y):
+        return (x * self.scale + self.pos_x, y * self.scale + self.pos_y)
+    def ToImage(self, canvas_x, canvas_y):
+        return ((canvas_x - self.pos_x) / self.scale, (canvas_y - self.pos_y) / self.scale)
+    def Contains(self, canvas_x, canvas_y):
+        x, y = self.ToImage(canvas_x, canvas_y)
+        return x > 0 and y > 0 and x < self.image_width and y < self.image_height
+    def VisibleRect(self):
+        #part of the image covered by the canvas, in image coordinates
+        x0, y0 = self.ToImage(0, 0)
+        x1, y1 = self.ToImage(self.canvas_width, self.canvas_height)
+        return (max(x0, 0), max(y0, 0), min(x1, self.image_width), min(y1, self.image_height))
+
+class CImagePyramid():
+    def __init__(self):
+        self.levels = []
+        self.key = None
+        self.min_size = 256
+        self.display_cache = {}
+        self.display_cache_size = 4
+        self.display_revision = None
+    def Reset(self):
+        self.levels = []
+        self.key = None
+        self.display_cache.clear()
+        self.display_revision = None
+    def Build(self, image, key):
+        #level 0 is the image itself, every next level is half of previous one
+        if self.key == key:
+            return
+        self.levels = [image]
+        level = image
+        while min(level.shape[0], level.shape[1]) // 2 >= self.min_size:
+            level = cv2.resize(level, (level.shape[1] // 2, level.shape[0] // 2), interpolation = cv2.INTER_AREA)
+            self.levels.append(level)
+        self.key = key
+        self.display_cache.clear()
+    def Level(self, scale):
+        #smallest level that still has at least requested scale
+        for level in reversed(self.levels):
+            if level.shape[1] / self.levels[0].shape[1] >= scale:
+                return level
+        return self.levels[0]
+    def GetDisplay(self, key, revision):
+        if self.display_revision != revision:
+            self.display_cache.clear()
+            self.display_revision = revision
+        return self.display_cache.get(key)
+    def PutDisplay(self, key, display):
+        if len(self.display_cache) >= self.display_cache_size:
+            del self.display_cache[next(iter(self.display_cache))]
+        self.display_cache[key] = display
+
+class CRedrawScheduler():
+    #coalesces redraw requests to at most one frame per frame interval,
+    #requests may come from any thread, but Tk is called from main thread
+    #only: requests of other threads are picked up by Poll
+    def __init__(self, root):
+        self.root = root
+        self.handler = None
+        self.frame_interval = 1 / 60
+        self.dirty_image = False
+        self.dirty_overlay = False
+        self.dirty_label = False
+        self.label_text = ""
+        self.pending = False
+        self.last_frame = 0
+        self.requests = 0
+        self.frames = 0
+        self.dropped = 0
+        self.mutex = threading.Lock()
+    def SetFrameRate(self, frame_rate):
+        if frame_rate > 0:
+            self.frame_interval = 1 / frame_rate
+    def Request(self, image=False, overlay=False, label=False):
+        with self.mutex:
+            self.requests += 1
+            self.dirty_image = self.dirty_image or image
+            self.dirty_overlay = self.dirty_overlay or overlay or image
+            self.dirty_label = self.dirty_label or label
+            if self.pending or threading.current_thread() is not threading.main_thread():
+                return
+            delay = self.Reserve()
+        #not under mutex, Run waits for it on main thread
+        self.Schedule(delay)
+    def Reserve(self):
+        #marks frame as scheduled, called with mutex held
+        #Returns delay of the frame in seconds
+        self.pending = True
+        return self.last_frame + self.frame_interval - time.perf_counter()
+    def Schedule(self, delay):
+        if delay <= 0:
+            self.root.after_idle(self.Run)
+        else:
+            self.root.after(int(delay * 1000) + 1, self.Run)
+    def Poll(self):
+        #main thread loop scheduling frames requested by other threads
+        with self.mutex:
+            delay = None
+            if self.pending == False and (self.dirty_image or self.dirty_overlay or self.dirty_label):
+                delay = self.Reserve()
+        if delay != None:
+            self.Schedule(delay)
+        self.root.after(max(1, int(self.frame_interval * 1000)), self.Poll)
+    def Drop(self):
+        with self.mutex:
+            self.dropped += 1
+    def Run(self):
+        with self.mutex:
+            image = self.dirty_image
+            overlay = self.dirty_overlay
+            label = self.dirty_label
+            self.dirty_image = False
+            self.dirty_overlay = False
+            self.dirty_label = False
+            self.pending = False
+            self.frames += 1
+            self.last_frame = time.perf_counter()
+        if self.handler != None:
+            self.handler(image, overlay, label)
+    def Statistics(self):
+        return "Redraw: {} requests, {} frames, {} coalesced, {} dropped".format(self.requests, self.frames, self.requests - self.frames, self.dropped)
+
+class CProfileView():
+    #candidate profile applied to display image ("after" view), camera RGB
+    #is mapped to display sRGB by 3D LUT built from matrix and DCP tables,
+    #LUT nodes are spaced by square root to keep precision in shadows
+    LUT_SIZE = 65
+    def __init__(self):
+        self.matrix = None
+        self.tables = []
+        self.enabled = False
+        self.revision = 0
+        self.lut = None
+        self.indices = {}
+    def Set(self, matrix, tables=None):
+        #matrix - camera RGB (0..1) to XYZ D50, XYZ = matrix . RGB
+        #tables - list of (table, srgb_value) applied in ProPhoto RGB
+        #LUT is built here, in generating thread, not on first redraw
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.tables = [] if tables == None else tables
+        self.BuildLUT()
+        self.enabled = True
+        self.revision += 1
+    def Toggle(self):
+        if self.matrix is None:
+            return False
+        self.enabled = not self.enabled
+        return True
+    def Key(self):
+        return (self.revision, self.enabled)
+    def BuildLUT(self):
+        n = self.LUT_SIZE
+        nodes = np.square(np.linspace(0, 1, n))
+        rgb = np.stack(np.meshgrid(nodes, nodes, nodes, indexing="ij"), axis=-1).reshape(-1, 3)
+        xyz = rgb @ self.matrix.T
+        if len(self.tables) > 0:
+            prophoto = xyz @ coloric_color.XYZ_TO_PROPHOTO.T
+            for table, srgb_value in self.tables:
+                prophoto = coloric_color.ApplyHueSatTable(prophoto, table, srgb_value)
+            xyz = prophoto @ coloric_color.PROPHOTO_TO_XYZ.T
+        #not clipped, so interpolation is smooth at gamut boundary;
+        #slices of blue are laid side by side, red is row and green is column
+        lut = coloric_color.XYZToSRGB(xyz).astype(np.float32).reshape(n, n, n, 3)
+        self.lut = np.ascontiguousarray(lut.transpose(0, 2, 1, 3).reshape(n, n * n, 3))
+    def Coordinates(self, dtype):
+        #LUT coordinate of every sample value
+        if dtype not in self.indices:
+            levels = np.sqrt(np.arange(np.iinfo(dtype).max + 1) / np.iinfo(dtype).max) * (self.LUT_SIZE - 1)
+            lower = np.minimum(np.floor(levels), self.LUT_SIZE - 2)
+            self.indices[dtype] = (levels.astype(np.float32), (lower * self.LUT_SIZE).astype(np.float32), (levels - lower).astype(np.float32))
+        return self.indices[dtype]
+    def Render(self, pixels):
+        #pixels - camera RGB in OpenCV channel order, returns 8-bit sRGB;
+        #bilinear lookup in red/green by remap, linear between blue slices
+        if self.lut is None:
+            self.BuildLUT()
+        coordinates, slices, weights = self.Coordinates(pixels.dtype.type)
+        map_y = coordinates[pixels[..., 2]]
+        map_x = coordinates[pixels[..., 1]]
+        blue = pixels[..., 0]
+        map_x += slices[blue]
+        weight = weights[blue][..., None]
+        low = cv2.remap(self.lut, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        map_x += self.LUT_SIZE
+        high = cv2.remap(self.lut, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        result = low + (high - low) * weight
+        return np.clip(result * 255 + 0.5, 0, 255).astype(np.uint8)
+
+class CPatchMonitor():
+    #samples patches on background thread while grid is edited, only
+    #the latest request is kept and requests are throttled to interval;
+    #request carries everything the thread needs, so it does not touch
+    #app state, and main thread polls for results with NewResult
+    def __init__(self):
+        self.interval = 0.1
+        self.max_delta_e = 5.0
+        self.max_noise = 2.0
+        self.request = None
+        self.request_key = None
+        self.result = None
+        self.result_new = False
+        self.masks_key = None
+        self.masks = None
+        self.reference_key = None
+        self.reference = None
+        self.last_run = 0
+        self.thread = None
+        self.running = False
+        self.condition = threading.Condition()
+    def Submit(self, key, image, quads, reference):
+        with self.condition:
+            self.request = (key, image, quads, reference)
+            if self.thread == None:
+                self.running = True
+                self.thread = threading.Thread(target=self.Run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+    def Stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+    def Run(self):
+        while True:
+            with self.condition:
+                while self.running and self.request == None:
+                    self.condition.wait()
+                if self.running == False:
+                    return
+                delay = self.last_run + self.interval - time.perf_counter()
+                if delay > 0:
+                    #newer requests replace this one while waiting
+                    self.condition.wait(delay)
+                    continue
+                key, image, quads, reference = self.request
+                self.request = None
+                self.last_run = time.perf_counter()
+            result = self.Sample(key, image, quads, reference)
+            with self.condition:
+                self.result = result
+                self.result_new = True
+    def Sample(self, key, image, quads, reference):
+        #masks depend only on grid geometry and image size
+        masks_key = (quads.tobytes(), image.shape[0:2])
+        if self.masks_key != masks_key:
+            self.masks = PatchMasks(quads, image.shape[1], image.shape[0])
+            self.masks_key = masks_key
+        stats = SamplePatches(image, quads, self.masks)
+        max_value = np.iinfo(image.dtype).max
+        rgb = stats["mean"] / max_value
+        noise = np.divide(stats["std"], stats["mean"], out=np.zeros_like(rgb), where=stats["mean"] > 0).max(axis=1) * 100
+        delta_e = np.full(len(quads), np.nan)
+        valid = stats["count"] > 0
+        if reference is not None and np.count_nonzero(valid) >= 3:
+            matrix, delta_e[valid] = FitPatchMatrix(rgb[valid], reference[valid])
+        flags = (noise > self.max_noise) | (delta_e > self.max_delta_e) | (valid == False)
+        return {"key": key, "rgb": rgb * 100, "noise": noise, "delta_e": delta_e, "flags": flags}
+    def Result(self):
+        with self.condition:
+            return self.result
+    def NewResult(self):
+        #Returns True once for every result finished since last call
+        with self.condition:
+            result_new = self.result_new
+            self.result_new = False
+            return result_new
+
 class CApp():
     def __init__(self, root):
         self.root = root
-        self.root.geometry('%dx%d+0+0' % (int(self.root.winfo_screenwidth()), int(self.root.winfo_screenheight())))
-        self.root.configure(bg="Black")
-        try:
-            self.root.state("zoomed") #doesn't work on Linux
-        except:
-            pass
-        self.root.title("Coloric")
 
         self.use_buttons = False
-
-        if self.use_buttons == False:
-            self.label = Label(self.root, text='Application initialization', anchor=CENTER, font=("Arial", 14), height=3, bg="Black", fg="White")
-            self.label.grid(row=0, sticky="nsew")
-            self.canvas = tk.Canvas(self.root, bg="Black", width=int(self.root.winfo_screenwidth()), height=(int(self.root.winfo_screenheight())-self.label.winfo_height()))
-            self.canvas.grid(row=1, sticky="nsew")
-        else:
-            self.canvas = tk.Canvas(root, bg="Black")
-            self.canvas.pack(side=LEFT, fill=BOTH, expand=True)    
-
-        self.croppedTestImageTk = None
-        self.saveCroppedTestImageTk = None
+        self.label = None
+        self.canvas = None
+
+        if self.root != None:
+            self.InitWindow()
+
+        self.imageBuffer = None
+        self.imageSource = None
+        self.edits = CEditStack()
+        self.patch_monitor = CPatchMonitor()
+        self.targets = CTargetLibrary()
+        self.runner = CStageRunner()
+        self.preview = None
+        self.profile_view = CProfileView()
+        self.pyramid = CImagePyramid()
         self.resizedTestImage = None
         self.resizedTestImageTk = None
-        self.cv2Image = None
 
         self.buttons = None
         self.image_id = None
-        self.proportion = 1
-        self.proportion_crop_init = 1
-        self.proportion_grid_init = 1
+        self.viewport = CViewport()
+        self.zoom_step = 1.25
+        self.pan_start = CPoint()
+        self.display_pos = (0, 0)
         self.line_width = 2
         self.background_id = None
+        self.widget_sizes = {}
+        self.redraw = CRedrawScheduler(root)
+        self.label_queue = queue.Queue()
+        self.overlay_patches = None
 
         self.DEFINE_SEARCH_RADIUS = 12
 
@@ -482,12 +1372,65 @@ class CApp():
         self.setting_grid = False 
 
         self.proc_exec = False
+
+        self.batch_crops = []
+        self.batch_fiducials = None
+
+    def InitWindow(self):
+        self.root.geometry('%dx%d+0+0' % (int(self.root.winfo_screenwidth()), int(self.root.winfo_screenheight())))
+        self.root.configure(bg="Black")
+        try:
+            self.root.state("zoomed") #doesn't work on Linux
+        except:
+            pass
+        self.root.title("Coloric")
+
+        if self.use_buttons == False:
+            self.label = tk.Label(self.root, text='Application initialization', anchor=tk.CENTER, font=("Arial", 14), height=3, bg="Black", fg="White")
+            self.label.grid(row=0, sticky="nsew")
+            self.canvas = tk.Canvas(self.root, bg="Black", width=int(self.root.winfo_screenwidth()), height=(int(self.root.winfo_screenheight())-self.label.winfo_height()))
+            self.canvas.grid(row=1, sticky="nsew")
+        else:
+            self.canvas = tk.Canvas(self.root, bg="Black")
+            self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)    
  
 # Init
 #---------------------------------------------------
-root = tk.Tk()
+root = None
+
+app = None
+
+###################################################
+# Imports GUI modules, called only when window is shown
+###################################################
+def ImportGui():
+    global tk, filedialog, messagebox, Image, ImageTk
+    import tkinter as tk
+    from tkinter import filedialog
+    from tkinter import messagebox
+    from PIL import Image, ImageTk
+    startup.Mark("gui imports")
+
+###################################################
+# Creates application state
+# window_root - Tk root window, None for batch mode
+###################################################
+def InitApp(window_root=None):
+    global root, app
+    root = window_root
+    app = CApp(root)
+    app.config = CConfiguration()
+    return app
 
-app = CApp(root)
+###################################################
+# Shows error message box or prints error in batch mode
+# message - error description
+###################################################
+def ShowWarning(message):
+    if app != None and app.root != None:
+        messagebox.showwarning(title='Error', message=message)
+    else:
+        print('Error: {}'.format(message), file=sys.stderr)
 
 # Fuctions
 #---------------------------------------------------
@@ -496,30 +1439,40 @@ app = CApp(root)
 # file_name - Path and name of image to open
 ###################################################
 def OpenImageFile(file_name):
-    if file_name[-3:] == 'tif' or file_name[-4:] == 'tiff':
-        app.saveCroppedTestImageTk = Image.open(file_name)
-        app.cv2Image = cv2.imread(file_name, -1)
+    source = app.imageSource
+    if file_name.startswith("shm:") or file_name.startswith("mmap:"):
+        try:
+            image = OpenFrameBuffer(file_name)
+        except (OSError, ValueError) as error:
+            ShowWarning(str(error))
+            return 1
+    elif file_name[-3:] == 'tif' or file_name[-4:] == 'tiff':
+        image = OpenTiffFile(file_name)
     else:   
-        messagebox.showwarning(title='Error', message='Not supported image format')
+        ShowWarning('Not supported image format')
+        return 1
+    if image is None:
+        ShowWarning('Unable to read image file')
         return 1
 
+    image_height, image_width = image.shape[0:2]
+    #limit 0 disables downscale along its axis
     coeff = 1    
-    if app.config.max_process_image_width < app.saveCroppedTestImageTk.width or app.config.max_process_image_height < app.saveCroppedTestImageTk.height:
-        if app.saveCroppedTestImageTk.width > app.saveCroppedTestImageTk.height:
-            coeff = app.config.max_process_image_width / app.saveCroppedTestImageTk.width 
-        else:
-            coeff = app.config.max_process_image_height / app.saveCroppedTestImageTk.height    
-    if coeff != 1:
-        if app.cv2Image.dtype == np.uint16:  
-            app.cv2Image = cv2.resize(app.cv2Image, (int(app.saveCroppedTestImageTk.width * coeff), int(app.saveCroppedTestImageTk.height * coeff)), interpolation = cv2.INTER_AREA)
-        app.saveCroppedTestImageTk = app.saveCroppedTestImageTk.resize((int(app.saveCroppedTestImageTk.width * coeff), int(app.saveCroppedTestImageTk.height * coeff)))
-
-    image_width = app.saveCroppedTestImageTk.width
-    image_height = app.saveCroppedTestImageTk.height
-
-    CropImageBuffer(0, 0, image_width, image_height)
+    if app.config.max_process_image_width > 0:
+        coeff = min(coeff, app.config.max_process_image_width / image_width)
+    if app.config.max_process_image_height > 0:
+        coeff = min(coeff, app.config.max_process_image_height / image_height)
+    if coeff < 1 and isinstance(app.imageSource, CTiffArray) and app.imageSource is not source:
+        #memory-mapped TIFF is not decoded, display is scaled from image pyramid
+        coeff = 1
+    if coeff < 1:
+        image = cv2.resize(np.asarray(image), (max(1, int(image_width * coeff)), max(1, int(image_height * coeff))), interpolation = cv2.INTER_AREA)
+    app.imageBuffer = image
+
+    app.edits.Reset(image.shape[1], image.shape[0])
+    app.pyramid.Reset()
     if app.wb_kr != 1.0 or app.wb_kg != 1.0 or app.wb_kb != 1.0:
-        ApplyWhiteBalance(app.croppedTestImageTk.mode)
+        app.edits.SetWhiteBalance(app.wb_kr, app.wb_kg, app.wb_kb, app.gamma)
  
     #buttons
     if app.use_buttons == True:
@@ -529,6 +1482,228 @@ def OpenImageFile(file_name):
         app.buttons.SetButtonState(CButtons_enum.OPEN_WB.value, tk.NORMAL)
     return 0    
 
+###################################################
+# Opens raw frame from shared memory or memory-mapped file
+# source - "shm:<name>" or "mmap:<path>"
+# Returns numpy array wrapping the frame without copying,
+# in OpenCV channel order
+###################################################
+def OpenFrameBuffer(source):
+    kind, name = source.split(":", 1)
+    if kind == "shm":
+        from multiprocessing import shared_memory, resource_tracker
+        segment = shared_memory.SharedMemory(name=name)
+        #segment is owned by producer, it must not be removed when this process exits
+        resource_tracker.unregister(segment._name, "shared_memory")
+        buffer = segment.buf
+    else:
+        with open(name, "rb") as f:
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = segment
+    header = CFrameHeader()
+    header.Unpack(buffer)
+    #keep mapping alive as long as image buffer is used
+    app.imageSource = segment
+    image = np.ndarray((header.height, header.width, 3), dtype=np.uint16, buffer=buffer, offset=CFrameHeader.SIZE, strides=(header.stride, 6, 2))
+    if header.format == CFrameFormat_enum.RGB16:
+        image = image[..., ::-1]
+    if header.wb_r > 0 and header.wb_g > 0 and header.wb_b > 0:
+        app.wb_kr = header.wb_r
+        app.wb_kg = header.wb_g
+        app.wb_kb = header.wb_b
+    return image
+
+###################################################
+# Opens .tif file, uncompressed files are memory-mapped
+# instead of decoded, so only touched parts are read
+# file_name - Path and name of .tif file
+# Returns numpy array, CTiffArray or None on error
+###################################################
+def OpenTiffFile(file_name):
+    try:
+        tiff = CTiffArray(file_name)
+    except (OSError, ValueError, KeyError, struct.error):
+        #compressed or exotic layout, decode whole file
+        return cv2.imread(file_name, cv2.IMREAD_UNCHANGED)
+    app.imageSource = tiff
+    view = tiff.View()
+    return tiff if view is None else view
+
+###################################################
+# Writes raw frame to shared memory or memory-mapped file,
+# producer side of OpenFrameBuffer used for testing
+# target - "shm:<name>" or "mmap:<path>"
+# image - 16-bit numpy array in OpenCV channel order
+# wb - white balance coefficients (r, g, b) or None
+# Returns mapping object, it has to be closed by caller
+###################################################
+def WriteFrameBuffer(target, image, wb=None):
+    kind, name = target.split(":", 1)
+    header = CFrameHeader()
+    header.height, header.width = image.shape[0:2]
+    header.stride = header.width * 6
+    if wb != None:
+        header.wb_r, header.wb_g, header.wb_b = wb
+    size = CFrameHeader.SIZE + header.stride * header.height
+    if kind == "shm":
+        from multiprocessing import shared_memory, resource_tracker
+        segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        buffer = segment.buf
+    else:
+        with open(name, "w+b") as f:
+            f.truncate(size)
+            segment = mmap.mmap(f.fileno(), size)
+        buffer = segment
+    buffer[0:CFrameHeader.SIZE] = header.Pack()
+    pixels = np.ndarray((header.height, header.width, 3), dtype=np.uint16, buffer=buffer, offset=CFrameHeader.SIZE)
+    pixels[...] = image[..., 2::-1]
+    del pixels
+    return segment
+
+###################################################
+# Rasterizes patches to masks over their bounding boxes
+# quads - patch corners, array of shape (patches, 4, 2)
+# width, height - image size
+# Returns list of (x0, y0, x1, y1, mask) or None for patches
+# outside of image
+###################################################
+def PatchMasks(quads, width, height):
+    masks = []
+    for quad in quads:
+        x0 = max(int(math.floor(quad[:, 0].min())), 0)
+        y0 = max(int(math.floor(quad[:, 1].min())), 0)
+        x1 = min(int(math.ceil(quad[:, 0].max())) + 1, width)
+        y1 = min(int(math.ceil(quad[:, 1].max())) + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            masks.append(None)
+            continue
+        #mask of pixel centers inside the patch, 4 fractional bits of corner precision
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillConvexPoly(mask, np.round((quad - (x0, y0)) * 16).astype(np.int32), 1, cv2.LINE_8, 4)
+        masks.append((x0, y0, x1, y1, mask != 0))
+    return masks
+
+###################################################
+# Samples patches of cropped image
+# image - cropped image in OpenCV channel order
+# quads - patch corners, array of shape (patches, 4, 2)
+# Returns dictionary of arrays of shape (patches, 3) in RGB
+# order: "mean", "median", "std", and pixel "count" per patch
+###################################################
+def SamplePatches(image, quads, masks=None):
+    count = len(quads)
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    stats = {"mean": np.zeros((count, 3)), "median": np.zeros((count, 3)), "std": np.zeros((count, 3)), "count": np.zeros(count, dtype=np.int64)}
+    if masks == None:
+        masks = PatchMasks(quads, image.shape[1], image.shape[0])
+    for i, patch_mask in enumerate(masks):
+        if patch_mask == None:
+            continue
+        x0, y0, x1, y1, mask = patch_mask
+        pixels = np.asarray(image[y0:y1, x0:x1]).reshape(y1 - y0, x1 - x0, channels)[mask].astype(np.float64)
+        if len(pixels) == 0:
+            continue
+        if channels >= 3:
+            pixels = pixels[:, 2::-1]
+        stats["mean"][i] = pixels.mean(axis=0)
+        stats["median"][i] = np.median(pixels, axis=0)
+        stats["std"][i] = pixels.std(axis=0)
+        stats["count"][i] = len(pixels)
+    return stats
+
+###################################################
+# Returns reference values of patches in .cht order,
+# from .cie file if it exists, from .cht file otherwise
+# cie_file - Path and name of .cie file
+# Returns (list of field names, list of values per patch)
+###################################################
+def ReadPatchReference(cie_file):
+    if app.cht.cie_file != cie_file:
+        app.cht.Read_cie(cie_file)
+    return app.cht.cie_names, app.cht.cie_reference
+
+###################################################
+# Returns reference values of patches as XYZ scaled to Y = 1,
+# array of shape (patches, 3) or None if .cht has no values
+###################################################
+def ReferenceXYZ():
+    if len(app.cht.patches_id) == 0:
+        return None
+    cie_file = "{}cie".format(app.config.input_cht_file[:-3])
+    if app.config.input_cie_file != "":
+        cie_file = app.config.input_cie_file
+    names, reference = ReadPatchReference(cie_file)
+    if names[0] == "LAB_L":
+        return coloric_color.LabToXYZ(np.array(reference))
+    return np.array(reference) / 100
+
+###################################################
+# Fits camera RGB to reference XYZ with 3x3 matrix
+# rgb - camera values, array of shape (patches, 3)
+# xyz - reference values, array of shape (patches, 3)
+# Returns (matrix, delta E 1976 of every patch)
+###################################################
+def FitPatchMatrix(rgb, xyz):
+    matrix = np.linalg.lstsq(rgb, xyz, rcond=None)[0]
+    return matrix, coloric_color.DeltaE76(coloric_color.XYZToLab(rgb @ matrix), coloric_color.XYZToLab(xyz))
+
+###################################################
+# Redraws patch overlay when patch monitor has new result,
+# runs on main thread every display frame
+###################################################
+def PollPatchSampling():
+    if app.patch_monitor.NewResult():
+        app.redraw.Request(overlay=True)
+    root.after(max(1, int(app.redraw.frame_interval * 1000)), PollPatchSampling)
+
+###################################################
+# Sends current grid to patch monitor if it has changed
+###################################################
+def SubmitPatchSampling():
+    if app.config.live_patch_sampling == False or isGridSet() == False:
+        return
+    tetra = app.grid.frame.tetra
+    key = (tetra.lt.x, tetra.lt.y, tetra.rt.x, tetra.rt.y, tetra.rb.x, tetra.rb.y, tetra.lb.x, tetra.lb.y, app.grid.start_point, app.edits.revision, id(app.cht.grid_patches))
+    if app.patch_monitor.request_key == key:
+        return
+    app.patch_monitor.request_key = key
+    app.patch_monitor.interval = app.config.live_sampling_interval / 1000
+    #reference values are read here, main thread may replace app.cht
+    if app.patch_monitor.reference_key is not app.cht.grid_patches:
+        app.patch_monitor.reference = ReferenceXYZ()
+        app.patch_monitor.reference_key = app.cht.grid_patches
+    app.patch_monitor.Submit(key, GetImageView(), PatchQuads(), app.patch_monitor.reference)
+
+###################################################
+# Writes sampled patches as scanin compatible .ti3 file
+# file_name - Path and name of .ti3 file
+# stats - patch statistics returned by SamplePatches
+# cie_file - Path and name of .cie file with reference values
+# max_value - white level of image samples
+###################################################
+def WriteTi3File(file_name, stats, cie_file, max_value):
+    names, reference = ReadPatchReference(cie_file)
+    rgb = stats["mean"] * 100 / max_value
+    std = stats["std"] * 100 / max_value
+    with open(file_name, "w") as f:
+        f.write('CTI3\n\n')
+        f.write('DESCRIPTOR "Argyll Calibration Target chart information 3"\n\n')
+        f.write('ORIGINATOR "coloric"\n')
+        f.write('CREATED "{}"\n'.format(datetime.datetime.now().strftime("%a %b %d %H:%M:%S %Y")))
+        f.write('DEVICE_CLASS "INPUT"\n')
+        f.write('COLOR_REP "{}_RGB"\n\n'.format(names[0][0:3]))
+        f.write('NUMBER_OF_FIELDS 11\n')
+        f.write('BEGIN_DATA_FORMAT\n')
+        f.write('SAMPLE_ID SAMPLE_LOC {} RGB_R RGB_G RGB_B STDEV_R STDEV_G STDEV_B\n'.format(" ".join(names)))
+        f.write('END_DATA_FORMAT\n\n')
+        f.write('NUMBER_OF_SETS {}\n'.format(len(reference)))
+        f.write('BEGIN_DATA\n')
+        for i in range(len(reference)):
+            values = list(reference[i]) + list(rgb[i]) + list(std[i])
+            f.write('{} "{}" {}\n'.format(app.cht.patches_id[i], app.cht.patches_id[i], " ".join("{:.6f}".format(value) for value in values)))
+        f.write('END_DATA\n')
+
 ################################################### 
 # Opens .json file with white balance coefficients
 # file_name - Path and name of .json file to open
@@ -550,11 +1725,10 @@ def OpenWbFile(file_name, apply_wb=False):
                 app.wb_kb = float(content["b"]) 
                 found_some = True  
             if found_some == True and apply_wb == True:
-                ApplyWhiteBalance(app.croppedTestImageTk.mode)
-                ResizeImage()    
-                DrawObjects() 
+                app.edits.SetWhiteBalance(app.wb_kr, app.wb_kg, app.wb_kb, app.gamma)
+                app.redraw.Request(image=True)
     except OSError as error: 
-        messagebox.showwarning('Error', title=error)
+        ShowWarning(error)
 
 ###################################################
 # Crops image buffers
@@ -564,42 +1738,133 @@ def OpenWbFile(file_name, apply_wb=False):
 # y1 - y coordinates of right bottom point
 ###################################################
 def CropImageBuffer(x0, y0, x1, y1):  
-    app.saveCroppedTestImageTk = app.saveCroppedTestImageTk.crop((x0, y0, x1, y1))
-    app.croppedTestImageTk = app.saveCroppedTestImageTk.copy() 
-    if app.cv2Image.dtype == np.uint16:  
-        app.cv2Image = app.cv2Image[int(y0):int(y1), int(x0):int(x1)]
+    app.edits.Crop(x0, y0, x1, y1)
+
+###################################################
+# Returns cropped region of image buffer
+# Returns numpy view (no copy) in OpenCV channel order
+###################################################
+def GetImageView():
+    if app.imageBuffer is None:
+        return None
+    x0, y0, x1, y1 = app.edits.CropRect()
+    return app.imageBuffer[y0:y1, x0:x1]
+
+###################################################
+# Returns cropped image to be saved, white balance is
+# not applied as output image has to stay linear
+###################################################
+def GetOutputImage():
+    return GetImageView()
+
+###################################################
+# Converts image buffer region to 8-bit display image
+# pixels - numpy array in OpenCV channel order
+# Returns PIL image with white balance applied
+###################################################
+def MakeDisplayImage(pixels):
+    if pixels.ndim == 2:
+        if pixels.dtype == np.uint16:
+            pixels = (pixels >> 8).astype(np.uint8)
+        return Image.fromarray(pixels)
+    if app.profile_view.enabled and np.issubdtype(pixels.dtype, np.integer):
+        return Image.fromarray(app.profile_view.Render(pixels))
+    rgb = pixels[..., 2::-1]
+    wb = app.edits.WhiteBalance()
+    if wb != None:
+        rgb = ApplyWhiteBalance(rgb, wb, np.uint8)
+    elif rgb.dtype == np.uint16:
+        rgb = (rgb >> 8).astype(np.uint8)
+    return Image.fromarray(np.ascontiguousarray(rgb))
    
 ###################################################
-# Applies white balance coefficients to imput image
-# mode - defines iamge pixel format
+# Builds white balance and gamma lookup tables
+# gains - white balance coefficients (r, g, b)
+# gamma - gamma applied after white balance
+# dtype - image sample type (np.uint8 or np.uint16)
+# out_dtype - result sample type, same as dtype if None
+# Returns array of shape (3, 256) or (3, 65536)
+###################################################
+def BuildWhiteBalanceLUT(gains, gamma, dtype, out_dtype=None):
+    if out_dtype == None:
+        out_dtype = dtype
+    max_value = np.iinfo(dtype).max
+    out_max_value = np.iinfo(out_dtype).max
+    levels = np.arange(max_value + 1, dtype=np.float64) / max_value
+    lut = np.empty((len(gains), max_value + 1), dtype=out_dtype)
+    for channel, gain in enumerate(gains):
+        lut[channel] = np.clip(np.power(levels * gain, 1 / gamma) * out_max_value, 0, out_max_value).astype(out_dtype)
+    return lut
+
+###################################################
+# Applies white balance lookup tables to pixel array
+# pixels - array of shape (height, width, channels), 3 or 4 channels
+# lut - lookup tables built by BuildWhiteBalanceLUT
+# Returns new array of lut type, 4th channel (alpha/padding)
+# is only rescaled to lut type
 ###################################################
-def ApplyWhiteBalance(mode):
-    pixelMap = app.croppedTestImageTk.load()
-    for i in range(app.croppedTestImageTk.size[0]):
-        for j in range(app.croppedTestImageTk.size[1]):
-            if mode == "RGBA" or mode == "RGBX":
-                pixelMap[i,j] = (int(pow(pixelMap[i,j][0] * app.wb_kr / 255, 1 / app.gamma) * 255), int(pow(pixelMap[i,j][1] * app.wb_kg / 255, 1 / 2.2) * 255), int(pow(pixelMap[i,j][2] * app.wb_kb / 255, 1 / 2.2) * 255), pixelMap[i,j][3])
-            if mode == "RGB":
-                pixelMap[i,j] = (int(pow(pixelMap[i,j][0] * app.wb_kr / 255, 1 / app.gamma) * 255), int(pow(pixelMap[i,j][1] * app.wb_kg / 255, 1 / 2.2) * 255), int(pow(pixelMap[i,j][2] * app.wb_kb / 255, 1 / 2.2) * 255))
+def ApplyWhiteBalanceLUT(pixels, lut):
+    result = np.empty(pixels.shape, dtype=lut.dtype)
+    for channel in range(lut.shape[0]):
+        result[..., channel] = lut[channel][pixels[..., channel]]
+    if pixels.shape[-1] > lut.shape[0]:
+        shift = 8 * (pixels.itemsize - result.itemsize)
+        result[..., lut.shape[0]:] = pixels[..., lut.shape[0]:] >> shift
+    return result
 
+###################################################
+# Applies white balance coefficients to pixel array
+# pixels - RGB, RGBA or RGBX numpy array
+# wb - white balance parameters (kr, kg, kb, gamma)
+# dtype - result sample type
+###################################################
+def ApplyWhiteBalance(pixels, wb, dtype):
+    lut = BuildWhiteBalanceLUT(wb[0:3], wb[3], pixels.dtype, dtype)
+    return ApplyWhiteBalanceLUT(pixels, lut)
+
+###################################################
+# Maps patch corners from fiducial frame to cropped image
+# through homography of the grid corners
+# Returns array of shape (patches, 4, 2) in grid order
+###################################################
+def TransformPatches():
+    tetra = app.grid.frame.tetra
+    corners = app.cht.grid_patches.corners
+    source = np.float32([[0, 0], [1, 0], [1, 1], [0, 1]])
+    destination = np.float32([[tetra.lt.x, tetra.lt.y], [tetra.rt.x, tetra.rt.y], [tetra.rb.x, tetra.rb.y], [tetra.lb.x, tetra.lb.y]])
+    homography = cv2.getPerspectiveTransform(source, destination)
+    if np.isfinite(homography).all() == False or abs(np.linalg.det(homography)) < 1e-9:
+        #grid is not set yet or collapsed to a line
+        return np.broadcast_to(destination[0], corners.shape).astype(np.float64)
+    return cv2.perspectiveTransform(corners.reshape(-1, 1, 2), homography).reshape(corners.shape)
 
 ###################################################
-# Interpolates grid patch coordinates
+# Returns index of color checker patch drawn at grid position,
+# grid is mirrored according to the corner chosen as chart start
+# x - grid column
+# y - grid row
 ###################################################
-def InterpolateLine(start, end, pos):
-    ret = CPoint()
-    ret.x = start.x + (end.x - start.x) * pos
-    ret.y = start.y + (end.y - start.y) * pos
-    return ret
+def PatchIndex(x, y):
+    patches = app.cht.grid_patches
+    if app.grid.start_point == CCornerPoints_enum.POINT_RT:
+        return y * patches.columns - x + patches.columns - 1
+    if app.grid.start_point == CCornerPoints_enum.POINT_RB:
+        return (patches.rows - 1 - y) * patches.columns - x + patches.columns - 1
+    if app.grid.start_point == CCornerPoints_enum.POINT_LB:
+        return (patches.rows - 1 - y) * patches.columns + x
+    return y * patches.columns + x
 
 ###################################################
-# Interpolates grid patch coordinates
+# Returns patch corners (lt, rt, rb, lb) in cropped image
+# coordinates as array of shape (patches, 4, 2), patches are
+# in .cht order
 ###################################################
-def TransformPoint(point):
-    left_line = InterpolateLine(app.grid.frame.tetra.lt, app.grid.frame.tetra.lb, point.y)
-    right_line = InterpolateLine(app.grid.frame.tetra.rt, app.grid.frame.tetra.rb, point.y)
-    ret = InterpolateLine(left_line, right_line, point.x)
-    return ret
+def PatchQuads():
+    patches = app.cht.grid_patches
+    order = [PatchIndex(x, y) for y in range(patches.rows) for x in range(patches.columns)]
+    quads = np.zeros((patches.number_patches, 4, 2))
+    quads[order] = TransformPatches()
+    return quads
 
 ###################################################
 # Updates grid
@@ -653,8 +1918,8 @@ def update_grid():
 # p2 - second point
 ###################################################        
 def FindNearestPoint(p1, p2):
-    scale = app.proportion / app.proportion_grid_init
-    if math.sqrt((p1.x * scale - p2.x) * (p1.x * scale - p2.x) + (p1.y * scale - p2.y) * (p1.y * scale - p2.y)) < app.DEFINE_SEARCH_RADIUS:
+    scale = app.viewport.scale
+    if math.sqrt((p1.x - p2.x) * (p1.x - p2.x) + (p1.y - p2.y) * (p1.y - p2.y)) * scale < app.DEFINE_SEARCH_RADIUS:
         return True
     return False 
 
@@ -663,90 +1928,115 @@ def FindNearestPoint(p1, p2):
 ################################################### 
 def DeleteGridObjects():
     app.grid.delete_objects(app.canvas)  
+    if app.overlay_patches != None:
+        app.overlay_patches.delete_objects(app.canvas)
+        app.overlay_patches = None
 
-    for i in range(app.cht.grid_patches.number_patches):
-        if app.cht.grid_patches.patches_lines[i].top != None:
-            app.canvas.delete(app.cht.grid_patches.patches_lines[i].top)     
-        if app.cht.grid_patches.patches_lines[i].right != None:
-            app.canvas.delete(app.cht.grid_patches.patches_lines[i].right)     
-        if app.cht.grid_patches.patches_lines[i].bottom != None:
-            app.canvas.delete(app.cht.grid_patches.patches_lines[i].bottom)     
-        if app.cht.grid_patches.patches_lines[i].left != None:
-            app.canvas.delete(app.cht.grid_patches.patches_lines[i].left) 
-        if app.cht.grid_patches.patches_triangles[i] != None:
-            app.canvas.delete(app.cht.grid_patches.patches_triangles[i])                         
+###################################################
+# Creates grid objects if they don't exist yet or
+# color checker layout has changed
+###################################################
+def CreateGridObjects():
+    if app.overlay_patches is not app.cht.grid_patches:
+        DeleteGridObjects()
+    if app.grid.has_objects() == False:
+        app.grid.create_objects(app.canvas, app.line_width)
+    if app.cht.grid_patches.has_objects() == False:
+        app.cht.grid_patches.create_objects(app.canvas, 1.5 * app.line_width)
+    app.overlay_patches = app.cht.grid_patches
 
 ###################################################
-# Draws all graphical object to Canvas
+# Draws all graphical object to Canvas, existing
+# canvas items are moved instead of recreated
 ################################################### 
 def DrawObjects():
     #update background
     width = app.canvas.winfo_width()
     height = app.canvas.winfo_height()
-    if app.background_id != None:
-        app.canvas.delete(app.background_id)
-    app.background_id = app.canvas.create_rectangle(0, 0, width, height, fill="black")
+    if app.background_id == None:
+        app.background_id = app.canvas.create_rectangle(0, 0, width, height, fill="black")
+    else:
+        app.canvas.coords(app.background_id, 0, 0, width, height)
 
     if app.resizedTestImageTk == None:
         return
 
     #display image
-    if app.image_id != None:
-        app.canvas.delete(app.image_id)
-    
-    offset_x = int((width - app.resizedTestImageTk.width() + 0.5) / 2)
-    app.image_id = app.canvas.create_image((offset_x, 0), image=app.resizedTestImageTk, anchor="nw")
-    image_pos = app.canvas.bbox(app.image_id)
+    if app.image_id == None:
+        app.image_id = app.canvas.create_image(app.display_pos, image=app.resizedTestImageTk, anchor="nw")
+    else:
+        app.canvas.coords(app.image_id, app.display_pos[0], app.display_pos[1])
+        if app.canvas.itemcget(app.image_id, "image") != str(app.resizedTestImageTk):
+            app.canvas.itemconfigure(app.image_id, image=app.resizedTestImageTk)
+    view = app.viewport
 
     #draw grid or crop if enabled
     if app.draw_grid:
-        DeleteGridObjects()
+        CreateGridObjects()
         radius = app.DEFINE_SEARCH_RADIUS
-        scale = app.proportion / app.proportion_grid_init
-        app.grid.lt_circle = app.canvas.create_oval(app.grid.frame.tetra.lt.x  * scale - radius + image_pos[0], app.grid.frame.tetra.lt.y  * scale - radius, app.grid.frame.tetra.lt.x  * scale + radius + image_pos[0], app.grid.frame.tetra.lt.y  * scale + radius, outline="red", dash=(3,5))
-        app.grid.rt_circle = app.canvas.create_oval(app.grid.frame.tetra.rt.x * scale - radius + image_pos[0], app.grid.frame.tetra.rt.y * scale - radius, app.grid.frame.tetra.rt.x * scale + radius + image_pos[0], app.grid.frame.tetra.rt.y * scale + radius, outline="red", dash=(3,5))
-        app.grid.rb_circle = app.canvas.create_oval(app.grid.frame.tetra.rb.x * scale - radius + image_pos[0], app.grid.frame.tetra.rb.y * scale - radius, app.grid.frame.tetra.rb.x * scale + radius + image_pos[0], app.grid.frame.tetra.rb.y * scale + radius, outline="red", dash=(3,5))
-        app.grid.lb_circle = app.canvas.create_oval(app.grid.frame.tetra.lb.x * scale - radius + image_pos[0], app.grid.frame.tetra.lb.y * scale - radius, app.grid.frame.tetra.lb.x * scale + radius + image_pos[0], app.grid.frame.tetra.lb.y  * scale + radius, outline="red", dash=(3,5))
+        app.canvas.itemconfigure("grid", state=tk.NORMAL)
+        tetra = app.grid.frame.tetra
+        lt = view.ToCanvas(tetra.lt.x, tetra.lt.y)
+        rt = view.ToCanvas(tetra.rt.x, tetra.rt.y)
+        rb = view.ToCanvas(tetra.rb.x, tetra.rb.y)
+        lb = view.ToCanvas(tetra.lb.x, tetra.lb.y)
+        app.canvas.coords(app.grid.lt_circle, lt[0] - radius, lt[1] - radius, lt[0] + radius, lt[1] + radius)
+        app.canvas.coords(app.grid.rt_circle, rt[0] - radius, rt[1] - radius, rt[0] + radius, rt[1] + radius)
+        app.canvas.coords(app.grid.rb_circle, rb[0] - radius, rb[1] - radius, rb[0] + radius, rb[1] + radius)
+        app.canvas.coords(app.grid.lb_circle, lb[0] - radius, lb[1] - radius, lb[0] + radius, lb[1] + radius)
         
-        app.grid.lt_frame_corner.line1 = app.canvas.create_line(app.grid.frame.tetra.lt.x  * scale + image_pos[0], app.grid.frame.tetra.lt.y  * scale, app.grid.frame.tetra.lt.x * scale + radius + image_pos[0], app.grid.frame.tetra.lt.y * scale, fill="white", width=app.line_width * scale, dash=(3,5))
-        app.grid.lt_frame_corner.line2 = app.canvas.create_line(app.grid.frame.tetra.lt.x  * scale + image_pos[0], app.grid.frame.tetra.lt.y  * scale, app.grid.frame.tetra.lt.x * scale + image_pos[0], app.grid.frame.tetra.lt.y * scale + radius, fill="white", width=app.line_width * scale, dash=(3,5))
+        app.canvas.coords(app.grid.lt_frame_corner.line1, lt[0], lt[1], lt[0] + radius, lt[1])
+        app.canvas.coords(app.grid.lt_frame_corner.line2, lt[0], lt[1], lt[0], lt[1] + radius)
 
-        app.grid.rt_frame_corner.line1 = app.canvas.create_line(app.grid.frame.tetra.rt.x  * scale + image_pos[0], app.grid.frame.tetra.rt.y  * scale, app.grid.frame.tetra.rt.x * scale - radius + image_pos[0], app.grid.frame.tetra.rt.y * scale, fill="white", width=app.line_width * scale, dash=(3,5))
-        app.grid.rt_frame_corner.line2 = app.canvas.create_line(app.grid.frame.tetra.rt.x  * scale + image_pos[0], app.grid.frame.tetra.rt.y  * scale, app.grid.frame.tetra.rt.x * scale + image_pos[0], app.grid.frame.tetra.rt.y * scale + radius, fill="white", width=app.line_width * scale, dash=(3,5))
+        app.canvas.coords(app.grid.rt_frame_corner.line1, rt[0], rt[1], rt[0] - radius, rt[1])
+        app.canvas.coords(app.grid.rt_frame_corner.line2, rt[0], rt[1], rt[0], rt[1] + radius)
 
-        app.grid.rb_frame_corner.line1 = app.canvas.create_line(app.grid.frame.tetra.rb.x  * scale + image_pos[0], app.grid.frame.tetra.rb.y  * scale, app.grid.frame.tetra.rb.x * scale - radius + image_pos[0], app.grid.frame.tetra.rb.y * scale, fill="white", width=app.line_width * scale, dash=(3,5))
-        app.grid.rb_frame_corner.line2 = app.canvas.create_line(app.grid.frame.tetra.rb.x  * scale + image_pos[0], app.grid.frame.tetra.rb.y  * scale, app.grid.frame.tetra.rb.x * scale + image_pos[0], app.grid.frame.tetra.rb.y * scale - radius, fill="white", width=app.line_width * scale, dash=(3,5))
+        app.canvas.coords(app.grid.rb_frame_corner.line1, rb[0], rb[1], rb[0] - radius, rb[1])
+        app.canvas.coords(app.grid.rb_frame_corner.line2, rb[0], rb[1], rb[0], rb[1] - radius)
 
-        app.grid.lb_frame_corner.line1 = app.canvas.create_line(app.grid.frame.tetra.lb.x  * scale + image_pos[0], app.grid.frame.tetra.lb.y  * scale, app.grid.frame.tetra.lb.x * scale + radius + image_pos[0], app.grid.frame.tetra.lb.y * scale, fill="white", width=app.line_width * scale, dash=(3,5))
-        app.grid.lb_frame_corner.line2 = app.canvas.create_line(app.grid.frame.tetra.lb.x  * scale + image_pos[0], app.grid.frame.tetra.lb.y  * scale, app.grid.frame.tetra.lb.x * scale + image_pos[0], app.grid.frame.tetra.lb.y * scale - radius, fill="white", width=app.line_width * scale, dash=(3,5))
+        app.canvas.coords(app.grid.lb_frame_corner.line1, lb[0], lb[1], lb[0] + radius, lb[1])
+        app.canvas.coords(app.grid.lb_frame_corner.line2, lb[0], lb[1], lb[0], lb[1] - radius)
 
+        patches = app.cht.grid_patches
+        SubmitPatchSampling()
+        result = app.patch_monitor.Result()
+        if result != None and len(result["delta_e"]) != patches.number_patches:
+            result = None
+        quads = TransformPatches() * view.scale + (view.pos_x, view.pos_y)
         i = 0
-        for y in range(app.cht.grid_patches.rows):
-            for x in range(app.cht.grid_patches.columns):   
-                lt = TransformPoint(app.cht.grid_patches.patches[i].lt)
-                rt = TransformPoint(app.cht.grid_patches.patches[i].rt)
-                rb = TransformPoint(app.cht.grid_patches.patches[i].rb)
-                lb = TransformPoint(app.cht.grid_patches.patches[i].lb)
-                color = "white"
-                if app.grid.start_point == CCornerPoints_enum.POINT_LT:
-                    color = app.cht.grid_patches.patches_colors[i]
-                if app.grid.start_point == CCornerPoints_enum.POINT_RT:
-                    color = app.cht.grid_patches.patches_colors[y * app.cht.grid_patches.columns - x + app.cht.grid_patches.columns - 1]    
-                if app.grid.start_point == CCornerPoints_enum.POINT_RB:
-                    color = app.cht.grid_patches.patches_colors[(app.cht.grid_patches.rows - 1 - y)  * app.cht.grid_patches.columns - x + app.cht.grid_patches.columns - 1] 
-                if app.grid.start_point == CCornerPoints_enum.POINT_LB:
-                    color = app.cht.grid_patches.patches_colors[(app.cht.grid_patches.rows - 1 - y)  * app.cht.grid_patches.columns + x]            
-                app.cht.grid_patches.patches_lines[i].top = app.canvas.create_line(lt.x * scale + image_pos[0], lt.y * scale, rt.x * scale + image_pos[0], rt.y * scale, fill="white", width=1.5 * app.line_width * scale, dash=(3,5))
-                app.cht.grid_patches.patches_lines[i].right = app.canvas.create_line(rt.x * scale + image_pos[0], rt.y * scale, rb.x * scale + image_pos[0], rb.y * scale, fill="white", width=1.5 * app.line_width * scale, dash=(3,5))
-                app.cht.grid_patches.patches_lines[i].bottom = app.canvas.create_line(rb.x * scale + image_pos[0], rb.y * scale, lb.x * scale + image_pos[0], lb.y * scale, fill="white", width=1.5 * app.line_width * scale, dash=(3,5))
-                app.cht.grid_patches.patches_lines[i].left = app.canvas.create_line(lb.x * scale + image_pos[0], lb.y * scale, lt.x * scale + image_pos[0], lt.y * scale, fill="white", width=1.5 * app.line_width * scale, dash=(3,5))
-                app.cht.grid_patches.patches_triangles[i] = app.canvas.create_polygon(lt.x * scale + image_pos[0] + 2, lt.y * scale + 2, rt.x * scale + image_pos[0] - 2, rt.y * scale + 2, lb.x * scale + image_pos[0] + 2, lb.y * scale - 2, lt.x * scale + image_pos[0] + 2, lt.y * scale + 2, outline=color, fill=color)
+        for y in range(patches.rows):
+            for x in range(patches.columns):   
+                lt, rt, rb, lb = quads[i].tolist()
+                color = patches.patches_colors[PatchIndex(x, y)]
+                app.canvas.coords(patches.patches_lines[i].top, lt[0], lt[1], rt[0], rt[1])
+                app.canvas.coords(patches.patches_lines[i].right, rt[0], rt[1], rb[0], rb[1])
+                app.canvas.coords(patches.patches_lines[i].bottom, rb[0], rb[1], lb[0], lb[1])
+                app.canvas.coords(patches.patches_lines[i].left, lb[0], lb[1], lt[0], lt[1])
+                app.canvas.coords(patches.patches_triangles[i], lt[0] + 2, lt[1] + 2, rt[0] - 2, rt[1] + 2, lb[0] + 2, lb[1] - 2, lt[0] + 2, lt[1] + 2)
+                if patches.drawn_colors[i] != color:
+                    app.canvas.itemconfigure(patches.patches_triangles[i], outline=color, fill=color)
+                    patches.drawn_colors[i] = color
+                #live readout of sampled values
+                app.canvas.coords(patches.patches_text[i], (lt[0] + rt[0] + rb[0] + lb[0]) / 4, (lt[1] + rt[1] + rb[1] + lb[1]) / 4)
+                if result != None:
+                    index = PatchIndex(x, y)
+                    app.canvas.itemconfigure(patches.patches_text[i], text="{:.1f} {:.1f} {:.1f}\n\u03c3 {:.1f}%\n\u0394E {:.1f}".format(*result["rgb"][index], result["noise"][index], result["delta_e"][index]), fill="red" if result["flags"][index] else "yellow")
                 i += 1
+        if result != None:
+            delta_e = result["delta_e"][np.isfinite(result["delta_e"])]
+            if len(delta_e) > 0:
+                app.canvas.itemconfigure(patches.summary_text, text="\u0394E mean {:.2f} max {:.2f}, {} patches flagged".format(delta_e.mean(), delta_e.max(), np.count_nonzero(result["flags"])))
+    elif app.grid.has_objects():
+        app.canvas.itemconfigure("grid", state=tk.HIDDEN)
     if app.draw_crop:
-        scale = app.proportion / app.proportion_crop_init
-        if app.crop_frame.rectangle != None:
-            app.canvas.delete(app.crop_frame.rectangle)
-        app.crop_frame.rectangle = app.canvas.create_rectangle(app.crop_frame.start.x * scale + image_pos[0], app.crop_frame.start.y * scale, app.crop_frame.stop.x * scale + image_pos[0], app.crop_frame.stop.y * scale, outline="red", width=app.line_width * scale, dash=(3,5)) 
+        if app.crop_frame.rectangle == None:
+            app.crop_frame.rectangle = app.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=app.line_width, dash=(3,5)) 
+        start = view.ToCanvas(app.crop_frame.start.x, app.crop_frame.start.y)
+        stop = view.ToCanvas(app.crop_frame.stop.x, app.crop_frame.stop.y)
+        app.canvas.coords(app.crop_frame.rectangle, start[0], start[1], stop[0], stop[1])
+        app.canvas.itemconfigure(app.crop_frame.rectangle, state=tk.NORMAL)
+    elif app.crop_frame.rectangle != None:
+        app.canvas.itemconfigure(app.crop_frame.rectangle, state=tk.HIDDEN)
 
 ###################################################
 # Handle to mouse double cleck
@@ -766,10 +2056,7 @@ def handle_mouse_rb_released(event):
     if app.draw_grid:
         if app.image_id == None:
             return
-        image_pos = app.canvas.bbox(app.image_id)
-        p = CPoint()
-        p.x = event.x - image_pos[0]
-        p.y = event.y
+        p = CPoint(*app.viewport.ToImage(event.x, event.y))
         if FindNearestPoint(app.grid.frame.tetra.lt, p): 
             app.grid.start_point = CCornerPoints_enum.POINT_LT 
         if FindNearestPoint(app.grid.frame.tetra.rt, p): 
@@ -778,7 +2065,7 @@ def handle_mouse_rb_released(event):
             app.grid.start_point = CCornerPoints_enum.POINT_RB 
         if FindNearestPoint(app.grid.frame.tetra.lb, p): 
             app.grid.start_point = CCornerPoints_enum.POINT_LB
-        DrawObjects() 
+        app.redraw.Request(overlay=True)
     if app.buttons.use_buttons == False and app.draw_crop == True:
         SetCropAreaButtonClick()
 
@@ -808,29 +2095,26 @@ def handle_mouse(event):
         return
     if app.image_id == None:
         return
-    image_pos = app.canvas.bbox(app.image_id)
-    if event.x > image_pos[0] and event.y > image_pos[1] and event.x < image_pos[2] and event.y < image_pos[3]:
-        x = event.x - image_pos[0]
-        y = event.y
+    if app.viewport.Contains(event.x, event.y):
+        x, y = app.viewport.ToImage(event.x, event.y)
         if "Motion" in str(event):
             button1_pressed = False
             if "Button1" in str(event):
                 button1_pressed = True
             if app.draw_grid:
                 if  button1_pressed and app.point_found == True: #left button pressed
-                    scale =  app.proportion_grid_init / app.proportion
                     if app.found_point_id == CCornerPoints_enum.POINT_LT:
-                        app.grid.frame.tetra.lt.x = x * scale
-                        app.grid.frame.tetra.lt.y = y * scale
+                        app.grid.frame.tetra.lt.x = x
+                        app.grid.frame.tetra.lt.y = y
                     if app.found_point_id == CCornerPoints_enum.POINT_RT:
-                        app.grid.frame.tetra.rt.x = x * scale
-                        app.grid.frame.tetra.rt.y = y * scale
+                        app.grid.frame.tetra.rt.x = x
+                        app.grid.frame.tetra.rt.y = y
                     if app.found_point_id == CCornerPoints_enum.POINT_RB:
-                        app.grid.frame.tetra.rb.x = x * scale
-                        app.grid.frame.tetra.rb.y = y * scale
+                        app.grid.frame.tetra.rb.x = x
+                        app.grid.frame.tetra.rb.y = y
                     if app.found_point_id == CCornerPoints_enum.POINT_LB:
-                        app.grid.frame.tetra.lb.x = x * scale
-                        app.grid.frame.tetra.lb.y = y * scale            
+                        app.grid.frame.tetra.lb.x = x
+                        app.grid.frame.tetra.lb.y = y            
                 elif button1_pressed and app.setting_grid:
                     app.grid.frame.stop.x = x
                     app.grid.frame.stop.y = y
@@ -851,7 +2135,6 @@ def handle_mouse(event):
                 app.grid.frame.start.y = y
                 app.grid.frame.stop.x = x
                 app.grid.frame.stop.y = y
-                app.proportion_grid_init =app.proportion
                 app.draw_grid = True
                 app.setting_grid = True
             else:
@@ -880,9 +2163,39 @@ def handle_mouse(event):
                         app.crop_frame.start.y = y
                         app.crop_frame.stop.x = x
                         app.crop_frame.stop.y = y
-                        app.proportion_crop_init = app.proportion
                         app.buttons.SetButtonState(CButtons_enum.CROP.value, tk.DISABLED)
-        DrawObjects()
+        app.redraw.Request(overlay=True)
+
+###################################################
+# Handle to V key, toggles candidate profile on displayed image
+###################################################
+def handle_key_profile_view(event):
+    if app.profile_view.Toggle():
+        app.redraw.Request(image=True)
+
+###################################################
+# Handle to mouse wheel, zooms image around cursor
+###################################################
+def handle_mouse_wheel(event):
+    if app.image_id == None:
+        return
+    if event.num == 4 or event.delta > 0:
+        factor = app.zoom_step
+    else:
+        factor = 1 / app.zoom_step
+    app.viewport.ZoomAt(event.x, event.y, factor)
+    app.redraw.Request(image=True)
+
+###################################################
+# Handle to mouse middle button, pans zoomed image
+###################################################
+def handle_mouse_pan(event):
+    if app.image_id == None:
+        return
+    if "Motion" in str(event):
+        app.viewport.Pan(event.x - app.pan_start.x, event.y - app.pan_start.y)
+        app.redraw.Request(image=True)
+    app.pan_start = CPoint(event.x, event.y)
 
 ###################################################
 # Image resizer
@@ -899,30 +2212,82 @@ def ResizeImage():
     if width <= 1 or height <= 1:
         return
 
-    if app.croppedTestImageTk == None:
+    image = GetImageView()
+    if image is None:
         return
-        
-    useHeight = height < width
-    if useHeight:
-        measurement = height
-    else:
-        measurement = width
+    app.viewport.SetSize(image.shape[1], image.shape[0], width, height)
+    RenderViewport(image)
 
-    if useHeight:
-        app.proportion = measurement / app.croppedTestImageTk.height
-    else:
-        app.proportion = measurement / app.croppedTestImageTk.width
-        
-    app.resizedTestImage = app.croppedTestImageTk.resize((int(app.croppedTestImageTk.width*app.proportion), int(app.croppedTestImageTk.height*app.proportion)))
+###################################################
+# Renders visible part of the image at viewport scale
+# image - cropped image view
+###################################################
+def RenderViewport(image):
+    view = app.viewport
+    app.pyramid.Build(image, app.edits.CropRect())
+    level = app.pyramid.Level(view.scale)
+    factor = level.shape[1] / image.shape[1]
+    #visible rectangle in level coordinates
+    x0, y0, x1, y1 = view.VisibleRect()
+    x0 = int(math.floor(x0 * factor))
+    y0 = int(math.floor(y0 * factor))
+    x1 = min(int(math.ceil(x1 * factor)), level.shape[1])
+    y1 = min(int(math.ceil(y1 * factor)), level.shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return
+    size = (max(int(round((x1 - x0) * view.scale / factor)), 1), max(int(round((y1 - y0) * view.scale / factor)), 1))
+    key = (level.shape, x0, y0, x1, y1, size, app.profile_view.Key())
+    display = app.pyramid.GetDisplay(key, app.edits.revision)
+    if display == None:
+        interpolation = cv2.INTER_NEAREST if view.scale > 1 else cv2.INTER_AREA
+        resized = cv2.resize(level[y0:y1, x0:x1], size, interpolation = interpolation)
+        resizedImage = MakeDisplayImage(resized)
+        display = (resizedImage, ImageTk.PhotoImage(resizedImage))
+        app.pyramid.PutDisplay(key, display)
+    app.resizedTestImage, app.resizedTestImageTk = display
+    app.display_pos = view.ToCanvas(x0 / factor, y0 / factor)
+
+###################################################
+# Redraws dirty parts of the window, called by
+# redraw scheduler at most once per display frame
+# image - display image has to be rescaled
+# overlay - canvas objects have to be updated
+# label - label text has changed
+###################################################
+def Redraw(image, overlay, label):
+    if label:
+        app.label["text"] = app.redraw.label_text
+    if image:
+        ResizeImage()
+    if overlay:
+        DrawObjects()
 
-    app.resizedTestImageTk = ImageTk.PhotoImage(app.resizedTestImage)
+###################################################
+# Sets label text on next redraw, text of other threads
+# is queued after their stage output lines
+###################################################
+def SetLabelText(text):
+    if threading.current_thread() is not threading.main_thread():
+        app.label_queue.put((None, text))
+        return
+    app.redraw.label_text = text
+    app.redraw.Request(label=True)
 
 ###################################################
 # Handle application events
 ###################################################
 def handle_configure(event):
-    ResizeImage()    
-    DrawObjects()
+    #<Configure> bound to root is also delivered for every child widget,
+    #only root and canvas size changes require image rescaling
+    if event.widget is not root and event.widget is not app.canvas:
+        app.redraw.Drop()
+        return
+    size = (event.width, event.height)
+    if app.widget_sizes.get(event.widget) == size:
+        app.redraw.Drop()
+        return
+    app.widget_sizes[event.widget] = size
+    app.redraw.Request(image=True)
 
 ###################################################
 # Image cropping
@@ -946,10 +2311,8 @@ def CropImage():
         else:
             y0 = app.crop_frame.stop.y
             y1 = app.crop_frame.start.y
-        CropImageBuffer(x0 / app.proportion, y0 / app.proportion, x1 / app.proportion, y1 / app.proportion)
-        ApplyWhiteBalance(app.croppedTestImageTk.mode)
-        ResizeImage()    
-        DrawObjects()
+        CropImageBuffer(x0, y0, x1, y1)
+        app.redraw.Request(image=True)
         app.buttons.SetButtonState(CButtons_enum.CROP.value, tk.DISABLED)
 
 ###################################################
@@ -1014,7 +2377,7 @@ def CheckSaveFiles():
     isGrid += app.grid.frame.tetra.lb.x
     isGrid += app.grid.frame.tetra.lb.y
     
-    if app.saveCroppedTestImageTk != None and isGrid != 0:
+    if app.imageBuffer is not None and isGrid != 0:
         app.buttons.SetButtonState(CButtons_enum.GENERATE.value, tk.NORMAL)
     else:
         app.buttons.SetButtonState(CButtons_enum.GENERATE.value, tk.DISABLED)
@@ -1029,8 +2392,7 @@ def OpenImageButtonClick():
     if filename != '':
         OpenImageFile(filename)
         SetDefaults()
-        ResizeImage()    
-        DrawObjects()
+        app.redraw.Request(image=True)
 
 ###################################################
 # Opens white balance file
@@ -1046,7 +2408,248 @@ def OpenWbButtonClick():
 def SaveImageButtonClick():
     types = [('TIF Files', '*.tif'), ('PNG Files', '*.png')]
     file = filedialog.asksaveasfile(title='save', filetypes=types, defaultextension=types)
-    app.saveCroppedTestImageTk.save(file.name)
+    cv2.imwrite(file.name, GetOutputImage())
+
+###################################################
+# Splits option string from configuration to argument list
+# options - e.g. "make-profile -g layout.json"
+###################################################
+def SplitOptions(options):
+    import shlex
+    return shlex.split(options, posix=(os.name != 'nt'))
+
+###################################################
+# Passes output line of external tool to label or console,
+# called by stage threads, label is updated by PollLabelQueue
+# name - stage name
+# line - output line without line end
+###################################################
+def StageOutput(name, line):
+    if app.label != None:
+        app.label_queue.put((name, line))
+    else:
+        print('[{}] {}'.format(name, line))
+
+###################################################
+# Shows last queued label text or output line of external
+# tools in label, runs on main thread every display frame
+###################################################
+def PollLabelQueue():
+    last = None
+    while True:
+        try:
+            last = app.label_queue.get_nowait()
+        except queue.Empty:
+            break
+    if last != None:
+        name, line = last
+        if name == None:
+            SetLabelText(line)
+        else:
+            preview = "" if app.preview == None else app.preview["summary"] + "\n"
+            SetLabelText('Generating files....\n{}[{}] {}'.format(preview, name, line))
+    root.after(max(1, int(app.redraw.frame_interval * 1000)), PollLabelQueue)
+
+###################################################
+# Fits matrix-only preview profile from patch means in memory,
+# takes milliseconds, so capture can be judged before dcamprof is done
+# image - cropped image in OpenCV channel order
+# quads - patch corners, array of shape (patches, 4, 2)
+# stats - patch statistics if patches have been sampled already
+# Returns dictionary with camera RGB to XYZ matrix, delta E 1976
+# of every patch, summary and rejection flag, None if .cht has no
+# reference values
+###################################################
+def PreviewProfile(image, quads, stats=None):
+    start = time.perf_counter()
+    xyz = ReferenceXYZ()
+    if xyz is None:
+        return None
+    if stats == None:
+        stats = SamplePatches(image, quads)
+    white_level = np.iinfo(image.dtype).max if np.issubdtype(image.dtype, np.integer) else 1.0
+    rgb = stats["mean"] / white_level
+    #clipped and unsampled patches do not constrain the matrix
+    clipped = (rgb.max(axis=1) >= 0.98) | (stats["count"] == 0)
+    valid = ~clipped
+    if valid.sum() < 3:
+        return None
+    matrix = FitPatchMatrix(rgb[valid], xyz[valid])[0]
+    #clipped patches are reported with error of the same matrix
+    delta_e = coloric_color.DeltaE76(coloric_color.XYZToLab(rgb @ matrix), coloric_color.XYZToLab(xyz))
+    order = np.argsort(np.where(valid, delta_e, -1))[::-1]
+    preview = {
+        "matrix": matrix.T.tolist(),
+        "white level": float(white_level),
+        "patches": {app.cht.patches_id[i]: {"rgb": rgb[i].tolist(), "delta e": float(delta_e[i]), "clipped": bool(clipped[i])} for i in range(len(rgb))},
+        "mean delta e": float(delta_e[valid].mean()),
+        "max delta e": float(delta_e[valid].max()),
+        "worst patches": [app.cht.patches_id[i] for i in order[0:5] if valid[i]],
+        "clipped patches": [app.cht.patches_id[i] for i in range(len(rgb)) if clipped[i]],
+        "time": (time.perf_counter() - start) * 1000}
+    preview["rejected"] = app.config.preview_reject_delta_e > 0 and preview["mean delta e"] > app.config.preview_reject_delta_e
+    preview["summary"] = 'Preview: mean \u0394E {:.2f}, max \u0394E {:.2f} ({}), {} clipped'.format(preview["mean delta e"], preview["max delta e"], " ".join(preview["worst patches"][0:3]), len(preview["clipped patches"]))
+    return preview
+
+###################################################
+# Makes preview profile of current grid and saves it to preview file
+# image - cropped image in OpenCV channel order
+# output_directory - directory of preview file
+# stats - patch statistics if patches have been sampled already
+# Returns preview dictionary or None
+###################################################
+def SavePreviewProfile(image, output_directory, stats=None):
+    if app.cht.grid_patches == None:
+        return None
+    try:
+        preview = PreviewProfile(image, PatchQuads(), stats)
+    except (OSError, ValueError, IndexError, np.linalg.LinAlgError) as error:
+        #preview is optional, dcamprof result does not depend on it
+        print('Preview profile failed: {}'.format(error), file=sys.stderr)
+        return None
+    if preview == None:
+        return None
+    if app.config.preview_file != "":
+        with open(output_directory + app.config.folder_separator + app.config.preview_file, "w") as f:
+            json.dump({key: value for key, value in preview.items() if key != "summary"}, f, indent=4)
+    print('{} in {:.1f} ms'.format(preview["summary"], preview["time"]))
+    if app.label != None:
+        SetLabelText('Generating files....\n' + preview["summary"])
+    if preview["rejected"]:
+        ShowWarning('Capture rejected: mean \u0394E {:.2f} of preview profile is above {}'.format(preview["mean delta e"], app.config.preview_reject_delta_e))
+    return preview
+
+###################################################
+# Applies candidate profile to displayed image, matrix of preview
+# profile and hue/saturation tables of generated .dcp file
+# output_directory - directory of generated files
+# Returns True if profile view is available
+###################################################
+def ShowCandidateProfile(output_directory):
+    if app.preview == None:
+        return False
+    tables = []
+    output_dcp_file = app.config.output_dcp_file
+    if output_dcp_file == "":
+        output_dcp_file = 'Output.dcp'
+    variant = ProfileVariants()[0]["name"]
+    dcp_file = VariantFile(output_directory + app.config.folder_separator + output_dcp_file, variant)
+    if app.config.make_dcp and os.path.exists(dcp_file):
+        try:
+            #tables are copied, so .dcp file is not kept mapped
+            dcp = coloric_dcp.CDcp().Open(dcp_file)
+            tables = [(np.array(table), srgb_value) for table, srgb_value in dcp.Tables()]
+            dcp.Close()
+        except (OSError, ValueError, struct.error) as error:
+            print('Unable to read tables of {}: {}'.format(dcp_file, error), file=sys.stderr)
+    app.profile_view.Set(app.preview["matrix"], tables)
+    app.redraw.Request(image=True)
+    return True
+
+###################################################
+# Returns profile variants from configuration, every variant is a dict
+# with name, dcamprof options, illuminant and profile name; without
+# variants in configuration single unnamed variant is returned
+###################################################
+def ProfileVariants():
+    variants = []
+    for content in app.config.profile_variants or [{"name": ""}]:
+        name = str(content.get("name", ""))
+        variants.append({
+            "name": name,
+            "dcamprof opt json": content.get("dcamprof opt json", app.config.dcamprof_opt_json),
+            "dcamprof opt dcp": content.get("dcamprof opt dcp", app.config.dcamprof_opt_dcp),
+            "calibration illuminant": content.get("calibration illuminant", app.config.calibration_illuminant),
+            "profile name": content.get("profile name", "{} {}".format(app.config.profile_name, name) if name != "" else app.config.profile_name)})
+    names = [variant["name"] for variant in variants]
+    if len(set(names)) != len(names):
+        raise ValueError("Profile variant names must be unique")
+    return variants
+
+###################################################
+# Returns output file name of profile variant, e.g. Image_neutral.dcp
+# file_name - output file name
+# name - variant name, unnamed variant keeps file name
+###################################################
+def VariantFile(file_name, name):
+    if name == "":
+        return file_name
+    root, extension = os.path.splitext(file_name)
+    return "{}_{}{}".format(root, name, extension)
+
+###################################################
+# Runs chain of external stages one by one, stops at first failure
+# pipeline - CPipeline, successful stages are committed to it
+# chain - list of (stage, script command, argument list, variant name)
+# log - opened log file
+# Returns 0 on success
+###################################################
+def RunChain(pipeline, chain, log):
+    for stage, command, args, variant in chain:
+        with app.runner.mutex:
+            log.write("$ {}".format(command))
+        returned_value = app.runner.Run(stage.name, args, app.config.stage_timeout, log)
+        if returned_value != 0:
+            return returned_value
+        pipeline.Commit([stage])
+    return 0
+
+###################################################
+# Runs external stages, shared stages (e.g. scanin) first,
+# then chains of profile variants concurrently
+# pipeline - CPipeline, successful stages are committed to it
+# stages - list of (stage, script command, argument list, variant name)
+# output_directory - directory of log file
+# Returns 0 on success
+###################################################
+def RunStages(pipeline, stages, output_directory):
+    import concurrent.futures
+    start = time.perf_counter()
+    app.runner.timings = []
+    chains = {}
+    for entry in stages:
+        chains.setdefault(entry[3], []).append(entry)
+    shared = chains.pop("", [])
+    log_file = app.config.log_file
+    if log_file != "":
+        log_file = output_directory + app.config.folder_separator + log_file
+    with open(log_file if log_file != "" else os.devnull, "a") as log:
+        log.write("# {}\n".format(datetime.datetime.now().isoformat(timespec="seconds")))
+        returned_value = RunChain(pipeline, shared, log)
+        if returned_value == 0 and len(chains) > 0:
+            workers = app.config.max_parallel_stages
+            if workers <= 0:
+                workers = os.cpu_count() or 1
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(chains))) as executor:
+                futures = [executor.submit(RunChain, pipeline, chain, log) for chain in chains.values()]
+                returned_values = [future.result() for future in futures]
+            returned_value = next((value for value in returned_values if value != 0), 0)
+        #report in order of stages, not in order of completion
+        order = {entry[0].name: index for index, entry in enumerate(stages)}
+        app.runner.timings.sort(key=lambda timing: order.get(timing[0], len(order)))
+        report = app.runner.Report(time.perf_counter() - start)
+        log.write(report + "\n")
+    print(report)
+    return returned_value
+
+###################################################
+# Returns hash of pixel data, shape and type of image
+# image - numpy array
+###################################################
+def HashArray(image):
+    digest = hashlib.sha256("{}{}".format(image.shape, image.dtype).encode("utf-8"))
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+###################################################
+# Returns hash of file content, empty string if file does not exist
+# file_name - Path and name of file
+###################################################
+def HashFile(file_name):
+    if file_name == "" or os.path.exists(file_name) == False:
+        return ""
+    with open(file_name, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
 ###################################################
 # Saves all output files
@@ -1057,59 +2660,69 @@ def SaveFilesButtonClick():
         if output_directory == "":
             output_directory = "." #os.getcwd()
         elif os.path.exists(output_directory) == False:
-            os.mkdir(output_directory)
+            os.makedirs(output_directory, exist_ok=True)
             
         #save image
         output_image_file = app.config.output_image_file
         if output_image_file == "":
-            messagebox.showwarning('Error', title='Output image name is not defined!!!')
+            ShowWarning('Output image name is not defined!!!')
             return 1
         image_file = output_directory + app.config.folder_separator + output_image_file    
-        if app.cv2Image.dtype == np.uint16:
-            cv2.imwrite(image_file, app.cv2Image)
-        else: 
-            app.saveCroppedTestImageTk.save(image_file) 
+        internal_sampler = app.config.patch_sampler == "internal"
+        #stages whose inputs have not changed since last run are skipped
+        state_file = None
+        if app.config.incremental_pipeline:
+            state_file = output_directory + app.config.folder_separator + ".coloric_pipeline.json"
+        pipeline = CPipeline(state_file)
+        stats = None
+        image = GetOutputImage()
+        image_digest = HashArray(image)
+        if internal_sampler == False:
+            image_stage = pipeline.Add("image", [image_digest], [image_file])
+            if pipeline.IsDone(image_stage) == False:
+                cv2.imwrite(image_file, image)
+                pipeline.Commit([image_stage])
         #save fiducial marks coordinates
         feducial_marks_file = app.config.feducial_marks_file
         if feducial_marks_file == "":
             feducial_marks_file = 'FiducialMarks.txt'
         fid_file = output_directory + app.config.folder_separator + feducial_marks_file
         if app.grid.start_point == CCornerPoints_enum.POINT_LT:
-            x0 = int(app.grid.frame.tetra.lt.x / app.proportion_grid_init)
-            y0 = int(app.grid.frame.tetra.lt.y / app.proportion_grid_init)
-            x1 = int(app.grid.frame.tetra.rt.x / app.proportion_grid_init)
-            y1 = int(app.grid.frame.tetra.rt.y / app.proportion_grid_init)
-            x2 = int(app.grid.frame.tetra.rb.x / app.proportion_grid_init)
-            y2 = int(app.grid.frame.tetra.rb.y / app.proportion_grid_init)
-            x3 = int(app.grid.frame.tetra.lb.x / app.proportion_grid_init)
-            y3 = int(app.grid.frame.tetra.lb.y / app.proportion_grid_init)
+            x0 = int(app.grid.frame.tetra.lt.x)
+            y0 = int(app.grid.frame.tetra.lt.y)
+            x1 = int(app.grid.frame.tetra.rt.x)
+            y1 = int(app.grid.frame.tetra.rt.y)
+            x2 = int(app.grid.frame.tetra.rb.x)
+            y2 = int(app.grid.frame.tetra.rb.y)
+            x3 = int(app.grid.frame.tetra.lb.x)
+            y3 = int(app.grid.frame.tetra.lb.y)
         if app.grid.start_point == CCornerPoints_enum.POINT_RT:
-            x0 = int(app.grid.frame.tetra.rt.x / app.proportion_grid_init)
-            y0 = int(app.grid.frame.tetra.rt.y / app.proportion_grid_init)
-            x1 = int(app.grid.frame.tetra.rb.x / app.proportion_grid_init)
-            y1 = int(app.grid.frame.tetra.rb.y / app.proportion_grid_init)
-            x2 = int(app.grid.frame.tetra.lb.x / app.proportion_grid_init)
-            y2 = int(app.grid.frame.tetra.lb.y / app.proportion_grid_init)
-            x3 = int(app.grid.frame.tetra.lt.x / app.proportion_grid_init)
-            y3 = int(app.grid.frame.tetra.lt.y / app.proportion_grid_init) 
+            x0 = int(app.grid.frame.tetra.rt.x)
+            y0 = int(app.grid.frame.tetra.rt.y)
+            x1 = int(app.grid.frame.tetra.rb.x)
+            y1 = int(app.grid.frame.tetra.rb.y)
+            x2 = int(app.grid.frame.tetra.lb.x)
+            y2 = int(app.grid.frame.tetra.lb.y)
+            x3 = int(app.grid.frame.tetra.lt.x)
+            y3 = int(app.grid.frame.tetra.lt.y) 
         if app.grid.start_point == CCornerPoints_enum.POINT_RB:
-            x0 = int(app.grid.frame.tetra.rb.x / app.proportion_grid_init)
-            y0 = int(app.grid.frame.tetra.rb.y / app.proportion_grid_init)
-            x1 = int(app.grid.frame.tetra.lb.x / app.proportion_grid_init)
-            y1 = int(app.grid.frame.tetra.lb.y / app.proportion_grid_init)
-            x2 = int(app.grid.frame.tetra.lt.x / app.proportion_grid_init)
-            y2 = int(app.grid.frame.tetra.lt.y / app.proportion_grid_init)
-            x3 = int(app.grid.frame.tetra.rt.x / app.proportion_grid_init)
-            y3 = int(app.grid.frame.tetra.rt.y / app.proportion_grid_init)
+            x0 = int(app.grid.frame.tetra.rb.x)
+            y0 = int(app.grid.frame.tetra.rb.y)
+            x1 = int(app.grid.frame.tetra.lb.x)
+            y1 = int(app.grid.frame.tetra.lb.y)
+            x2 = int(app.grid.frame.tetra.lt.x)
+            y2 = int(app.grid.frame.tetra.lt.y)
+            x3 = int(app.grid.frame.tetra.rt.x)
+            y3 = int(app.grid.frame.tetra.rt.y)
         if app.grid.start_point == CCornerPoints_enum.POINT_LB:
-            x0 = int(app.grid.frame.tetra.lb.x / app.proportion_grid_init)
-            y0 = int(app.grid.frame.tetra.lb.y / app.proportion_grid_init)
-            x1 = int(app.grid.frame.tetra.lt.x / app.proportion_grid_init)
-            y1 = int(app.grid.frame.tetra.lt.y / app.proportion_grid_init)
-            x2 = int(app.grid.frame.tetra.rt.x / app.proportion_grid_init)
-            y2 = int(app.grid.frame.tetra.rt.y / app.proportion_grid_init)
-            x3 = int(app.grid.frame.tetra.rb.x / app.proportion_grid_init)
-            y3 = int(app.grid.frame.tetra.rb.y / app.proportion_grid_init)           
+            x0 = int(app.grid.frame.tetra.lb.x)
+            y0 = int(app.grid.frame.tetra.lb.y)
+            x1 = int(app.grid.frame.tetra.lt.x)
+            y1 = int(app.grid.frame.tetra.lt.y)
+            x2 = int(app.grid.frame.tetra.rt.x)
+            y2 = int(app.grid.frame.tetra.rt.y)
+            x3 = int(app.grid.frame.tetra.rb.x)
+            y3 = int(app.grid.frame.tetra.rb.y)           
         fid = "{},{},{},{},{},{},{},{}".format(x0, y0, x1, y1, x2, y2, x3, y3)
 
         with open(fid_file, 'w') as f:
@@ -1117,45 +2730,106 @@ def SaveFilesButtonClick():
         #save scanin command  
         output_generate_file = app.config.output_generate_file
         if output_generate_file == "":
-            messagebox.showwarning('Error', title='Generate file is not defined!!!')
+            ShowWarning('Generate file is not defined!!!')
             return 1
         fid_file = output_directory + app.config.folder_separator + output_generate_file
         fid_file_ok = False
+        #external stages, written to generate file only if they have to be run
+        stages = []
         with open(fid_file, 'w') as f:
             cie_file = "{}cie".format(app.config.input_cht_file[:-3])
             if app.config.input_cie_file != "":
                 cie_file = app.config.input_cie_file
-            scanin = app.config.scanin
-            if scanin == "":
-                messagebox.showwarning('Error', title='scanin tool is not defined!!!')
-                return 1
             output_ti3_file = app.config.output_ti3_file
             if output_ti3_file == "":  
                 output_ti3_file = 'Output.ti3' 
-            scanin_cmd = ".{}{} -dipn -F {} -O \"{}\" \"{}\" \"{}\" \"{}\" \"{}diag.tif\"\n".format(app.config.folder_separator, scanin, fid, output_directory + app.config.folder_separator + output_ti3_file, image_file, app.config.input_cht_file, cie_file, output_directory + app.config.folder_separator)
-            f.write(scanin_cmd)
+            ti3_file = output_directory + app.config.folder_separator + output_ti3_file
+            if internal_sampler or app.config.preview_profile:
+                #patches are sampled from image buffer by internal sampler and preview profile
+                if app.cht.grid_patches == None and app.cht.Open_cht(app.config.input_cht_file) == 1:
+                    return 1
+            if internal_sampler:
+                #scanin step is not needed
+                if app.cht.grid_patches == None:
+                    ShowWarning('No patches found in .cht file!!!')
+                    return 1
+                quads = PatchQuads()
+                sample_stage = pipeline.Add("sample", [image_digest, quads.tobytes(), HashFile(app.config.input_cht_file), HashFile(cie_file)], [ti3_file])
+                if pipeline.IsDone(sample_stage) == False or app.config.preview_profile:
+                    stats = SamplePatches(image, quads)
+                if pipeline.IsDone(sample_stage) == False:
+                    WriteTi3File(ti3_file, stats, cie_file, np.iinfo(image.dtype).max)
+                    pipeline.Commit([sample_stage])
+                ti3_stage = sample_stage
+            else:
+                scanin = app.config.scanin
+                if scanin == "":
+                    ShowWarning('scanin tool is not defined!!!')
+                    return 1
+                scanin_cmd = ".{}{} -dipn -F {} -O \"{}\" \"{}\" \"{}\" \"{}\" \"{}diag.tif\"\n".format(app.config.folder_separator, scanin, fid, ti3_file, image_file, app.config.input_cht_file, cie_file, output_directory + app.config.folder_separator)
+                scanin_args = [".{}{}".format(app.config.folder_separator, scanin), "-dipn", "-F", fid, "-O", ti3_file, image_file, app.config.input_cht_file, cie_file, "{}{}diag.tif".format(output_directory, app.config.folder_separator)]
+                ti3_stage = pipeline.Add("scanin", [image_stage, scanin_cmd, HashFile(app.config.input_cht_file), HashFile(cie_file)], [ti3_file])
+                stages.append((ti3_stage, scanin_cmd, scanin_args, ""))
             dcamprof = app.config.dcamprof
             if dcamprof == "":
-                messagebox.showwarning('Error', title='dcamprof tool is not defined!!!')
+                ShowWarning('dcamprof tool is not defined!!!')
                 return 1
             output_json_file = app.config.output_json_file
             if output_json_file == "":  
                 output_json_file = 'Output.json'    
-            dcamprof_json = ".{}{} {} -i {} \"{}\" \"{}\"\n".format(app.config.folder_separator, dcamprof, app.config.dcamprof_opt_json, app.config.calibration_illuminant, output_directory + app.config.folder_separator + output_ti3_file, output_directory + app.config.folder_separator + output_json_file)
-            f.write(dcamprof_json)
             output_dcp_file = app.config.output_dcp_file
             if output_dcp_file == "":  
                 output_dcp_file = 'Output.dcp'
-            dcamprof_dcp = ".{}{} {} -n \"{}\" -d \"{}\" \"{}\" \"{}\"\n".format(app.config.folder_separator, dcamprof, app.config.dcamprof_opt_dcp, app.config.unique_camera_name, app.config.profile_name, output_directory + app.config.folder_separator + output_json_file, output_directory + app.config.folder_separator + output_dcp_file)
-            f.write(dcamprof_dcp)
+            #every variant shares .ti3 file and has its own make-profile and make-dcp
+            for variant in ProfileVariants():
+                name = variant["name"]
+                json_file = VariantFile(output_directory + app.config.folder_separator + output_json_file, name)
+                dcp_file = VariantFile(output_directory + app.config.folder_separator + output_dcp_file, name)
+                dcamprof_json = ".{}{} {} -i {} \"{}\" \"{}\"\n".format(app.config.folder_separator, dcamprof, variant["dcamprof opt json"], variant["calibration illuminant"], ti3_file, json_file)
+                dcamprof_json_args = [".{}{}".format(app.config.folder_separator, dcamprof)] + SplitOptions(variant["dcamprof opt json"]) + ["-i", variant["calibration illuminant"], ti3_file, json_file]
+                profile_stage = pipeline.Add("profile", [ti3_stage, dcamprof_json], [json_file])
+                profile_stage.name = "profile {}".format(name).strip()
+                stages.append((profile_stage, dcamprof_json, dcamprof_json_args, name))
+                if app.config.make_dcp == False:
+                    continue
+                dcamprof_dcp = ".{}{} {} -n \"{}\" -d \"{}\" \"{}\" \"{}\"\n".format(app.config.folder_separator, dcamprof, variant["dcamprof opt dcp"], app.config.unique_camera_name, variant["profile name"], json_file, dcp_file)
+                dcamprof_dcp_args = [".{}{}".format(app.config.folder_separator, dcamprof)] + SplitOptions(variant["dcamprof opt dcp"]) + ["-n", app.config.unique_camera_name, "-d", variant["profile name"], json_file, dcp_file]
+                dcp_stage = pipeline.Add("dcp", [profile_stage, dcamprof_dcp], [dcp_file])
+                dcp_stage.name = "dcp {}".format(name).strip()
+                stages.append((dcp_stage, dcamprof_dcp, dcamprof_dcp_args, name))
+            stages = [entry for entry in stages if pipeline.IsDone(entry[0]) == False]
+            for stage, command, args, variant in stages:
+                f.write(command)
             fid_file_ok = True
         returned_value = 0    
-        if fid_file_ok == True: 
+        if fid_file_ok == True and app.config.preview_profile and (len(stages) == 0 or app.config.stage_runner == "script"):
+            app.preview = SavePreviewProfile(image, output_directory, stats)
+            if app.preview != None and app.preview["rejected"]:
+                return 1
+        if fid_file_ok == True and len(stages) == 0:
+            print("All stages are up to date")
+        elif fid_file_ok == True and app.config.stage_runner == "script": 
             returned_value = os.system(app.config.executor.format(fid_file))     
+            if returned_value == 0:
+                pipeline.Commit([entry[0] for entry in stages])
+        elif fid_file_ok == True and app.config.preview_profile:
+            #external stages run in background while preview profile is made,
+            #rejected capture cancels them
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(RunStages, pipeline, stages, output_directory)
+                app.preview = SavePreviewProfile(image, output_directory, stats)
+                if app.preview != None and app.preview["rejected"]:
+                    app.runner.Cancel()
+                returned_value = future.result()
+            if app.preview != None and app.preview["rejected"]:
+                returned_value = 1
+        elif fid_file_ok == True:
+            returned_value = RunStages(pipeline, stages, output_directory)
         else:
             returned_value = 1 
-    except OSError as error: 
-        messagebox.showwarning('Error', title=error)
+    except (OSError, ValueError) as error: 
+        ShowWarning(error)
         returned_value = 1 
     return returned_value       
  
@@ -1178,7 +2852,7 @@ def DoCropButtonClick():
 def SetGridAreaButtonClick():
     SetDefaults()
     app.start_grid_rect = True
-    DrawObjects()
+    app.redraw.Request(overlay=True)
 
 ###################################################
 # Opens Colorchecker .cht file
@@ -1195,19 +2869,30 @@ def OpenCHTButtonClick():
  
 # Event handlers 
 #---------------------------------------------------    
-root.bind("<Configure>", handle_configure)
-app.canvas.bind("<Motion>", handle_mouse)
-app.canvas.bind('<Button-1>', handle_mouse)
-app.canvas.bind('<ButtonRelease-3>', handle_mouse_rb_released)
-app.canvas.bind('<Double-Button-1>', handle_mouse_double)
-app.canvas.bind('<ButtonRelease-1>', handle_mouse_lb_released)
+def BindEvents():
+    app.redraw.handler = Redraw
+    app.redraw.Poll()
+    PollPatchSampling()
+    PollLabelQueue()
+    root.bind("<Configure>", handle_configure)
+    app.canvas.bind("<Motion>", handle_mouse)
+    app.canvas.bind('<Button-1>', handle_mouse)
+    app.canvas.bind('<ButtonRelease-3>', handle_mouse_rb_released)
+    app.canvas.bind('<Double-Button-1>', handle_mouse_double)
+    app.canvas.bind('<ButtonRelease-1>', handle_mouse_lb_released)
+    app.canvas.bind('<MouseWheel>', handle_mouse_wheel)
+    app.canvas.bind('<Button-4>', handle_mouse_wheel)
+    app.canvas.bind('<Button-5>', handle_mouse_wheel)
+    app.canvas.bind('<ButtonPress-2>', handle_mouse_pan)
+    app.canvas.bind('<B2-Motion>', handle_mouse_pan)
+    root.bind('<Key-v>', handle_key_profile_view)
 
 #main
 #---------------------------------------------------
 def Usage():
     print('Coloric [options]')
     print('options:')
-    print('-i Input image (supported format .tif)')
+    print('-i Input image (supported format .tif, shm:<name> or mmap:<path> for raw RGB16 frame)')
     print('-t Input color checker cht file')
     print('-r White balance red coefficient')
     print('-g White balance green coefficient')
@@ -1216,102 +2901,628 @@ def Usage():
     print('-s Calibration illuminant')
     print('-o Output directory')
     print('-c Configuration json file')
+    print('-n Non-interactive (batch) mode, no window is shown')
+    print('-x Crop rectangle x0,y0,x1,y1 for batch mode, can be repeated')
+    print('-f Fiducial marks x0,y0,x1,y1,x2,y2,x3,y3 for batch mode')
+    print('-j Batch job json file (implies -n)')
+    print('-m Batch manifest json file, runs all its jobs in parallel')
+    print('-p Maximum number of parallel jobs for -m (default is number of CPUs)')
+    print('-D Dual illuminant job json file, profiles two captures in parallel and merges them to one .dcp')
+    print('-T Print startup time and redraw statistics report')
+    print('-P Copy input image to raw frame shm:<name> or mmap:<path> and exit (test producer)')
+    print('-W Run as worker, reading JSON commands from Unix socket path or "-" for stdin/stdout')
+    print('-Q Send JSON commands from stdin to worker listening on Unix socket path')
     print('-h Help')
-#--------------------------------------------------- 
-def main(argv):
-    app.config = CConfiguration() 
 
+###################################################
+# Parses comma separated list of numbers
+# text - string to parse
+# count - expected number of values
+###################################################
+def ParseNumbers(text, count):
+    values = [float(value) for value in text.split(",")]
+    if len(values) != count:
+        raise ValueError("{} values expected in '{}'".format(count, text))
+    return values
+
+###################################################
+# Opens batch job .json file
+# file_name - Path and name of .json file to open
+###################################################
+def OpenJobFile(file_name):
+    try:
+        with open(file_name, 'r') as f:
+            return ApplyJob(json.loads(f.read()))
+    except (OSError, ValueError) as error:
+        ShowWarning(error)
+        return 1
+
+###################################################
+# Applies batch job parameters
+# content - dictionary with job parameters
+###################################################
+def ApplyJob(content):
+    try:
+        if "config file" in content:
+            if app.config.ParseConfigFile(content["config file"]) == 1:
+                return 1
+        if "input image file" in content:
+            app.Input_image_file = content["input image file"]
+        if "input cht file" in content:
+            app.config.input_cht_file = content["input cht file"]
+        if "input cie file" in content:
+            app.config.input_cie_file = content["input cie file"]
+        if "white balance file" in content:
+            app.Input_wb_file = content["white balance file"]
+        if "white balance" in content:
+            app.wb_kr = float(content["white balance"].get("r", app.wb_kr))
+            app.wb_kg = float(content["white balance"].get("g", app.wb_kg))
+            app.wb_kb = float(content["white balance"].get("b", app.wb_kb))
+        if "calibration illuminant" in content:
+            app.config.calibration_illuminant = content["calibration illuminant"]
+        if "output directory" in content:
+            app.config.output_directory = content["output directory"]
+        if "unique camera name" in content:
+            app.config.unique_camera_name = content["unique camera name"]
+        if "profile name" in content:
+            app.config.profile_name = content["profile name"]
+        if "profile variants" in content:
+            app.config.profile_variants = list(content["profile variants"])
+        if "make dcp" in content:
+            app.config.make_dcp = bool(content["make dcp"])
+        if "crops" in content:
+            app.batch_crops = [[float(value) for value in crop] for crop in content["crops"]]
+        if "fiducial marks" in content:
+            app.batch_fiducials = [float(value) for value in content["fiducial marks"]]
+        return 0
+    except ValueError as error:
+        ShowWarning(error)
+        return 1
+
+###################################################
+# Parses command line options
+# argv - command line arguments
+# Returns list of (option, value) pairs
+###################################################
+def ParseArguments(argv):
     try:
-        opts, args = getopt.getopt(argv,"i:h:t:r:g:b:w:s:o:c:")
+        opts, args = getopt.getopt(argv,"i:h:t:r:g:b:w:s:o:c:nx:f:j:m:p:TW:Q:P:D:")
     except getopt.GetoptError:
         Usage()
         sys.exit(2)
-    for opt, arg in opts:
-        if opt == '-h':
-            Usage()
-            sys.exit(0)
-        elif opt in ("-i"):
-            app.Input_image_file = arg
-        elif opt in ("-t"):
-            app.config.input_cht_file = arg
-        elif opt in ("-r"):
-            app.wb_kr = float(arg)  
-        elif opt in ("-g"):
-            app.wb_kg = float(arg)  
-        elif opt in ("-b"):
-            app.wb_kb = float(arg) 
-        elif opt in ("-w"):
-            app.Input_wb_file = arg 
-        elif opt in ("-s"):
-            app.config.calibration_illuminant = arg 
-        elif opt in ("-o"):
-            app.config.output_directory = arg 
-        elif opt in ("-c"):
-            if app.config.ParseConfigFile(arg) == 1:
-                os._exit(1)
-            app.label.config(font=(app.config.label_font, app.config.label_font_size))
+    return opts
+
+###################################################
+# Runs whole pipeline for already opened image
+# Returns 0 on success
+###################################################
+def RunBatchJob():
+    if app.imageBuffer is None:
+        ShowWarning('Input image was not defined!!!')
+        return 1
+    #crop rectangles are relative to previous crop, as in GUI
+    for crop in app.batch_crops:
+        CropImageBuffer(*crop)
+    if app.batch_fiducials == None:
+        ShowWarning('Fiducial marks were not defined!!!')
+        return 1
+    #fiducial marks are in cropped image coordinates, first point is top left corner of the chart
+    tetra = app.grid.frame.tetra
+    tetra.lt.x, tetra.lt.y, tetra.rt.x, tetra.rt.y, tetra.rb.x, tetra.rb.y, tetra.lb.x, tetra.lb.y = app.batch_fiducials
+    app.grid.start_point = CCornerPoints_enum.POINT_LT
+    return SaveFilesButtonClick()
+
+###################################################
+# Runs one job of batch manifest, called in worker process
+# index - job index in manifest
+# job - dictionary with job parameters
+# Returns (index, exit code, wall time, cpu time)
+###################################################
+def RunManifestJob(index, job):
+    start_wall = time.perf_counter()
+    start_cpu = os.times()
+    InitApp(None)
+    app.buttons = CButtons(False)
+    try:
+        error = ApplyJob(job)
+        if error == 0:
+            error = main([], False)
+        if error == 0:
+            error = RunBatchJob()
+    except Exception as exception:
+        ShowWarning(exception)
+        error = 1
+    stop_cpu = os.times()
+    #scanin and dcamprof run as child processes
+    cpu = sum(stop_cpu[0:4]) - sum(start_cpu[0:4])
+    return (index, error, time.perf_counter() - start_wall, cpu)
+
+###################################################
+# Runs all jobs of batch manifest in process pool
+# file_name - Path and name of manifest .json file
+# workers - maximum number of parallel jobs, 0 for CPU count
+# Returns 0 if all jobs succeeded
+###################################################
+def RunManifest(file_name, workers=0):
+    import concurrent.futures
+    try:
+        with open(file_name, 'r') as f:
+            content = json.loads(f.read())
+    except (OSError, ValueError) as error:
+        print('Error: {}'.format(error), file=sys.stderr)
+        return 1
+    #all keys except "jobs" and "workers" are defaults for every job
+    defaults = {key: value for key, value in content.items() if key != "jobs" and key != "workers"}
+    if workers <= 0:
+        workers = int(content.get("workers", 0))
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    jobs = []
+    for index, job in enumerate(content.get("jobs", [])):
+        merged = dict(defaults, **job)
+        merged.setdefault("name", "job{}".format(index + 1))
+        #every job gets its own output directory unless it is set explicitly
+        if "output directory" not in job:
+            merged["output directory"] = os.path.join(defaults.get("output directory", "."), merged["name"])
+        jobs.append(merged)
+
+    start_wall = time.perf_counter()
+    results = [None] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(RunManifestJob, index, job) for index, job in enumerate(jobs)]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                index, error, wall, cpu = future.result()
+            except Exception as exception:
+                print('Error: {}'.format(exception), file=sys.stderr)
+                continue
+            results[index] = (error, wall, cpu)
+
+    print('{:<4} {:<24} {:>6} {:>10} {:>10}'.format('#', 'name', 'exit', 'wall, s', 'cpu, s'))
+    failed = 0
+    for index, job in enumerate(jobs):
+        if results[index] == None:
+            results[index] = (1, 0.0, 0.0)
+        error, wall, cpu = results[index]
+        if error != 0:
+            failed += 1
+        print('{:<4} {:<24} {:>6} {:>10.2f} {:>10.2f}'.format(index + 1, job["name"], error, wall, cpu))
+    print('{} jobs, {} failed, {} workers, {:.2f} s total'.format(len(jobs), failed, workers, time.perf_counter() - start_wall))
+    return 0 if failed == 0 else 1
+
+###################################################
+# Makes dual illuminant .dcp from two captures, every capture is
+# profiled in its own process and output subdirectory, so unchanged
+# capture is not processed again (see incremental pipeline)
+# file_name - Path and name of dual illuminant job .json file
+# Returns 0 on success
+###################################################
+def RunDualIlluminant(file_name):
+    import concurrent.futures
+    try:
+        with open(file_name, 'r') as f:
+            content = json.loads(f.read())
+    except (OSError, ValueError) as error:
+        print('Error: {}'.format(error), file=sys.stderr)
+        return 1
+    captures = content.get("captures", [])
+    if len(captures) != 2:
+        print('Error: two captures expected in {}'.format(file_name), file=sys.stderr)
+        return 1
+    #all keys except "captures" are defaults for both captures
+    defaults = {key: value for key, value in content.items() if key != "captures"}
+    InitApp(None)
+    app.buttons = CButtons(False)
+    if ApplyJob(defaults) != 0:
+        return 1
+    output_directory = app.config.output_directory
+    if output_directory == "":
+        output_directory = "."
+    jobs = []
+    for index, capture in enumerate(captures):
+        job = dict(defaults, **capture)
+        job.setdefault("name", job.get("calibration illuminant", "capture{}".format(index + 1)))
+        if "output directory" not in capture:
+            job["output directory"] = os.path.join(output_directory, job["name"])
+        #only make-profile for every capture, .dcp is made from both profiles below
+        job["make dcp"] = False
+        job["profile variants"] = []
+        jobs.append(job)
+    if jobs[0]["output directory"] == jobs[1]["output directory"]:
+        print('Error: captures need different output directories', file=sys.stderr)
+        return 1
+
+    start_wall = time.perf_counter()
+    results = [(1, 0.0, 0.0)] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(RunManifestJob, index, job) for index, job in enumerate(jobs)]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                index, error, wall, cpu = future.result()
+            except Exception as exception:
+                print('Error: {}'.format(exception), file=sys.stderr)
+                continue
+            results[index] = (error, wall, cpu)
+    for job, (error, wall, cpu) in zip(jobs, results):
+        print('{:<24} {:>6} {:>10.2f} {:>10.2f}'.format(job["name"], error, wall, cpu))
+    if any(error != 0 for error, wall, cpu in results):
+        return 1
+
+    #merge both profiles, first capture is illuminant 1 (e.g. StdA), second is illuminant 2 (e.g. D65)
+    dcamprof = app.config.dcamprof
+    if dcamprof == "":
+        ShowWarning('dcamprof tool is not defined!!!')
+        return 1
+    output_json_file = app.config.output_json_file
+    if output_json_file == "":
+        output_json_file = 'Output.json'
+    output_dcp_file = app.config.output_dcp_file
+    if output_dcp_file == "":
+        output_dcp_file = 'Output.dcp'
+    json_files = [job["output directory"] + app.config.folder_separator + output_json_file for job in jobs]
+    dcp_file = output_directory + app.config.folder_separator + output_dcp_file
+    try:
+        os.makedirs(output_directory, exist_ok=True)
+        dcamprof_dcp = ".{}{} {} -n \"{}\" -d \"{}\" \"{}\" \"{}\" \"{}\"\n".format(app.config.folder_separator, dcamprof, app.config.dcamprof_opt_dcp, app.config.unique_camera_name, app.config.profile_name, json_files[0], json_files[1], dcp_file)
+        dcamprof_dcp_args = [".{}{}".format(app.config.folder_separator, dcamprof)] + SplitOptions(app.config.dcamprof_opt_dcp) + ["-n", app.config.unique_camera_name, "-d", app.config.profile_name] + json_files + [dcp_file]
+        state_file = None
+        if app.config.incremental_pipeline:
+            state_file = output_directory + app.config.folder_separator + ".coloric_pipeline.json"
+        pipeline = CPipeline(state_file)
+        dcp_stage = pipeline.Add("dual dcp", [dcamprof_dcp] + [HashFile(json_file) for json_file in json_files], [dcp_file])
+        if pipeline.IsDone(dcp_stage):
+            print("All stages are up to date")
+            error = 0
+        else:
+            error = RunStages(pipeline, [(dcp_stage, dcamprof_dcp, dcamprof_dcp_args, "")], output_directory)
+    except (OSError, ValueError) as exception:
+        ShowWarning(exception)
+        error = 1
+    print('dual illuminant profile {} in {:.2f} s'.format(dcp_file if error == 0 else "failed", time.perf_counter() - start_wall))
+    return error
+
+###################################################
+# Applies command line options and opens input files
+# opts - parsed command line options
+# open_cht - if true, opens .cht file for grid preview
+# Returns 0 on success
+###################################################
+def main(opts, open_cht=True):
+    try:
+        for opt, arg in opts:
+            if opt == '-h':
+                Usage()
+                sys.exit(0)
+            elif opt in ("-i"):
+                app.Input_image_file = arg
+            elif opt in ("-t"):
+                app.config.input_cht_file = arg
+            elif opt in ("-r"):
+                app.wb_kr = float(arg)  
+            elif opt in ("-g"):
+                app.wb_kg = float(arg)  
+            elif opt in ("-b"):
+                app.wb_kb = float(arg) 
+            elif opt in ("-w"):
+                app.Input_wb_file = arg 
+            elif opt in ("-s"):
+                app.config.calibration_illuminant = arg 
+            elif opt in ("-o"):
+                app.config.output_directory = arg 
+            elif opt in ("-c"):
+                if app.config.ParseConfigFile(arg) == 1:
+                    return 1
+                if app.label != None:
+                    app.label.config(font=(app.config.label_font, app.config.label_font_size))
+            elif opt in ("-x"):
+                app.batch_crops.append(ParseNumbers(arg, 4))
+            elif opt in ("-f"):
+                app.batch_fiducials = ParseNumbers(arg, 8)
+            elif opt in ("-j"):
+                if OpenJobFile(arg) == 1:
+                    return 1
+            elif opt in ("-m", "-p", "-W", "-Q", "-P", "-D"):
+                pass
+            elif opt in ("-T"):
+                startup.enabled = True
+    except ValueError as error:
+        ShowWarning(error)
+        return 1
+    app.redraw.SetFrameRate(app.config.redraw_frame_rate)
+    startup.budget = app.config.startup_time_budget
+    startup.Mark("options parsed")
 
     if app.Input_wb_file:
         OpenWbFile(app.Input_wb_file)          
     if app.Input_image_file:
         if OpenImageFile(app.Input_image_file) == 1:
-            os._exit(1)
-        SetDefaults()
+            return 1
+        startup.Mark("image opened")
+        if app.root != None:
+            SetDefaults()
   
-        if app.config.input_cht_file != "":
+        if open_cht and app.config.input_cht_file != "":
             if app.cht.Open_cht(app.config.input_cht_file) == 1:
-                os._exit(1)    
+                return 1    
+            startup.Mark("cht opened")
             app.buttons.SetButtonState(CButtons_enum.SET_GRID.value, tk.NORMAL)
+    return 0
+
+###################################################
+# Runs whole pipeline without GUI
+# opts - parsed command line options
+# Returns 0 on success
+###################################################
+def RunBatch(opts):
+    InitApp(None)
+    app.buttons = CButtons(False)
+    if main(opts, False) != 0:
+        return 1
+    error = RunBatchJob()
+    startup.Mark("batch done")
+    startup.Report()
+    return error
+
+###################################################
+# Resets per-capture state, configuration, white balance
+# and parsed .cht file are kept for next capture
+###################################################
+def ResetCapture():
+    app.imageBuffer = None
+    app.imageSource = None
+    app.edits = CEditStack()
+    app.pyramid.Reset()
+    app.grid = CGrid()
+    app.Input_image_file = None
+    app.batch_crops = []
+    app.batch_fiducials = None
+    app.Input_wb_file = None
+    app.wb_kr = 1.0
+    app.wb_kg = 1.0
+    app.wb_kb = 1.0
+    app.preview = None
+    app.runner = CStageRunner()
+
+###################################################
+# Handles one worker command
+# command - dictionary with "command" key and parameters
+# Returns response dictionary
+###################################################
+def HandleWorkerCommand(command):
+    start = time.perf_counter()
+    name = command.get("command", "")
+    response = {"command": name, "status": 0}
+    if name == "capture":
+        ResetCapture()
+        error = ApplyJob(command)
+        if error == 0 and app.Input_wb_file:
+            OpenWbFile(app.Input_wb_file)
+        if error == 0 and app.config.input_cht_file != "" and app.cht.IsOpened(app.config.input_cht_file) == False:
+            #capture with other chart, compiled chart comes from target library
+            app.cht = Ccht()
+            error = app.cht.Open_cht(app.config.input_cht_file)
+        if error == 0 and app.Input_image_file:
+            error = OpenImageFile(app.Input_image_file)
+        if error == 0:
+            if app.batch_fiducials != None:
+                error = RunBatchJob()
+            else:
+                for crop in app.batch_crops:
+                    CropImageBuffer(*crop)
+            x0, y0, x1, y1 = app.edits.CropRect()
+            response["image size"] = [x1 - x0, y1 - y0]
+        if app.preview != None:
+            response["preview"] = {key: app.preview[key] for key in ("mean delta e", "max delta e", "worst patches", "clipped patches", "rejected")}
+        response["status"] = error
+    elif name == "white balance":
+        app.wb_kr = float(command.get("r", app.wb_kr))
+        app.wb_kg = float(command.get("g", app.wb_kg))
+        app.wb_kb = float(command.get("b", app.wb_kb))
+        if app.imageBuffer is not None:
+            app.edits.SetWhiteBalance(app.wb_kr, app.wb_kg, app.wb_kb, app.gamma)
+    elif name == "reload config":
+        config_file = command.get("config file", app.config.config_file)
+        app.config = CConfiguration()
+        if config_file != None and app.config.ParseConfigFile(config_file) == 1:
+            response["status"] = 1
+        elif app.config.input_cht_file != "":
+            #keep parsed chart warm for grid preview and sampling
+            app.cht = Ccht()
+            response["status"] = app.cht.Open_cht(app.config.input_cht_file)
+    elif name == "status":
+        response["config file"] = app.config.config_file
+        response["cht patches"] = app.cht.columns * app.cht.rows
+        response["image loaded"] = app.imageBuffer is not None
+        response["white balance"] = [app.wb_kr, app.wb_kg, app.wb_kb]
+    elif name != "quit":
+        response["status"] = 1
+        response["error"] = "unknown command"
+    response["time"] = (time.perf_counter() - start) * 1000
+    return response
+
+###################################################
+# Reads JSON commands line by line and writes responses
+# reader - file-like object with commands
+# writer - file-like object for responses
+# Returns False when worker has to quit
+###################################################
+def ServeWorkerStream(reader, writer):
+    for line in reader:
+        if line.strip() == "":
+            continue
+        try:
+            command = json.loads(line)
+            response = HandleWorkerCommand(command)
+        except Exception as exception:
+            command = {}
+            response = {"status": 1, "error": str(exception)}
+        writer.write(json.dumps(response) + "\n")
+        writer.flush()
+        if command.get("command") == "quit":
+            return False
+    return True
+
+###################################################
+# Runs coloric as long-lived worker process
+# opts - parsed command line options
+# address - Unix domain socket path, "-" for stdin/stdout
+# Returns 0 on success
+###################################################
+def RunWorker(opts, address):
+    InitApp(None)
+    app.buttons = CButtons(False)
+    if main(opts, False) != 0:
+        return 1
+    if app.config.input_cht_file != "":
+        app.cht.Open_cht(app.config.input_cht_file)
+    if address == "-":
+        #responses get own copy of stdout, output of scanin and dcamprof goes to stderr
+        responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        ServeWorkerStream(sys.stdin, responses)
+        return 0
+    import socket
+    if os.path.exists(address):
+        os.remove(address)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(address)
+    server.listen(1)
+    try:
+        running = True
+        while running:
+            connection, client_address = server.accept()
+            with connection, connection.makefile("r") as reader, connection.makefile("w") as writer:
+                running = ServeWorkerStream(reader, writer)
+    finally:
+        server.close()
+        os.remove(address)
+    return 0
+
+###################################################
+# Sends JSON commands from stdin to worker and prints responses
+# address - Unix domain socket path of the worker
+# Returns 0 if all commands succeeded
+###################################################
+def RunWorkerClient(address):
+    import socket
+    error = 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(address)
+        with client.makefile("r") as reader, client.makefile("w") as writer:
+            for line in sys.stdin:
+                if line.strip() == "":
+                    continue
+                writer.write(line.strip() + "\n")
+                writer.flush()
+                response = reader.readline()
+                print(response.strip())
+                if response == "" or json.loads(response).get("status", 1) != 0:
+                    error = 1
+    return error
+
+###################################################
+# Runs interactive application
+# opts - parsed command line options
+###################################################
+def RunGui(opts):
+    ImportGui()
+    InitApp(tk.Tk())
+    BindEvents()
+    app.buttons = CButtons(app.use_buttons) 
+    startup.Mark("window created")
+    #show window before image and .cht are loaded
+    root.update()
+    startup.Mark("first window")
+    if main(opts) != 0:
+        os._exit(1)
+    startup.Report()
+    if app.use_buttons == False:
+        app.thread_handle = threading.Thread(target=thread_function, args=(1,))
+        app.thread_handle.start() 
+ 
+    root.protocol("WM_DELETE_WINDOW", close_window)
+    root.mainloop()
 
 def thread_function(name):
-    if app.saveCroppedTestImageTk == None:
+    if app.imageBuffer is None:
         messagebox.showwarning('Error', 'Input image was not defined!!!')
         os._exit(1)
     app.mutex.acquire() 
     if app.finish_thread == True:
         return  
     for i in range(app.config.number_of_crops): 
-        app.label["text"] = '#' + str(i + 1) + ':' + 'Setting crop ROI: \n Hold mouse left button and move cursor to define ROI, \n Left button double click to apply, right click to reset'      
+        SetLabelText('#' + str(i + 1) + ':' + 'Setting crop ROI: \n Hold mouse left button and move cursor to define ROI, \n Left button double click to apply, right click to reset')
         SetCropAreaButtonClick() 
         app.mutex.acquire() 
         if app.finish_thread == True:
             return   
         app.proc_exec = True  
-        app.label["text"] = 'Processing....'  
+        SetLabelText('Processing....')
         CropImage()
         app.proc_exec = False 
-    app.label["text"] = 'Setting color patch grid: \n Hold mouse left button and move cursor to set grid, \n Left button double click to apply' 
+    SetLabelText('Setting color patch grid: \n Hold mouse left button and move cursor to set grid, \n Left button double click to apply')
     SetGridAreaButtonClick() 
     app.mutex.acquire() 
     if app.finish_thread == True:
         return  
     error = 0     
     if isGridSet():  
-        app.label["text"] = 'Generating files....'
+        SetLabelText('Generating files....')
         app.proc_exec = True
         error = SaveFilesButtonClick()
         app.proc_exec = False
     else: 
         messagebox.showwarning('Error', 'Grid has not been set!!!')
         error = 1
-    app.label["text"] = ('Done' if error == 0 else 'Failed') + ' \n Left button double click to close application'
+    preview = "" if app.preview == None else ' \n ' + app.preview["summary"]
+    output_directory = app.config.output_directory if app.config.output_directory != "" else "."
+    if error == 0 and ShowCandidateProfile(output_directory):
+        preview += ' \n V key toggles image with and without profile'
+    SetLabelText(('Done' if error == 0 else 'Failed') + preview + ' \n Left button double click to close application')
     app.mutex.acquire()   
+    if startup.enabled:
+        print(app.redraw.Statistics())
     os._exit(0 if error == 0 else 1)
 
 def close_window():
+    app.runner.Cancel()
     if app.thread_handle != None and app.thread_handle.is_alive():
         app.finish_thread = True
         app.mutex.release()
         app.thread_handle.join()
+    app.patch_monitor.Stop()
+    if startup.enabled:
+        print(app.redraw.Statistics())
     root.destroy()
     os._exit(1)
 
+startup.Mark("module loaded")
+
 if __name__ == "__main__":
-    app.buttons = CButtons(app.use_buttons) 
-    main(sys.argv[1:])
-    if app.use_buttons == False:
-        app.thread_handle = threading.Thread(target=thread_function, args=(1,))
-        app.thread_handle.start() 
- 
-root.protocol("WM_DELETE_WINDOW", close_window)
-root.mainloop()
+    opts = ParseArguments(sys.argv[1:])
+    worker = [arg for opt, arg in opts if opt == "-W"]
+    if worker:
+        sys.exit(RunWorker(opts, worker[-1]))
+    client = [arg for opt, arg in opts if opt == "-Q"]
+    if client:
+        sys.exit(RunWorkerClient(client[-1]))
+    producer = [arg for opt, arg in opts if opt == "-P"]
+    if producer:
+        image = [arg for opt, arg in opts if opt == "-i"]
+        WriteFrameBuffer(producer[-1], cv2.imread(image[-1], cv2.IMREAD_UNCHANGED)).close()
+        sys.exit(0)
+    dual = [arg for opt, arg in opts if opt == "-D"]
+    if dual:
+        sys.exit(RunDualIlluminant(dual[-1]))
+    manifest = [arg for opt, arg in opts if opt == "-m"]
+    if manifest:
+        try:
+            workers = [int(arg) for opt, arg in opts if opt == "-p"]
+        except ValueError:
+            Usage()
+            sys.exit(2)
+        sys.exit(RunManifest(manifest[-1], workers[-1] if workers else 0))
+    if any(opt in ("-n", "-j") for opt, arg in opts):
+        sys.exit(RunBatch(opts))
+    RunGui(opts)
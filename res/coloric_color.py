@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# IFF SDK samples (https://mr-te.ch/iff-sdk) are licensed under MIT License.
+#
+# Copyright (c) 2022-2026 MRTech SK, s.r.o.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+###############################################################
+# Colorimetric conversions for Coloric, all functions work on
+# arrays of shape (..., 3), XYZ values are scaled to Y = 1;
+# CGATS reader shared by Coloric and coloric_dcp
+###############################################################
+import numpy as np
+
+#reference whites (CIE 1931 2 degree observer)
+WHITE_D50 = np.array([0.96422, 1.0, 0.82521])
+WHITE_D65 = np.array([0.95047, 1.0, 1.08883])
+WHITE_A = np.array([1.09850, 1.0, 0.35585])
+WHITES = {"D50": WHITE_D50, "D65": WHITE_D65, "A": WHITE_A, "StdA": WHITE_A}
+
+#linear sRGB primaries, D65 white
+XYZ_TO_SRGB = np.array([[ 3.2404542, -1.5371385, -0.4985314],
+                        [-0.9692660,  1.8760108,  0.0415560],
+                        [ 0.0556434, -0.2040259,  1.0572252]])
+SRGB_TO_XYZ = np.linalg.inv(XYZ_TO_SRGB)
+
+#linear ProPhoto (ROMM) RGB primaries, D50 white, color space of DCP hue/saturation tables
+XYZ_TO_PROPHOTO = np.array([[ 1.3459433, -0.2556075, -0.0511118],
+                            [-0.5445989,  1.5081673,  0.0205351],
+                            [ 0.0000000,  0.0000000,  1.2118128]])
+PROPHOTO_TO_XYZ = np.linalg.inv(XYZ_TO_PROPHOTO)
+
+BRADFORD = np.array([[ 0.8951,  0.2664, -0.1614],
+                     [-0.7502,  1.7135,  0.0367],
+                     [ 0.0389, -0.0685,  1.0296]])
+
+LAB_EPSILON = 216 / 24389
+LAB_KAPPA = 24389 / 27
+
+###################################################
+# Returns 3x3 Bradford chromatic adaptation matrix
+# source_white - white of input XYZ
+# target_white - white of output XYZ
+###################################################
+def BradfordMatrix(source_white, target_white):
+    source = BRADFORD @ np.asarray(source_white, dtype=np.float64)
+    target = BRADFORD @ np.asarray(target_white, dtype=np.float64)
+    return np.linalg.inv(BRADFORD) @ np.diag(target / source) @ BRADFORD
+
+###################################################
+# Adapts XYZ values from one illuminant to another
+# xyz - array of shape (..., 3)
+# source_white - white of input XYZ
+# target_white - white of output XYZ
+###################################################
+def ChromaticAdaptation(xyz, source_white, target_white):
+    if np.array_equal(source_white, target_white):
+        return np.asarray(xyz, dtype=np.float64)
+    return np.asarray(xyz, dtype=np.float64) @ BradfordMatrix(source_white, target_white).T
+
+###################################################
+# Converts XYZ to CIE L*a*b*
+# xyz - array of shape (..., 3)
+# white - reference white, D50 by default
+###################################################
+def XYZToLab(xyz, white=WHITE_D50):
+    t = np.asarray(xyz, dtype=np.float64) / np.asarray(white)
+    f = np.where(t > LAB_EPSILON, np.cbrt(t), (LAB_KAPPA * t + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+###################################################
+# Converts CIE L*a*b* to XYZ
+# lab - array of shape (..., 3)
+# white - reference white, D50 by default
+###################################################
+def LabToXYZ(lab, white=WHITE_D50):
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    t = np.where(f ** 3 > LAB_EPSILON, f ** 3, (116 * f - 16) / LAB_KAPPA)
+    #lightness is linear below epsilon regardless of a*, b*
+    t[..., 1] = np.where(lab[..., 0] > LAB_KAPPA * LAB_EPSILON, fy ** 3, lab[..., 0] / LAB_KAPPA)
+    return t * np.asarray(white)
+
+###################################################
+# Converts XYZ to linear sRGB
+# xyz - array of shape (..., 3)
+# white - white of input XYZ, adapted to D65 by Bradford
+###################################################
+def XYZToLinearSRGB(xyz, white=WHITE_D50):
+    return ChromaticAdaptation(xyz, white, WHITE_D65) @ XYZ_TO_SRGB.T
+
+###################################################
+# Converts linear sRGB to XYZ
+# rgb - array of shape (..., 3)
+# white - white of output XYZ, adapted from D65 by Bradford
+###################################################
+def LinearSRGBToXYZ(rgb, white=WHITE_D50):
+    return ChromaticAdaptation(np.asarray(rgb, dtype=np.float64) @ SRGB_TO_XYZ.T, WHITE_D65, white)
+
+###################################################
+# Applies sRGB transfer curve, values are not clipped
+# rgb - linear values, array of shape (..., 3)
+###################################################
+def LinearToSRGB(rgb):
+    rgb = np.asarray(rgb, dtype=np.float64)
+    return np.where(rgb <= 0.0031308, rgb * 12.92, 1.055 * np.power(np.maximum(rgb, 0.0031308), 1 / 2.4) - 0.055)
+
+###################################################
+# Removes sRGB transfer curve
+# rgb - encoded values, array of shape (..., 3)
+###################################################
+def SRGBToLinear(rgb):
+    rgb = np.asarray(rgb, dtype=np.float64)
+    return np.where(rgb <= 0.04045, rgb / 12.92, np.power((np.maximum(rgb, 0.04045) + 0.055) / 1.055, 2.4))
+
+###################################################
+# Converts XYZ to encoded sRGB in range 0..1 (not clipped)
+# xyz - array of shape (..., 3)
+# white - white of input XYZ
+###################################################
+def XYZToSRGB(xyz, white=WHITE_D50):
+    return LinearToSRGB(XYZToLinearSRGB(xyz, white))
+
+###################################################
+# Converts encoded sRGB in range 0..1 to XYZ
+# rgb - array of shape (..., 3)
+# white - white of output XYZ
+###################################################
+def SRGBToXYZ(rgb, white=WHITE_D50):
+    return LinearSRGBToXYZ(SRGBToLinear(rgb), white)
+
+###################################################
+# Converts CIE L*a*b* to encoded sRGB in range 0..1
+# lab - array of shape (..., 3)
+# white - reference white of L*a*b* values
+###################################################
+def LabToSRGB(lab, white=WHITE_D50):
+    return XYZToSRGB(LabToXYZ(lab, white), white)
+
+###################################################
+# Color difference CIE 1976
+# lab1, lab2 - arrays of shape (..., 3)
+# Returns array of shape (...)
+###################################################
+def DeltaE76(lab1, lab2):
+    return np.linalg.norm(np.asarray(lab1, dtype=np.float64) - np.asarray(lab2, dtype=np.float64), axis=-1)
+
+###################################################
+# Color difference CIEDE2000
+# lab1, lab2 - arrays of shape (..., 3)
+# kl, kc, kh - parametric weighting factors
+# Returns array of shape (...)
+###################################################
+def DeltaE2000(lab1, lab2, kl=1.0, kc=1.0, kh=1.0):
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    l1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    l2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+    c_mean = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    g = 0.5 * (1 - np.sqrt(c_mean ** 7 / (c_mean ** 7 + 25.0 ** 7)))
+    a1 = a1 * (1 + g)
+    a2 = a2 * (1 + g)
+    c1 = np.hypot(a1, b1)
+    c2 = np.hypot(a2, b2)
+    h1 = np.degrees(np.arctan2(b1, a1)) % 360
+    h2 = np.degrees(np.arctan2(b2, a2)) % 360
+    #hue difference and mean hue are undefined for achromatic colors
+    chroma = (c1 * c2) != 0
+    dh = h2 - h1
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(chroma, dh, 0)
+    dl = l2 - l1
+    dc = c2 - c1
+    dhh = 2 * np.sqrt(c1 * c2) * np.sin(np.radians(dh / 2))
+    l_mean = (l1 + l2) / 2
+    c_mean = (c1 + c2) / 2
+    h_mean = (h1 + h2) / 2
+    h_mean = np.where(np.abs(h1 - h2) > 180, np.where(h1 + h2 < 360, h_mean + 180, h_mean - 180), h_mean)
+    h_mean = np.where(chroma, h_mean, h1 + h2)
+    t = 1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean)) + 0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63))
+    sl = 1 + 0.015 * (l_mean - 50) ** 2 / np.sqrt(20 + (l_mean - 50) ** 2)
+    sc = 1 + 0.045 * c_mean
+    sh = 1 + 0.015 * c_mean * t
+    rt = -2 * np.sqrt(c_mean ** 7 / (c_mean ** 7 + 25.0 ** 7)) * np.sin(np.radians(60 * np.exp(-((h_mean - 275) / 25) ** 2)))
+    return np.sqrt((dl / (kl * sl)) ** 2 + (dc / (kc * sc)) ** 2 + (dhh / (kh * sh)) ** 2 + rt * (dc / (kc * sc)) * (dhh / (kh * sh)))
+
+###################################################
+# Converts RGB to hue, saturation and value as defined by DNG,
+# hue is in range 0..6, negative components are clipped
+# rgb - array of shape (..., 3), float32 is kept
+###################################################
+def RGBToHSV(rgb):
+    rgb = np.maximum(np.asarray(rgb), 0)
+    if rgb.dtype != np.float32:
+        rgb = rgb.astype(np.float64)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    v = rgb.max(axis=-1)
+    delta = v - rgb.min(axis=-1)
+    safe = np.where(delta > 0, delta, 1)
+    h = np.where(r == v, (g - b) / safe, np.where(g == v, 2 + (b - r) / safe, 4 + (r - g) / safe))
+    h = np.where(delta > 0, h % 6, 0)
+    s = np.where(v > 0, delta / np.where(v > 0, v, 1), 0)
+    return np.stack([h, s, v], axis=-1).astype(rgb.dtype)
+
+###################################################
+# Converts hue (0..6), saturation and value to RGB
+# hsv - array of shape (..., 3)
+###################################################
+def HSVToRGB(hsv):
+    hsv = np.asarray(hsv)
+    h, s, v = hsv[..., 0] % 6, hsv[..., 1], hsv[..., 2]
+    sector = np.floor(h)
+    f = h - sector
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+    sector = sector.astype(np.int64)[..., None]
+    choices = [np.stack(channels, axis=-1) for channels in ((v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q))]
+    return np.choose(np.clip(sector, 0, 5), choices)
+
+###################################################
+# Applies DCP hue/saturation/value table (HueSatMap, LookTable)
+# with trilinear interpolation, hue wraps around
+# rgb - linear ProPhoto RGB, array of shape (..., 3)
+# table - array of shape (value divisions, hue divisions,
+#         saturation divisions, 3) of hue shift in degrees,
+#         saturation scale and value scale
+# srgb_value - value axis is indexed and scaled in sRGB encoding
+###################################################
+def ApplyHueSatTable(rgb, table, srgb_value=False):
+    hsv = RGBToHSV(rgb)
+    dtype = hsv.dtype
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    if srgb_value:
+        v = LinearToSRGB(v).astype(dtype)
+    value_divisions, hue_divisions, sat_divisions = table.shape[0:3]
+    table = np.asarray(table, dtype=dtype)
+    hue = h * (hue_divisions / 6)
+    h0 = np.floor(hue).astype(np.int64)
+    fh = (hue - h0)[..., None]
+    h0 %= hue_divisions
+    h1 = (h0 + 1) % hue_divisions
+    sat = np.clip(s, 0, 1) * (sat_divisions - 1)
+    s0 = np.minimum(np.floor(sat).astype(np.int64), max(sat_divisions - 2, 0))
+    s1 = np.minimum(s0 + 1, sat_divisions - 1)
+    fs = np.clip(sat - s0, 0, 1)[..., None]
+    val = np.clip(v, 0, 1) * (value_divisions - 1)
+    v0 = np.minimum(np.floor(val).astype(np.int64), max(value_divisions - 2, 0))
+    v1 = np.minimum(v0 + 1, value_divisions - 1)
+    fv = np.clip(val - v0, 0, 1)[..., None]
+    def Lerp(value):
+        low = (table[value, h0, s0] * (1 - fs) + table[value, h0, s1] * fs) * (1 - fh)
+        high = (table[value, h1, s0] * (1 - fs) + table[value, h1, s1] * fs) * fh
+        return low + high
+    modifier = Lerp(v0) * (1 - fv) + Lerp(v1) * fv if value_divisions > 1 else Lerp(v0)
+    h = h + modifier[..., 0] * (6 / 360)
+    s = np.clip(s * modifier[..., 1], 0, 1)
+    v = v * modifier[..., 2]
+    if srgb_value:
+        v = SRGBToLinear(v).astype(dtype)
+    return HSVToRGB(np.stack([h, s, v], axis=-1))
+
+###################################################
+# Reads CGATS file (.cie, .ti3)
+# file_name - Path and name of file
+# Returns (list of field names, list of data rows)
+###################################################
+def ReadCgatsFile(file_name):
+    fields = []
+    rows = []
+    section = None
+    with open(file_name, "r") as f:
+        for line in f:
+            T = line.split()
+            if len(T) == 0 or T[0].startswith("#"):
+                continue
+            if T[0] in ("BEGIN_DATA_FORMAT", "BEGIN_DATA"):
+                section = T[0]
+            elif T[0] in ("END_DATA_FORMAT", "END_DATA"):
+                section = None
+            elif section == "BEGIN_DATA_FORMAT":
+                fields += T
+            elif section == "BEGIN_DATA":
+                rows.append([value.strip('"') for value in T])
+    return fields, rows
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# IFF SDK samples (https://mr-te.ch/iff-sdk) are licensed under MIT License.
+#
+# Copyright (c) 2022-2026 MRTech SK, s.r.o.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+###############################################################
+# DNG camera profile (.dcp) reader and writer for Coloric,
+# profile inspection, comparison and batch QA without external tools
+# usage: coloric_dcp.py [-t chart.ti3] [-k condition] [-e delta E] [-j] profile.dcp ...
+#        coloric_dcp.py -d profile1.dcp profile2.dcp
+###############################################################
+import os
+import sys
+import json
+import mmap
+import struct
+import getopt
+import numpy as np
+import coloric_color
+
+#TIFF field types: numpy type and size of one value, rationals are pairs
+TYPES = {1: ("u1", 1), 2: ("u1", 1), 3: ("u2", 2), 4: ("u4", 4), 5: ("u4", 8), 6: ("i1", 1), 7: ("u1", 1), 8: ("i2", 2), 9: ("i4", 4), 10: ("i4", 8), 11: ("f4", 4), 12: ("f8", 8)}
+ASCII = 2
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+SRATIONAL = 10
+FLOAT = 11
+RATIONAL_DENOMINATOR = 10000
+
+#DCP tags: name, code and type used for writing
+TAGS = {
+    "UniqueCameraModel": (50708, ASCII),
+    "ColorMatrix1": (50721, SRATIONAL),
+    "ColorMatrix2": (50722, SRATIONAL),
+    "ReductionMatrix1": (50725, SRATIONAL),
+    "ReductionMatrix2": (50726, SRATIONAL),
+    "CalibrationIlluminant1": (50778, SHORT),
+    "CalibrationIlluminant2": (50779, SHORT),
+    "ProfileCalibrationSignature": (50932, ASCII),
+    "ProfileName": (50936, ASCII),
+    "ProfileHueSatMapDims": (50937, LONG),
+    "ProfileHueSatMapData1": (50938, FLOAT),
+    "ProfileHueSatMapData2": (50939, FLOAT),
+    "ProfileToneCurve": (50940, FLOAT),
+    "ProfileEmbedPolicy": (50941, LONG),
+    "ProfileCopyright": (50942, ASCII),
+    "ForwardMatrix1": (50964, SRATIONAL),
+    "ForwardMatrix2": (50965, SRATIONAL),
+    "ProfileLookTableDims": (50981, LONG),
+    "ProfileLookTableData": (50982, FLOAT),
+    "ProfileHueSatMapEncoding": (51107, LONG),
+    "ProfileLookTableEncoding": (51108, LONG),
+    "BaselineExposureOffset": (51109, SRATIONAL),
+    "DefaultBlackRender": (51110, LONG),
+}
+NAMES = {code: name for name, (code, kind) in TAGS.items()}
+
+#EXIF light source codes of calibration illuminants
+ILLUMINANTS = {17: "StdA", 21: "D65", 23: "D50"}
+
+class CDcp():
+    #DNG camera profile: TIFF-like container with "IIRC" or "MMCR" header
+    #and one IFD; tag values are str for ASCII and numpy arrays otherwise,
+    #arrays of opened file are read-only views of its memory map
+    def __init__(self):
+        self.tags = {}
+        self.types = {}
+        self.file_name = None
+        self.map = None
+    def Open(self, file_name):
+        with open(file_name, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_name = file_name
+        self.tags = {}
+        self.types = {}
+        data = self.map
+        order = {b"II": "<", b"MM": ">"}.get(data[0:2])
+        if order == None or len(data) < 8 or struct.unpack(order + "H", data[2:4])[0] != 0x4352:
+            raise ValueError("{} is not a DCP file".format(file_name))
+        offset = struct.unpack(order + "I", data[4:8])[0]
+        count = struct.unpack(order + "H", data[offset:offset + 2])[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            code, kind, values, position = struct.unpack(order + "HHII", data[entry:entry + 12])
+            if kind not in TYPES:
+                continue
+            numpy_type, size = TYPES[kind]
+            if values * size <= 4:
+                position = entry + 8
+            if position + values * size > len(data):
+                raise ValueError("Tag {} of {} is out of file".format(code, file_name))
+            if kind == ASCII:
+                value = bytes(data[position:position + values]).split(b"\0")[0].decode("latin-1")
+            elif kind in (RATIONAL, SRATIONAL):
+                pairs = np.frombuffer(data, dtype=order + numpy_type, count=values * 2, offset=position).astype(np.float64).reshape(-1, 2)
+                value = np.divide(pairs[:, 0], pairs[:, 1], out=np.zeros(values), where=pairs[:, 1] != 0)
+            else:
+                value = np.frombuffer(data, dtype=order + numpy_type, count=values, offset=position)
+            self.tags[code] = value
+            self.types[code] = kind
+        return self
+    def Close(self):
+        self.tags = {}
+        if self.map != None:
+            try:
+                self.map.close()
+            except BufferError:
+                #arrays are still used, mapping is released with them
+                pass
+            self.map = None
+    def Save(self, file_name):
+        #little-endian, tags in ascending order, values follow the IFD
+        codes = sorted(self.tags)
+        ifd_size = 2 + len(codes) * 12 + 4
+        entries = []
+        blobs = b""
+        for code in codes:
+            kind = self.types.get(code, TAGS[NAMES[code]][1] if code in NAMES else FLOAT)
+            numpy_type, size = TYPES[kind]
+            value = self.tags[code]
+            if kind == ASCII:
+                raw = str(value).encode("latin-1") + b"\0"
+                count = len(raw)
+            elif kind in (RATIONAL, SRATIONAL):
+                value = np.asarray(value, dtype=np.float64).ravel()
+                pairs = np.stack([np.round(value * RATIONAL_DENOMINATOR), np.full(len(value), RATIONAL_DENOMINATOR)], axis=-1)
+                raw = pairs.astype("<" + numpy_type).tobytes()
+                count = len(value)
+            else:
+                value = np.asarray(value).ravel()
+                raw = value.astype("<" + numpy_type).tobytes()
+                count = len(value)
+            if len(raw) <= 4:
+                entries.append(struct.pack("<HHI", code, kind, count) + raw.ljust(4, b"\0"))
+            else:
+                entries.append(struct.pack("<HHII", code, kind, count, 8 + ifd_size + len(blobs)))
+                blobs += raw + b"\0" * (-len(raw) % 4)
+        #write to temporary file first, so readers never see partial file
+        temporary = "{}.{}".format(file_name, os.getpid())
+        with open(temporary, "wb") as f:
+            f.write(b"IIRC" + struct.pack("<IH", 8, len(codes)) + b"".join(entries) + struct.pack("<I", 0) + blobs)
+        os.replace(temporary, file_name)
+    def Get(self, name, default=None):
+        return self.tags.get(TAGS[name][0], default)
+    def Set(self, name, value):
+        code, kind = TAGS[name]
+        if value is None:
+            self.tags.pop(code, None)
+            self.types.pop(code, None)
+            return
+        self.tags[code] = value if kind == ASCII else np.asarray(value).ravel()
+        self.types[code] = kind
+    def Matrix(self, name):
+        #3x3 matrix, ColorMatrix maps XYZ to camera, ForwardMatrix white balanced camera to XYZ D50
+        value = self.Get(name)
+        if value is None or len(value) != 9:
+            return None
+        return np.asarray(value, dtype=np.float64).reshape(3, 3)
+    def Illuminant(self, index):
+        value = self.Get("CalibrationIlluminant{}".format(index))
+        return None if value is None else int(value[0])
+    def Index(self):
+        #illuminant used for single illuminant evaluation, the second one if present
+        return 2 if self.Matrix("ColorMatrix2") is not None else 1
+    def Table(self, name):
+        #returns (table, srgb_value) or None, table has shape
+        #(value divisions, hue divisions, saturation divisions, 3)
+        if name == "ProfileLookTableData":
+            dims, encoding = self.Get("ProfileLookTableDims"), self.Get("ProfileLookTableEncoding")
+        else:
+            dims, encoding = self.Get("ProfileHueSatMapDims"), self.Get("ProfileHueSatMapEncoding")
+        data = self.Get(name)
+        if dims is None or data is None or len(dims) < 3:
+            return None
+        hue_divisions, sat_divisions, value_divisions = (int(value) for value in dims[0:3])
+        value_divisions = max(value_divisions, 1)
+        if len(data) != value_divisions * hue_divisions * sat_divisions * 3:
+            raise ValueError("Size of {} does not match its dimensions".format(name))
+        return data.reshape(value_divisions, hue_divisions, sat_divisions, 3), encoding is not None and int(encoding[0]) == 1
+    def Tables(self, index=None):
+        #HueSatMap of illuminant and LookTable in order of application
+        if index == None:
+            index = self.Index()
+        tables = [self.Table("ProfileHueSatMapData{}".format(index)) or self.Table("ProfileHueSatMapData1"), self.Table("ProfileLookTableData")]
+        return [table for table in tables if table is not None]
+    def ToneCurve(self):
+        value = self.Get("ProfileToneCurve")
+        return None if value is None else np.asarray(value).reshape(-1, 2)
+
+###################################################
+# Returns maximum absolute second difference of DCP table along
+# hue (wraps around), saturation and value axes
+# table - array of shape (value, hue, saturation divisions, 3)
+# Returns array of (hue shift, saturation scale, value scale)
+###################################################
+def TableRoughness(table):
+    table = np.asarray(table, dtype=np.float64)
+    roughness = np.zeros(3)
+    hue = np.roll(table, -1, axis=1) - 2 * table + np.roll(table, 1, axis=1)
+    roughness = np.maximum(roughness, np.abs(hue).reshape(-1, 3).max(axis=0))
+    for axis in (0, 2):
+        if table.shape[axis] >= 3:
+            roughness = np.maximum(roughness, np.abs(np.diff(table, n=2, axis=axis)).reshape(-1, 3).max(axis=0))
+    return roughness
+
+###################################################
+# Converts camera RGB to XYZ D50 with profile matrices
+# dcp - CDcp
+# rgb - camera values, array of shape (..., 3)
+# index - calibration illuminant (1 or 2), see CDcp.Index
+###################################################
+def CameraToXYZ(dcp, rgb, index=None):
+    if index == None:
+        index = dcp.Index()
+    color_matrix = dcp.Matrix("ColorMatrix{}".format(index))
+    if color_matrix is None:
+        raise ValueError("ColorMatrix{} is missing".format(index))
+    white = coloric_color.WHITES.get(ILLUMINANTS.get(dcp.Illuminant(index)), coloric_color.WHITE_D50)
+    forward_matrix = dcp.Matrix("ForwardMatrix{}".format(index))
+    rgb = np.asarray(rgb, dtype=np.float64)
+    if forward_matrix is not None:
+        neutral = color_matrix @ white
+        return (rgb / neutral) @ forward_matrix.T
+    return coloric_color.ChromaticAdaptation(rgb @ np.linalg.inv(color_matrix).T, white, coloric_color.WHITE_D50)
+
+###################################################
+# Returns CIEDE2000 of chart patches rendered by profile (matrices,
+# HueSatMap and LookTable, without tone curve) against reference,
+# exposure is matched to reference by least squares of Y
+# dcp - CDcp
+# rgb - camera values of patches, array of shape (patches, 3)
+# xyz - reference values (D50, Y = 1), array of shape (patches, 3)
+# index - calibration illuminant (1 or 2), see CDcp.Index
+###################################################
+def ChartDeltaE(dcp, rgb, xyz, index=None):
+    if index == None:
+        index = dcp.Index()
+    estimate = CameraToXYZ(dcp, rgb, index)
+    estimate *= np.dot(estimate[:, 1], xyz[:, 1]) / max(np.dot(estimate[:, 1], estimate[:, 1]), 1e-12)
+    tables = dcp.Tables(index)
+    if len(tables) > 0:
+        prophoto = estimate @ coloric_color.XYZ_TO_PROPHOTO.T
+        for table, srgb_value in tables:
+            prophoto = coloric_color.ApplyHueSatTable(prophoto, table, srgb_value)
+        estimate = prophoto @ coloric_color.PROPHOTO_TO_XYZ.T
+    return coloric_color.DeltaE2000(coloric_color.XYZToLab(estimate), coloric_color.XYZToLab(xyz))
+
+###################################################
+# Reads camera RGB and reference XYZ of patches from .ti3 file
+# file_name - Path and name of .ti3 file
+# Returns (rgb, xyz), XYZ scaled to Y = 1
+###################################################
+def ReadTi3(file_name):
+    fields, rows = coloric_color.ReadCgatsFile(file_name)
+    def Columns(names):
+        return np.array([[float(row[fields.index(name)]) for name in names] for row in rows])
+    rgb = Columns(["RGB_R", "RGB_G", "RGB_B"])
+    if "XYZ_X" in fields:
+        return rgb, Columns(["XYZ_X", "XYZ_Y", "XYZ_Z"]) / 100
+    return rgb, coloric_color.LabToXYZ(Columns(["LAB_L", "LAB_A", "LAB_B"]))
+
+###################################################
+# Collects QA metrics and problems of profile
+# dcp - CDcp
+# chart - (rgb, xyz) of chart patches or None
+# max_condition - highest accepted condition number of matrices
+# max_delta_e - highest accepted mean CIEDE2000 on chart
+# Returns dictionary, "issues" lists problems found
+###################################################
+def Inspect(dcp, chart=None, max_condition=50, max_delta_e=3):
+    report = {"file": dcp.file_name, "profile name": dcp.Get("ProfileName", ""), "camera": dcp.Get("UniqueCameraModel", ""), "issues": []}
+    issues = report["issues"]
+    report["illuminants"] = [ILLUMINANTS.get(dcp.Illuminant(index), dcp.Illuminant(index)) for index in (1, 2) if dcp.Illuminant(index) != None]
+    for name in ("ColorMatrix1", "ColorMatrix2", "ForwardMatrix1", "ForwardMatrix2"):
+        matrix = dcp.Matrix(name)
+        if matrix is None:
+            continue
+        condition = float(np.linalg.cond(matrix))
+        report[name + " condition"] = condition
+        if np.isfinite(condition) == False or condition > max_condition:
+            issues.append("{} condition number {:.1f}".format(name, condition))
+    if dcp.Matrix("ColorMatrix1") is None:
+        issues.append("ColorMatrix1 is missing")
+    if dcp.Matrix("ColorMatrix2") is not None and dcp.Illuminant(2) == None:
+        issues.append("CalibrationIlluminant2 is missing")
+    for name in ("ProfileHueSatMapData1", "ProfileHueSatMapData2", "ProfileLookTableData"):
+        try:
+            table = dcp.Table(name)
+        except ValueError as error:
+            issues.append(str(error))
+            continue
+        if table is None:
+            continue
+        table = table[0]
+        report[name + " dims"] = list(table.shape[0:3])
+        report[name + " roughness"] = TableRoughness(table).tolist()
+        if np.isfinite(table).all() == False:
+            issues.append("{} contains non-finite values".format(name))
+        elif (table[..., 1:3] < 0).any():
+            issues.append("{} has negative scale".format(name))
+    curve = dcp.ToneCurve()
+    if curve is not None:
+        report["tone curve points"] = len(curve)
+        if (np.diff(curve[:, 0]) <= 0).any() or (np.diff(curve[:, 1]) < 0).any():
+            issues.append("ProfileToneCurve is not monotonic")
+    if chart != None and dcp.Matrix("ColorMatrix1") is not None:
+        delta_e = ChartDeltaE(dcp, chart[0], chart[1])
+        report["mean delta e"] = float(delta_e.mean())
+        report["max delta e"] = float(delta_e.max())
+        if report["mean delta e"] > max_delta_e:
+            issues.append("mean \u0394E {:.2f} on chart".format(report["mean delta e"]))
+    return report
+
+###################################################
+# Compares tags of two profiles
+# first, second - CDcp
+# Returns list of (tag name, difference description)
+###################################################
+def Diff(first, second):
+    differences = []
+    for code in sorted(set(first.tags) | set(second.tags)):
+        name = NAMES.get(code, str(code))
+        if code not in second.tags:
+            differences.append((name, "only in first"))
+        elif code not in first.tags:
+            differences.append((name, "only in second"))
+        elif isinstance(first.tags[code], str) or isinstance(second.tags[code], str):
+            if first.tags[code] != second.tags[code]:
+                differences.append((name, "'{}' != '{}'".format(first.tags[code], second.tags[code])))
+        elif first.tags[code].shape != second.tags[code].shape:
+            differences.append((name, "{} != {} values".format(len(first.tags[code]), len(second.tags[code]))))
+        else:
+            delta = np.abs(first.tags[code].astype(np.float64) - second.tags[code].astype(np.float64))
+            if delta.max(initial=0) > 0:
+                differences.append((name, "max difference {:.6g}, mean {:.6g}".format(delta.max(), delta.mean())))
+    return differences
+
+def Usage():
+    print('coloric_dcp.py [options] profile.dcp ...')
+    print('options:')
+    print('-t Chart .ti3 file, reports delta E of profiles on chart')
+    print('-k Maximum condition number of matrices (default is 50)')
+    print('-e Maximum mean delta E on chart (default is 3)')
+    print('-j Print one JSON line per profile')
+    print('-d Print differences of two profiles')
+    print('-h Help')
+
+###################################################
+# Inspects or compares profiles given on command line
+# argv - command line arguments
+# Returns 0 if no profile has issues
+###################################################
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "t:k:e:jdh")
+    except getopt.GetoptError:
+        Usage()
+        return 2
+    chart = None
+    max_condition = 50
+    max_delta_e = 3
+    as_json = False
+    diff = False
+    try:
+        for opt, arg in opts:
+            if opt == "-h":
+                Usage()
+                return 0
+            elif opt == "-t":
+                chart = ReadTi3(arg)
+            elif opt == "-k":
+                max_condition = float(arg)
+            elif opt == "-e":
+                max_delta_e = float(arg)
+            elif opt == "-j":
+                as_json = True
+            elif opt == "-d":
+                diff = True
+    except (OSError, ValueError) as error:
+        print('Error: {}'.format(error), file=sys.stderr)
+        return 1
+    if diff:
+        if len(args) != 2:
+            Usage()
+            return 2
+        differences = Diff(CDcp().Open(args[0]), CDcp().Open(args[1]))
+        for name, text in differences:
+            print('{:<32} {}'.format(name, text))
+        return 0 if len(differences) == 0 else 1
+    failed = 0
+    for file_name in args:
+        try:
+            report = Inspect(CDcp().Open(file_name), chart, max_condition, max_delta_e)
+        except (OSError, ValueError, struct.error) as error:
+            report = {"file": file_name, "issues": [str(error)]}
+        if len(report["issues"]) > 0:
+            failed += 1
+        if as_json:
+            print(json.dumps(report))
+            continue
+        conditions = " ".join("{:.1f}".format(report[key]) for key in sorted(report) if key.endswith("condition")) or "-"
+        delta_e = " \u0394E {:.2f}/{:.2f}".format(report["mean delta e"], report["max delta e"]) if "mean delta e" in report else ""
+        print('{} [{}] cond {}{} {}'.format(file_name, "/".join(str(name) for name in report.get("illuminants", [])), conditions, delta_e, "OK" if len(report["issues"]) == 0 else "; ".join(report["issues"])))
+    return 0 if failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# IFF SDK samples (https://mr-te.ch/iff-sdk) are licensed under MIT License.
+#
+# Copyright (c) 2022-2026 MRTech SK, s.r.o.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+###############################################################
+# Tests of coloric_color against colormath and CIEDE2000 test
+# data of Sharma, Wu, Dalal (2005)
+# run: python3 -m pytest res/test_coloric_color.py
+###############################################################
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import coloric_color
+
+try:
+    from colormath.color_objects import XYZColor, LabColor, sRGBColor
+    from colormath.color_conversions import convert_color
+    from colormath.color_diff import delta_e_cie1976
+    from colormath import chromatic_adaptation
+except ImportError:
+    convert_color = None
+
+#L1 a1 b1 L2 a2 b2 delta E 2000
+SHARMA_PAIRS = [
+    (50.0000, 2.6772, -79.7751, 50.0000, 0.0000, -82.7485, 2.0425),
+    (50.0000, 3.1571, -77.2803, 50.0000, 0.0000, -82.7485, 2.8615),
+    (50.0000, 2.8361, -74.0200, 50.0000, 0.0000, -82.7485, 3.4412),
+    (50.0000, -1.3802, -84.2814, 50.0000, 0.0000, -82.7485, 1.0000),
+    (50.0000, -1.1848, -84.8006, 50.0000, 0.0000, -82.7485, 1.0000),
+    (50.0000, -0.9009, -85.5211, 50.0000, 0.0000, -82.7485, 1.0000),
+    (50.0000, 0.0000, 0.0000, 50.0000, -1.0000, 2.0000, 2.3669),
+    (50.0000, -1.0000, 2.0000, 50.0000, 0.0000, 0.0000, 2.3669),
+    (50.0000, 2.4900, -0.0010, 50.0000, -2.4900, 0.0009, 7.1792),
+    (50.0000, 2.4900, -0.0010, 50.0000, -2.4900, 0.0010, 7.1792),
+    (50.0000, 2.4900, -0.0010, 50.0000, -2.4900, 0.0011, 7.2195),
+    (50.0000, 2.4900, -0.0010, 50.0000, -2.4900, 0.0012, 7.2195),
+    (50.0000, -0.0010, 2.4900, 50.0000, 0.0009, -2.4900, 4.8045),
+    (50.0000, -0.0010, 2.4900, 50.0000, 0.0010, -2.4900, 4.8045),
+    (50.0000, -0.0010, 2.4900, 50.0000, 0.0011, -2.4900, 4.7461),
+    (50.0000, 2.5000, 0.0000, 50.0000, 0.0000, -2.5000, 4.3065),
+    (50.0000, 2.5000, 0.0000, 73.0000, 25.0000, -18.0000, 27.1492),
+    (50.0000, 2.5000, 0.0000, 61.0000, -5.0000, 29.0000, 22.8977),
+    (50.0000, 2.5000, 0.0000, 56.0000, -27.0000, -3.0000, 31.9030),
+    (50.0000, 2.5000, 0.0000, 58.0000, 24.0000, 15.0000, 19.4535),
+    (50.0000, 2.5000, 0.0000, 50.0000, 3.1736, 0.5854, 1.0000),
+    (50.0000, 2.5000, 0.0000, 50.0000, 3.2972, 0.0000, 1.0000),
+    (50.0000, 2.5000, 0.0000, 50.0000, 1.8634, 0.5757, 1.0000),
+    (50.0000, 2.5000, 0.0000, 50.0000, 3.2592, 0.3350, 1.0000),
+    (60.2574, -34.0099, 36.2677, 60.4626, -34.1751, 39.4387, 1.2644),
+    (63.0109, -31.0961, -5.8663, 62.8187, -29.7946, -4.0864, 1.2630),
+    (61.2901, 3.7196, -5.3901, 61.4292, 2.2480, -4.9620, 1.8731),
+    (35.0831, -44.1164, 3.7933, 35.0232, -40.0716, 1.5901, 1.8645),
+    (22.7233, 20.0904, -46.6940, 23.0331, 14.9730, -42.5619, 2.0373),
+    (36.4612, 47.8580, 18.3852, 36.2715, 50.5065, 21.2231, 1.4146),
+    (90.8027, -2.0831, 1.4410, 91.1528, -1.6435, 0.0447, 1.4441),
+    (90.9257, -0.5406, -0.9208, 88.6381, -0.8985, -0.7239, 1.5381),
+    (6.7747, -0.2908, -2.4247, 5.8714, -0.0985, -2.2286, 0.6377),
+    (2.0776, 0.0795, -1.1350, 0.9033, -0.0636, -0.5514, 0.9082),
+]
+
+#colormath uses sRGB matrix and whites rounded to 4 decimals
+SRGB_TOLERANCE = 2e-4
+
+#XYZ (Y = 1) of in-gamut sRGB colors
+def RandomXYZ(count=200, seed=1):
+    rng = np.random.default_rng(seed)
+    return coloric_color.SRGBToXYZ(rng.uniform(0.02, 0.98, (count, 3)))
+
+class CDeltaE2000Test(unittest.TestCase):
+    def test_sharma_pairs(self):
+        pairs = np.array(SHARMA_PAIRS)
+        delta_e = coloric_color.DeltaE2000(pairs[:, 0:3], pairs[:, 3:6])
+        np.testing.assert_allclose(delta_e, pairs[:, 6], atol=1e-4)
+
+    def test_symmetric(self):
+        pairs = np.array(SHARMA_PAIRS)
+        np.testing.assert_allclose(coloric_color.DeltaE2000(pairs[:, 0:3], pairs[:, 3:6]), coloric_color.DeltaE2000(pairs[:, 3:6], pairs[:, 0:3]), atol=1e-9)
+
+class CRoundTripTest(unittest.TestCase):
+    def test_lab(self):
+        xyz = RandomXYZ()
+        np.testing.assert_allclose(coloric_color.LabToXYZ(coloric_color.XYZToLab(xyz)), xyz, atol=1e-12)
+
+    def test_srgb(self):
+        xyz = RandomXYZ()
+        np.testing.assert_allclose(coloric_color.SRGBToXYZ(coloric_color.XYZToSRGB(xyz)), xyz, atol=1e-12)
+
+    def test_adaptation(self):
+        xyz = RandomXYZ()
+        there = coloric_color.ChromaticAdaptation(xyz, coloric_color.WHITE_D50, coloric_color.WHITE_A)
+        np.testing.assert_allclose(coloric_color.ChromaticAdaptation(there, coloric_color.WHITE_A, coloric_color.WHITE_D50), xyz, atol=1e-12)
+        np.testing.assert_allclose(coloric_color.BradfordMatrix(coloric_color.WHITE_D65, coloric_color.WHITE_D50) @ coloric_color.WHITE_D65, coloric_color.WHITE_D50, atol=1e-12)
+
+@unittest.skipIf(convert_color == None, "colormath is not installed")
+class CColormathTest(unittest.TestCase):
+    def test_xyz_to_lab(self):
+        xyz = RandomXYZ()
+        lab = coloric_color.XYZToLab(xyz)
+        for i in range(len(xyz)):
+            expected = convert_color(XYZColor(*xyz[i], illuminant="d50"), LabColor, target_illuminant="d50").get_value_tuple()
+            np.testing.assert_allclose(lab[i], expected, atol=1e-3)
+
+    def test_lab_to_xyz(self):
+        lab = coloric_color.XYZToLab(RandomXYZ())
+        xyz = coloric_color.LabToXYZ(lab)
+        for i in range(len(lab)):
+            expected = convert_color(LabColor(*lab[i], illuminant="d50"), XYZColor, target_illuminant="d50").get_value_tuple()
+            np.testing.assert_allclose(xyz[i], expected, atol=1e-4)
+
+    def test_bradford(self):
+        xyz = RandomXYZ()
+        adapted = coloric_color.ChromaticAdaptation(xyz, coloric_color.WHITE_D65, coloric_color.WHITE_D50)
+        for i in range(len(xyz)):
+            expected = chromatic_adaptation.apply_chromatic_adaptation(*xyz[i], "d65", "d50", adaptation="bradford")
+            np.testing.assert_allclose(adapted[i], expected, atol=1e-4)
+
+    def test_xyz_to_srgb(self):
+        xyz = RandomXYZ()
+        rgb = coloric_color.XYZToSRGB(xyz)
+        for i in range(len(xyz)):
+            expected = convert_color(XYZColor(*xyz[i], illuminant="d50"), sRGBColor).get_value_tuple()
+            np.testing.assert_allclose(rgb[i], expected, atol=SRGB_TOLERANCE)
+
+    def test_srgb_to_xyz(self):
+        rgb = np.random.default_rng(2).uniform(0.02, 0.98, (200, 3))
+        xyz = coloric_color.SRGBToXYZ(rgb)
+        for i in range(len(rgb)):
+            expected = convert_color(sRGBColor(*rgb[i]), XYZColor, target_illuminant="d50").get_value_tuple()
+            np.testing.assert_allclose(xyz[i], expected, atol=SRGB_TOLERANCE)
+
+    def test_delta_e_76(self):
+        lab = coloric_color.XYZToLab(RandomXYZ(count=100))
+        other = coloric_color.XYZToLab(RandomXYZ(count=100, seed=3))
+        delta_e = coloric_color.DeltaE76(lab, other)
+        for i in range(len(lab)):
+            first, second = LabColor(*lab[i]), LabColor(*other[i])
+            try:
+                expected = delta_e_cie1976(first, second)
+            except AttributeError:
+                #colormath 3.0 calls numpy.asscalar removed from NumPy 1.23,
+                #its formula is applied to colormath Lab values instead
+                expected = np.linalg.norm(np.subtract(first.get_value_tuple(), second.get_value_tuple()))
+            self.assertAlmostEqual(delta_e[i], expected, places=9)
+
+if __name__ == "__main__":
+    unittest.main()
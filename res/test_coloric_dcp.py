@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# IFF SDK samples (https://mr-te.ch/iff-sdk) are licensed under MIT License.
+#
+# Copyright (c) 2022-2026 MRTech SK, s.r.o.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+###############################################################
+# Tests of coloric_dcp: .dcp round trip in both byte orders,
+# tables, tone curve, inspection, comparison and command line
+# run: python3 -m pytest res/test_coloric_dcp.py
+###############################################################
+import io
+import os
+import sys
+import json
+import struct
+import tempfile
+import unittest
+import contextlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import coloric_dcp
+
+COLOR_MATRIX = np.array([[0.8, -0.2, -0.1], [-0.4, 1.2, 0.2], [-0.05, 0.15, 0.6]])
+FORWARD_MATRIX = np.array([[0.6, 0.25, 0.1], [0.25, 0.8, -0.05], [0.0, -0.1, 0.9]])
+#hue, saturation and value divisions
+HUE_SAT_DIMS = (6, 4, 2)
+
+def HueSatData():
+    data = np.zeros(HUE_SAT_DIMS[2] * HUE_SAT_DIMS[0] * HUE_SAT_DIMS[1] * 3, dtype=np.float32)
+    data[0::3] = np.arange(len(data) // 3)
+    data[1::3] = 1.0
+    data[2::3] = 1.0
+    return data
+
+def MakeProfile():
+    dcp = coloric_dcp.CDcp()
+    dcp.Set("UniqueCameraModel", "Test Camera")
+    dcp.Set("ProfileName", "Test Profile")
+    dcp.Set("ColorMatrix1", COLOR_MATRIX)
+    dcp.Set("ForwardMatrix1", FORWARD_MATRIX)
+    dcp.Set("CalibrationIlluminant1", [23])
+    dcp.Set("ProfileHueSatMapDims", HUE_SAT_DIMS)
+    dcp.Set("ProfileHueSatMapData1", HueSatData())
+    dcp.Set("ProfileToneCurve", [0.0, 0.0, 0.25, 0.3, 1.0, 1.0])
+    return dcp
+
+###################################################
+# Writes big-endian ("MMCR") .dcp, CDcp.Save writes little-endian only
+# file_name - Path and name of .dcp file
+# tags - list of (code, type, raw big-endian value bytes, count)
+###################################################
+def WriteBigEndian(file_name, tags):
+    ifd_size = 2 + len(tags) * 12 + 4
+    entries = b""
+    blobs = b""
+    for code, kind, raw, count in tags:
+        if len(raw) <= 4:
+            entries += struct.pack(">HHI", code, kind, count) + raw.ljust(4, b"\0")
+        else:
+            entries += struct.pack(">HHII", code, kind, count, 8 + ifd_size + len(blobs))
+            blobs += raw
+    with open(file_name, "wb") as f:
+        f.write(b"MMCR" + struct.pack(">IH", 8, len(tags)) + entries + struct.pack(">I", 0) + blobs)
+
+###################################################
+# Writes .ti3 file with patches of given camera RGB and XYZ (Y = 1)
+###################################################
+def WriteTi3(file_name, rgb, xyz):
+    with open(file_name, "w") as f:
+        f.write("CTI3\n\nNUMBER_OF_FIELDS 7\nBEGIN_DATA_FORMAT\nSAMPLE_ID XYZ_X XYZ_Y XYZ_Z RGB_R RGB_G RGB_B\nEND_DATA_FORMAT\n\n")
+        f.write("NUMBER_OF_SETS {}\nBEGIN_DATA\n".format(len(rgb)))
+        for i in range(len(rgb)):
+            f.write("{} {} {}\n".format(i + 1, " ".join("{:.6f}".format(value) for value in xyz[i] * 100), " ".join("{:.6f}".format(value) for value in rgb[i])))
+        f.write("END_DATA\n")
+
+class CDcpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.opened = []
+    def tearDown(self):
+        for dcp in self.opened:
+            dcp.Close()
+        self.directory.cleanup()
+    def Path(self, name):
+        return os.path.join(self.directory.name, name)
+    def Open(self, file_name):
+        dcp = coloric_dcp.CDcp().Open(file_name)
+        self.opened.append(dcp)
+        return dcp
+    def Saved(self, dcp, name="profile.dcp"):
+        dcp.Save(self.Path(name))
+        return self.Path(name)
+    def Main(self, argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            returned_value = coloric_dcp.main(argv)
+        return returned_value, output.getvalue()
+
+class CRoundTripTest(CDcpTestCase):
+    def test_save_open(self):
+        dcp = self.Open(self.Saved(MakeProfile()))
+        self.assertEqual(dcp.Get("UniqueCameraModel"), "Test Camera")
+        self.assertEqual(dcp.Get("ProfileName"), "Test Profile")
+        self.assertEqual(dcp.Illuminant(1), 23)
+        self.assertEqual(dcp.Illuminant(2), None)
+        self.assertEqual(dcp.Index(), 1)
+        #rationals are stored with denominator RATIONAL_DENOMINATOR
+        np.testing.assert_allclose(dcp.Matrix("ColorMatrix1"), COLOR_MATRIX, atol=0.5 / coloric_dcp.RATIONAL_DENOMINATOR)
+        np.testing.assert_allclose(dcp.Matrix("ForwardMatrix1"), FORWARD_MATRIX, atol=0.5 / coloric_dcp.RATIONAL_DENOMINATOR)
+        np.testing.assert_array_equal(dcp.Get("ProfileHueSatMapData1"), HueSatData())
+        self.assertEqual(dcp.Matrix("ColorMatrix2"), None)
+
+    def test_save_opened(self):
+        first = self.Open(self.Saved(MakeProfile()))
+        second = self.Open(self.Saved(first, "copy.dcp"))
+        self.assertEqual(coloric_dcp.Diff(first, second), [])
+        with open(self.Path("profile.dcp"), "rb") as f, open(self.Path("copy.dcp"), "rb") as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_little_endian_header(self):
+        with open(self.Saved(MakeProfile()), "rb") as f:
+            self.assertEqual(f.read(4), b"IIRC")
+
+    def test_big_endian(self):
+        matrix = np.round(COLOR_MATRIX * 10000).astype(np.int64)
+        rationals = np.stack([matrix.ravel(), np.full(9, 10000)], axis=-1).astype(">i4").tobytes()
+        curve = np.array([0.0, 0.0, 1.0, 1.0], dtype=">f4").tobytes()
+        WriteBigEndian(self.Path("big.dcp"), [
+            (50708, coloric_dcp.ASCII, b"Big\0", 4),
+            (50721, coloric_dcp.SRATIONAL, rationals, 9),
+            (50778, coloric_dcp.SHORT, struct.pack(">H", 21), 1),
+            (50940, coloric_dcp.FLOAT, curve, 4)])
+        dcp = self.Open(self.Path("big.dcp"))
+        self.assertEqual(dcp.Get("UniqueCameraModel"), "Big")
+        self.assertEqual(dcp.Illuminant(1), 21)
+        np.testing.assert_allclose(dcp.Matrix("ColorMatrix1"), COLOR_MATRIX, atol=1e-12)
+        np.testing.assert_array_equal(dcp.ToneCurve(), [[0, 0], [1, 1]])
+        #saved again as little-endian with same values
+        copy = self.Open(self.Saved(dcp, "little.dcp"))
+        self.assertEqual(coloric_dcp.Diff(dcp, copy), [])
+
+    def test_not_dcp(self):
+        with open(self.Path("image.tif"), "wb") as f:
+            f.write(b"II*\0" + struct.pack("<I", 8) + b"\0" * 8)
+        with self.assertRaises(ValueError):
+            self.Open(self.Path("image.tif"))
+
+    def test_set_none_removes_tag(self):
+        dcp = MakeProfile()
+        dcp.Set("ProfileToneCurve", None)
+        self.assertEqual(dcp.ToneCurve(), None)
+        self.assertEqual(self.Open(self.Saved(dcp)).ToneCurve(), None)
+
+class CTableTest(CDcpTestCase):
+    def test_table_shape(self):
+        table, srgb_value = self.Open(self.Saved(MakeProfile())).Table("ProfileHueSatMapData1")
+        hue_divisions, sat_divisions, value_divisions = HUE_SAT_DIMS
+        self.assertEqual(table.shape, (value_divisions, hue_divisions, sat_divisions, 3))
+        self.assertFalse(srgb_value)
+        #values are stored with value outermost and saturation innermost
+        for value in range(value_divisions):
+            for hue in range(hue_divisions):
+                for sat in range(sat_divisions):
+                    self.assertEqual(table[value, hue, sat, 0], (value * hue_divisions + hue) * sat_divisions + sat)
+
+    def test_no_value_divisions(self):
+        dcp = MakeProfile()
+        dcp.Set("ProfileHueSatMapDims", (6, 4, 0))
+        dcp.Set("ProfileHueSatMapData1", HueSatData()[0:6 * 4 * 3])
+        dcp.Set("ProfileHueSatMapEncoding", [1])
+        table, srgb_value = dcp.Table("ProfileHueSatMapData1")
+        self.assertEqual(table.shape, (1, 6, 4, 3))
+        self.assertTrue(srgb_value)
+
+    def test_size_mismatch(self):
+        dcp = MakeProfile()
+        dcp.Set("ProfileHueSatMapDims", (6, 5, 2))
+        with self.assertRaises(ValueError):
+            dcp.Table("ProfileHueSatMapData1")
+        self.assertIn("Size of ProfileHueSatMapData1 does not match its dimensions", coloric_dcp.Inspect(dcp)["issues"])
+
+    def test_tables(self):
+        dcp = MakeProfile()
+        self.assertEqual(dcp.Table("ProfileLookTableData"), None)
+        self.assertEqual(len(dcp.Tables()), 1)
+        dcp.Set("ProfileLookTableDims", (2, 2, 1))
+        dcp.Set("ProfileLookTableData", np.tile([0.0, 1.0, 1.0], 4))
+        tables = dcp.Tables()
+        self.assertEqual([table.shape for table, _ in tables], [(2, 6, 4, 3), (1, 2, 2, 3)])
+
+    def test_roughness(self):
+        table = np.zeros((1, 6, 4, 3))
+        table[..., 1:3] = 1.0
+        np.testing.assert_array_equal(coloric_dcp.TableRoughness(table), [0, 0, 0])
+        table[0, 2, 1, 0] = 3.0
+        np.testing.assert_array_equal(coloric_dcp.TableRoughness(table), [6, 0, 0])
+
+    def test_tone_curve(self):
+        curve = self.Open(self.Saved(MakeProfile())).ToneCurve()
+        np.testing.assert_allclose(curve, [[0, 0], [0.25, 0.3], [1, 1]], atol=1e-7)
+
+class CInspectTest(CDcpTestCase):
+    def test_clean_profile(self):
+        report = coloric_dcp.Inspect(self.Open(self.Saved(MakeProfile())))
+        self.assertEqual(report["issues"], [])
+        self.assertEqual(report["camera"], "Test Camera")
+        self.assertEqual(report["profile name"], "Test Profile")
+        self.assertEqual(report["illuminants"], ["D50"])
+        self.assertEqual(report["ProfileHueSatMapData1 dims"], [2, 6, 4])
+        self.assertEqual(report["tone curve points"], 3)
+        self.assertAlmostEqual(report["ColorMatrix1 condition"], np.linalg.cond(COLOR_MATRIX), places=2)
+        json.dumps(report)
+
+    def test_issues(self):
+        dcp = MakeProfile()
+        dcp.Set("ColorMatrix2", np.diag([1.0, 1.0, 1e-3]))
+        data = HueSatData()
+        data[1] = -1.0
+        dcp.Set("ProfileHueSatMapData1", data)
+        dcp.Set("ProfileToneCurve", [0.0, 0.0, 0.5, 0.6, 0.4, 1.0])
+        issues = coloric_dcp.Inspect(dcp)["issues"]
+        self.assertIn("ColorMatrix2 condition number 1000.0", issues)
+        self.assertIn("CalibrationIlluminant2 is missing", issues)
+        self.assertIn("ProfileHueSatMapData1 has negative scale", issues)
+        self.assertIn("ProfileToneCurve is not monotonic", issues)
+
+    def test_missing_color_matrix(self):
+        dcp = MakeProfile()
+        dcp.Set("ColorMatrix1", None)
+        self.assertIn("ColorMatrix1 is missing", coloric_dcp.Inspect(dcp)["issues"])
+
+    def test_chart(self):
+        #identity matrix profile calibrated at D50 renders camera RGB as XYZ
+        dcp = coloric_dcp.CDcp()
+        dcp.Set("ColorMatrix1", np.eye(3))
+        dcp.Set("CalibrationIlluminant1", [23])
+        xyz = np.random.default_rng(1).uniform(0.05, 0.9, (24, 3))
+        report = coloric_dcp.Inspect(dcp, (xyz, xyz))
+        self.assertLess(report["max delta e"], 1e-6)
+        self.assertEqual(report["issues"], [])
+        report = coloric_dcp.Inspect(dcp, (xyz * [1.3, 1.0, 0.8], xyz), max_delta_e=1)
+        self.assertGreater(report["mean delta e"], 1)
+        self.assertIn("mean ΔE {:.2f} on chart".format(report["mean delta e"]), report["issues"])
+
+    def test_read_ti3(self):
+        rgb = np.random.default_rng(2).uniform(0, 100, (5, 3))
+        xyz = np.random.default_rng(3).uniform(0.05, 0.9, (5, 3))
+        WriteTi3(self.Path("chart.ti3"), rgb, xyz)
+        chart = coloric_dcp.ReadTi3(self.Path("chart.ti3"))
+        np.testing.assert_allclose(chart[0], rgb, atol=1e-6)
+        np.testing.assert_allclose(chart[1], xyz, atol=1e-8)
+
+class CDiffTest(CDcpTestCase):
+    def test_diff(self):
+        first = MakeProfile()
+        second = MakeProfile()
+        self.assertEqual(coloric_dcp.Diff(first, second), [])
+        second.Set("ProfileName", "Other")
+        second.Set("ColorMatrix1", COLOR_MATRIX + 0.5)
+        second.Set("ProfileToneCurve", None)
+        second.Set("ProfileHueSatMapData1", HueSatData()[0:12])
+        second.Set("CalibrationIlluminant2", [17])
+        differences = dict(coloric_dcp.Diff(first, second))
+        self.assertEqual(differences["ProfileName"], "'Test Profile' != 'Other'")
+        self.assertTrue(differences["ColorMatrix1"].startswith("max difference 0.5,"))
+        self.assertEqual(differences["ProfileToneCurve"], "only in first")
+        self.assertEqual(differences["CalibrationIlluminant2"], "only in second")
+        self.assertEqual(differences["ProfileHueSatMapData1"], "{} != 12 values".format(len(HueSatData())))
+        self.assertEqual(len(differences), 5)
+
+class CCommandLineTest(CDcpTestCase):
+    def test_help(self):
+        returned_value, output = self.Main(["-h"])
+        self.assertEqual(returned_value, 0)
+        self.assertIn("-d Print differences of two profiles", output)
+
+    def test_bad_options(self):
+        self.assertEqual(self.Main(["-x"])[0], 2)
+        self.assertEqual(self.Main(["-k", "many", self.Saved(MakeProfile())])[0], 1)
+        self.assertEqual(self.Main(["-t", self.Path("missing.ti3")])[0], 1)
+        self.assertEqual(self.Main(["-d", self.Saved(MakeProfile())])[0], 2)
+
+    def test_inspect(self):
+        good = self.Saved(MakeProfile())
+        returned_value, output = self.Main([good])
+        self.assertEqual(returned_value, 0)
+        self.assertTrue(output.startswith(good + " [D50] cond "))
+        self.assertTrue(output.rstrip().endswith("OK"))
+        bad = MakeProfile()
+        bad.Set("ColorMatrix1", np.diag([1.0, 1.0, 1e-3]))
+        bad = self.Saved(bad, "bad.dcp")
+        self.assertEqual(self.Main([good, bad])[0], 1)
+        with open(self.Path("broken.dcp"), "wb") as f:
+            f.write(b"IIRC")
+        returned_value, output = self.Main(["-j", good, self.Path("broken.dcp")])
+        self.assertEqual(returned_value, 1)
+        reports = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([len(report["issues"]) for report in reports], [0, 1])
+
+    def test_chart(self):
+        dcp = coloric_dcp.CDcp()
+        dcp.Set("ColorMatrix1", np.eye(3))
+        dcp.Set("CalibrationIlluminant1", [23])
+        xyz = np.random.default_rng(4).uniform(0.05, 0.9, (10, 3))
+        WriteTi3(self.Path("chart.ti3"), xyz * [1.3, 1.0, 0.8], xyz)
+        profile = self.Saved(dcp)
+        returned_value, output = self.Main(["-t", self.Path("chart.ti3"), "-j", profile])
+        self.assertEqual(returned_value, 1)
+        self.assertIn("mean delta e", json.loads(output))
+        self.assertEqual(self.Main(["-t", self.Path("chart.ti3"), "-e", "100", profile])[0], 0)
+
+    def test_diff(self):
+        first = self.Saved(MakeProfile())
+        other = MakeProfile()
+        other.Set("ProfileName", "Other")
+        second = self.Saved(other, "other.dcp")
+        self.assertEqual(self.Main(["-d", first, first])[0], 0)
+        returned_value, output = self.Main(["-d", first, second])
+        self.assertEqual(returned_value, 1)
+        self.assertTrue(output.startswith("ProfileName"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,7 @@ try
 
 	"Installing Python modules..."
 	python -m pip install --upgrade pip
-	pip install --upgrade colormath Pillow
+	pip install --upgrade Pillow
 
 	"Downloading Argyll CMS and dcamprof..."
 	Invoke-WebRequest -Uri "https://www.argyllcms.com/Argyll_V${ARGYLL_VERSION}_win64_exe.zip" -OutFile "tmp\Argyll_V${ARGYLL_VERSION}_win64_exe.zip"